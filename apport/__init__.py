@@ -2,12 +2,40 @@ import sys
 import os
 import time
 
-from apport.report import Report
-
-from apport.packaging_impl import impl as packaging
-
-Report  # pyflakes
-packaging  # pyflakes
+# apport.Report and apport.packaging pull in the whole report machinery and
+# the packaging backend; import them on first use, so that programs which
+# only need the lightweight modules (like the core dump handler for crashes
+# which get ignored anyway) start fast.
+if sys.version_info >= (3, 5):
+    import types
+
+    class _LazyModule(types.ModuleType):
+        '''apport module which imports expensive attributes on first use.
+
+        These are properties instead of a module __getattr__(), as importing
+        the apport.packaging interface module sets the "packaging" attribute
+        of this package, which must keep pointing to the implementation.
+        '''
+        @property
+        def Report(self):
+            from apport.report import Report
+            return Report
+
+        @property
+        def packaging(self):
+            from apport.packaging_impl import impl
+            return impl
+
+        @packaging.setter
+        def packaging(self, value):
+            pass
+
+    sys.modules[__name__].__class__ = _LazyModule
+else:
+    from apport.report import Report
+    from apport.packaging_impl import impl as packaging
+    Report  # pyflakes
+    packaging  # pyflakes
 
 # fix gettext to output proper unicode strings
 import gettext
@@ -9,11 +9,12 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
-import os, os.path, sys, shutil
+import os, os.path, sys, shutil, json, threading
 
 try:
     from exceptions import Exception
     from urllib import quote_plus, urlopen
+    from Queue import Queue, Empty, Full
     URLError = IOError
     (quote_plus, urlopen)  # pyflakes
 except ImportError:
@@ -22,9 +23,22 @@ except ImportError:
     from urllib.parse import quote_plus
     from urllib.request import urlopen
     from urllib.error import URLError
+    from queue import Queue, Empty, Full
 
 import apport
 
+# fields which close_duplicate() copies to a master report which asks for a
+# better stack trace
+retrace_update_keys = ('Stacktrace', 'ThreadStacktrace', 'Package',
+                       'Dependencies', 'ProcMaps', 'ProcCmdline')
+
+# fields which check_duplicate() and check_duplicate_address_signature() look
+# at, including the ones they pass on to close_duplicate(); downloading just
+# these avoids fetching bulky attachments like CoreDump
+duplicate_check_keys = ('ProblemType', 'DuplicateSignature', 'ExecutablePath',
+                        'Signal', 'AssertionMessage', 'SourcePackage',
+                        'StacktraceTop', 'Traceback') + retrace_update_keys
+
 
 def _u(str):
     '''Convert str to an unicode if it isn't already.'''
@@ -84,7 +98,7 @@ class CrashDatabase:
         assert dbapi2.paramstyle == 'qmark', \
             'this module assumes qmark dbapi parameter style'
 
-        self.format_version = 3
+        self.format_version = 4
 
         init = not os.path.exists(path) or path == ':memory:' or \
             os.path.getsize(path) == 0
@@ -107,6 +121,8 @@ class CrashDatabase:
                 crash_id INTEGER NOT NULL,
                 CONSTRAINT address_signatures_pk PRIMARY KEY (signature))''')
 
+            self._duplicate_db_create_address_frames(cur)
+
             self.duplicate_db.commit()
 
         # verify integrity
@@ -143,13 +159,14 @@ class CrashDatabase:
         If the report does not have a valid crash signature, this function does
         nothing and just returns None.
 
-        By default, the report gets download()ed, but for performance reasons
-        it can be explicitly passed to this function if it is already available.
+        By default, the report gets download()ed (only the
+        duplicate_check_keys), but for performance reasons it can be explicitly
+        passed to this function if it is already available.
         '''
         assert self.duplicate_db, 'init_duplicate_db() needs to be called before'
 
         if not report:
-            report = self.download(id)
+            report = self.download(id, duplicate_check_keys)
 
         self._mark_dup_checked(id, report)
 
@@ -195,6 +212,11 @@ class CrashDatabase:
         addr_sig = report.crash_signature_addresses()
         if addr_sig:
             addr_match = self._duplicate_search_address_signature(addr_sig)
+            if addr_match is None and master_id is None and self.options.get('address_similarity'):
+                similar = self._duplicate_search_similar_address_signature(
+                    addr_sig, float(self.options['address_similarity']))
+                if similar and similar[0] != id:
+                    addr_match = similar[0]
             if addr_match and addr_match != master_id:
                 if master_id is None:
                     # we have a duplicate only identified by address sig, close it
@@ -232,6 +254,39 @@ class CrashDatabase:
 
         return None
 
+    def check_duplicate_address_signature(self, id, report):
+        '''Check whether a crash is a known duplicate by its address signature.
+
+        Unlike check_duplicate(), this only uses
+        Report.crash_signature_addresses(), which just needs ProcMaps and the
+        raw addresses in Stacktrace, but no debug symbols. Thus this can be
+        used to avoid retracing known crashes. If the "address_similarity"
+        option is set, similar address signatures are considered as well.
+
+        If the crash is known, it is closed as a duplicate and the function
+        returns the master ID. Otherwise, the database is not changed and the
+        function returns None.
+        '''
+        assert self.duplicate_db, 'init_duplicate_db() needs to be called before'
+
+        addr_sig = report.crash_signature_addresses()
+        if not addr_sig:
+            return None
+
+        master_id = self._duplicate_search_address_signature(addr_sig)
+        if master_id is None and self.options.get('address_similarity'):
+            similar = self._duplicate_search_similar_address_signature(
+                addr_sig, float(self.options['address_similarity']))
+            if similar:
+                master_id = similar[0]
+
+        if master_id is None or master_id == id:
+            return None
+
+        self._duplicate_db_add_address_signature(addr_sig, master_id)
+        self.close_duplicate(report, id, master_id)
+        return master_id
+
     def known(self, report):
         '''Check if the crash db already knows about the crash signature.
 
@@ -327,6 +382,7 @@ class CrashDatabase:
         cur = self.duplicate_db.cursor()
         cur.execute('DELETE FROM crashes WHERE crash_id = ?', [id])
         cur.execute('DELETE FROM address_signatures WHERE crash_id = ?', [id])
+        cur.execute('DELETE FROM address_frames WHERE crash_id = ?', [id])
         self.duplicate_db.commit()
 
     def duplicate_db_change_master_id(self, old_id, new_id):
@@ -339,6 +395,8 @@ class CrashDatabase:
                     [new_id, old_id])
         cur.execute('UPDATE address_signatures SET crash_id = ? WHERE crash_id = ?',
                     [new_id, old_id])
+        cur.execute('UPDATE OR REPLACE address_frames SET crash_id = ? WHERE crash_id = ?',
+                    [new_id, old_id])
         self.duplicate_db.commit()
 
     def duplicate_db_publish(self, dir):
@@ -419,6 +477,118 @@ class CrashDatabase:
         if os.path.exists(dir + '.old'):
             shutil.rmtree(dir + '.old')
 
+    def duplicate_db_export(self, file, since=None, batch_size=1000):
+        '''Write the duplicate database into a file-like object.
+
+        Every crash and address signature is written as a JSON record on a
+        separate line, fetching batch_size database rows at a time. The result
+        can be loaded into another database with duplicate_db_import().
+
+        If since is given (a "YYYY-MM-DD [HH:MM:SS]" timestamp), only crashes
+        whose last change happened at or after that time are exported, along
+        with their address signatures.
+
+        Return the number of written records.
+        '''
+        assert self.duplicate_db, 'init_duplicate_db() needs to be called before'
+
+        count = 0
+        cur = self.duplicate_db.cursor()
+
+        if since:
+            cur.execute('SELECT * FROM crashes WHERE last_change >= ?', [since])
+        else:
+            cur.execute('SELECT * FROM crashes')
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for (sig, id, ver, last_change) in rows:
+                file.write(json.dumps({'type': 'crash', 'signature': sig,
+                                       'id': id, 'fixed_version': ver,
+                                       'last_change': last_change}) + '\n')
+            count += len(rows)
+
+        if since:
+            cur.execute('''SELECT a.signature, a.crash_id FROM address_signatures a
+                           JOIN crashes c ON a.crash_id = c.crash_id
+                           WHERE c.last_change >= ?''', [since])
+        else:
+            cur.execute('SELECT * FROM address_signatures')
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for (sig, id) in rows:
+                file.write(json.dumps({'type': 'address', 'signature': sig,
+                                       'id': id}) + '\n')
+            count += len(rows)
+
+        return count
+
+    def duplicate_db_import(self, file, batch_size=1000):
+        '''Merge records from duplicate_db_export() into the duplicate database.
+
+        file is a file-like object or an iterable of lines. Records are
+        written in batches of batch_size, so that memory usage does not depend
+        on the size of the input.
+
+        Crashes which are not in the database yet get added. Existing crashes
+        are only updated if the imported record has a newer last change time
+        stamp. Existing address signatures are kept.
+
+        Return the number of read records. Raise ValueError on invalid
+        records.
+        '''
+        assert self.duplicate_db, 'init_duplicate_db() needs to be called before'
+
+        count = 0
+        crashes = []
+        addresses = []
+        cur = self.duplicate_db.cursor()
+
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if record['type'] == 'crash':
+                    crashes.append((record['signature'], int(record['id']),
+                                    record['fixed_version'], record['last_change']))
+                elif record['type'] == 'address':
+                    addresses.append((record['signature'], int(record['id'])))
+                else:
+                    raise ValueError('unknown record type %s' % record['type'])
+            except (KeyError, TypeError) as e:
+                raise ValueError('invalid duplicate DB record: %s (%s)' % (line, str(e)))
+            count += 1
+
+            if len(crashes) + len(addresses) >= batch_size:
+                self._duplicate_db_import_batch(cur, crashes, addresses)
+                crashes = []
+                addresses = []
+
+        self._duplicate_db_import_batch(cur, crashes, addresses)
+        self.duplicate_db.commit()
+        return count
+
+    def _duplicate_db_import_batch(self, cur, crashes, addresses):
+        '''Write a batch of imported records into the duplicate database.'''
+
+        if crashes:
+            cur.executemany('INSERT OR IGNORE INTO crashes VALUES (?, ?, ?, ?)', crashes)
+            cur.executemany('''UPDATE crashes SET signature = ?, fixed_version = ?, last_change = ?
+                               WHERE crash_id = ? AND (last_change IS NULL OR last_change < ?)''',
+                            [(sig, ver, last_change, id, last_change)
+                             for (sig, id, ver, last_change) in crashes
+                             if last_change is not None])
+        if addresses:
+            cur.executemany('INSERT OR IGNORE INTO address_signatures VALUES (?, ?)', addresses)
+            cur.executemany('INSERT OR IGNORE INTO address_frames VALUES (?, ?)',
+                            [(gram, id) for (sig, id) in addresses
+                             for gram in self.address_signature_grams(sig)])
+
     def _duplicate_db_upgrade(self, cur_format):
         '''Upgrade database to current format'''
 
@@ -429,6 +599,14 @@ class CrashDatabase:
 
         cur = self.duplicate_db.cursor()
 
+        # Format 4 added the address_frames index
+        if cur_format < 4:
+            self._duplicate_db_create_address_frames(cur)
+            cur.execute('SELECT * FROM address_signatures')
+            for (sig, id) in cur.fetchall():
+                self._duplicate_db_add_address_frames(cur, sig, id)
+            cur_format = 4
+
         cur.execute('UPDATE version SET format = ?', (cur_format,))
         self.duplicate_db.commit()
 
@@ -497,6 +675,36 @@ class CrashDatabase:
         else:
             return None
 
+    def _duplicate_search_similar_address_signature(self, sig, threshold,
+                                                    max_candidates=10):
+        '''Look up crash with a similar address signature.
+
+        This compares the frame n-grams of address_signature_grams() with the
+        ones of all known address signatures of the same executable and
+        signal. The similarity is the fraction of the signature's n-grams which
+        are also known for a crash. Only the max_candidates crashes with the
+        most shared n-grams are considered.
+
+        Return (crash_id, similarity) for the most similar crash with a
+        similarity of at least threshold (between 0 and 1), or None.
+        '''
+        grams = self.address_signature_grams(sig)
+        if not grams:
+            return None
+
+        cur = self.duplicate_db.cursor()
+        cur.execute('''SELECT crash_id, count(*) AS shared FROM address_frames
+                       WHERE gram IN (%s) GROUP BY crash_id
+                       ORDER BY shared DESC, crash_id LIMIT ?''' % ', '.join(['?'] * len(grams)),
+                    grams + [max_candidates])
+        for (id, shared) in cur.fetchall():
+            similarity = float(shared) / len(grams)
+            if similarity >= threshold:
+                return (id, similarity)
+            # results are sorted by decreasing number of shared grams
+            break
+        return None
+
     def _duplicate_db_dump(self, with_timestamps=False):
         '''Return the entire duplicate database as a dictionary.
 
@@ -566,8 +774,24 @@ class CrashDatabase:
         else:
             cur = self.duplicate_db.cursor()
             cur.execute('INSERT INTO address_signatures VALUES (?, ?)', (_u(sig), id))
+            self._duplicate_db_add_address_frames(cur, sig, id)
             self.duplicate_db.commit()
 
+    def _duplicate_db_create_address_frames(self, cur):
+        '''Create the address_frames table for similar address signatures.'''
+
+        cur.execute('''CREATE TABLE address_frames (
+            gram VARCHAR(1000) NOT NULL,
+            crash_id INTEGER NOT NULL,
+            CONSTRAINT address_frames_pk PRIMARY KEY (gram, crash_id))''')
+        cur.execute('CREATE INDEX address_frames_crash_id ON address_frames (crash_id)')
+
+    def _duplicate_db_add_address_frames(self, cur, sig, id):
+        '''Add the frame n-grams of an address signature to the index.'''
+
+        cur.executemany('INSERT OR IGNORE INTO address_frames VALUES (?, ?)',
+                        [(gram, id) for gram in self.address_signature_grams(sig)])
+
     def _duplicate_db_merge_id(self, dup, master):
         '''Merge two crash IDs.
 
@@ -580,6 +804,8 @@ class CrashDatabase:
         cur.execute('DELETE FROM crashes WHERE crash_id = ?', [dup])
         cur.execute('UPDATE address_signatures SET crash_id = ? WHERE crash_id = ?',
                     [master, dup])
+        cur.execute('UPDATE OR REPLACE address_frames SET crash_id = ? WHERE crash_id = ?',
+                    [master, dup])
         self.duplicate_db.commit()
 
     @classmethod
@@ -602,6 +828,47 @@ class CrashDatabase:
         i = i[:200]
         return i
 
+    @classmethod
+    def address_signature_frames(klass, sig):
+        '''Return the normalized frames of an address signature.
+
+        This returns an "ExecutablePath:Signal" prefix and a list of
+        "library+offset" frames. Library paths are reduced to their base name,
+        so that the same library in a different directory still matches.
+
+        Return None if sig is not a valid address signature.
+        '''
+        fields = _u(sig).split(':')
+        if len(fields) < 3:
+            return None
+        frames = []
+        for frame in fields[2:]:
+            try:
+                (lib, offset) = frame.rsplit('+', 1)
+            except ValueError:
+                return None
+            frames.append('%s+%s' % (lib.replace('..', ':').rsplit('/', 1)[-1], offset))
+        return (':'.join(fields[:2]), frames)
+
+    @classmethod
+    def address_signature_grams(klass, sig, n=3):
+        '''Return the n-grams of consecutive frames of an address signature.
+
+        Two signatures which only differ in one frame still share most of their
+        n-grams. Each n-gram includes the executable path and signal, so that
+        only crashes of the same program and signal are compared.
+        '''
+        parsed = klass.address_signature_frames(sig)
+        if not parsed:
+            return []
+        (prefix, frames) = parsed
+        grams = []
+        for i in range(max(1, len(frames) - n + 1)):
+            gram = '%s:%s' % (prefix, '|'.join(frames[i:i + n]))
+            if gram not in grams:
+                grams.append(gram)
+        return grams
+
     #
     # Abstract functions that need to be implemented by subclasses
     #
@@ -613,8 +880,10 @@ class CrashDatabase:
 
         If the implementation supports it, and a function progress_callback is
         passed, that is called repeatedly with two arguments: the number of
-        bytes already sent, and the total number of bytes to send. This can be
-        used to provide a proper upload progress indication on frontends.
+        bytes already sent, and the total number of bytes to send (None if
+        that is not known in advance, e. g. when streaming the report). This
+        can be used to provide a proper upload progress indication on
+        frontends.
 
         Implementations ought to "assert self.accepts(report)". The UI logic
         already prevents uploading a report to a database which does not accept
@@ -644,11 +913,85 @@ class CrashDatabase:
         '''
         raise NotImplementedError('this method must be implemented by a concrete subclass')
 
-    def download(self, id):
-        '''Download the problem report from given ID and return a Report.'''
+    def download(self, id, keys=None):
+        '''Download the problem report from given ID and return a Report.
 
+        If keys is given, only these fields need to be downloaded, e. g.
+        duplicate_check_keys for check_duplicate(). Implementations can still
+        return further fields which do not cost extra to get.
+        '''
         raise NotImplementedError('this method must be implemented by a concrete subclass')
 
+    def download_many(self, ids, keys=None):
+        '''Download the problem reports of given IDs.
+
+        keys selects the fields to download, like with download().
+
+        This is a generator of (id, report) pairs in the order in which the
+        reports arrive, which is not necessarily the order of ids. If a report
+        cannot be downloaded, the exception is given instead of the Report.
+
+        Implementations can fetch several reports at the same time (see
+        _download_concurrently()). This default implementation downloads one
+        after the other.
+        '''
+        for id in ids:
+            try:
+                report = self.download(id, keys)
+            except Exception as e:
+                report = e
+            yield (id, report)
+
+    def _download_concurrently(self, ids, download, jobs):
+        '''Generate (id, report) pairs from download(id) calls in jobs threads.
+
+        This implements download_many() for backends which can download in
+        parallel; download must be thread safe. At most jobs downloaded
+        reports wait for the consumer, so that memory usage stays bounded.
+
+        Exceptions from download() are given instead of the report, except
+        for ones which are not an Exception (like SystemExit), which are
+        re-raised.
+        '''
+        todo = Queue()
+        for id in ids:
+            todo.put(id)
+        count = todo.qsize()
+        results = Queue(jobs)
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    id = todo.get_nowait()
+                except Empty:
+                    return
+                try:
+                    report = download(id)
+                except BaseException as e:
+                    report = e
+                # wait for the consumer, unless it went away
+                while not stop.is_set():
+                    try:
+                        results.put((id, report), timeout=0.1)
+                        break
+                    except Full:
+                        pass
+
+        for i in range(min(jobs, count)):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        try:
+            for i in range(count):
+                (id, report) = results.get()
+                if isinstance(report, BaseException) and not isinstance(report, Exception):
+                    raise report
+                yield (id, report)
+        finally:
+            stop.set()
+
     def update(self, id, report, comment, change_description=False,
                attachment_comment=None, key_filter=None):
         '''Update the given report ID with all data from report.
@@ -814,7 +1157,9 @@ def get_crashdb(auth_file, name=None, conf=None):
       dictionaries. These need to have at least the key 'impl' (Python module
       in apport.crashdb_impl which contains a concrete 'CrashDatabase' class
       implementation for that crash db type). Other generally known options are
-      'bug_pattern_url', 'dupdb_url', and 'problem_types'.
+      'bug_pattern_url', 'dupdb_url', and 'problem_types'. If
+      'address_similarity' is set to a value between 0 and 1, check_duplicate()
+      also considers crashes with similar address signatures as duplicates.
     '''
     if not conf:
         conf = os.environ.get('APPORT_CRASHDB_CONF', '/etc/apport/crashdb.conf')
@@ -10,20 +10,18 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
-import tempfile, atexit, os.path, re, gzip, sys, email, time, shutil
+import tempfile, atexit, os.path, re, gzip, sys, email, random, shutil, threading
 
 from io import BytesIO
 
 if sys.version_info.major == 2:
-    from urllib2 import HTTPSHandler, Request, build_opener
-    from httplib import HTTPSConnection
-    from urllib import urlencode, urlopen
-    (HTTPSHandler, Request, build_opener, HTTPSConnection, urlencode, urlopen)  # pyflakes
+    from urllib2 import Request, urlopen
+    from urllib import urlencode
+    (Request, urlencode, urlopen)  # pyflakes
     _python2 = True
 else:
-    from urllib.request import HTTPSHandler, Request, build_opener, urlopen
+    from urllib.request import Request, urlopen
     from urllib.parse import urlencode
-    from http.client import HTTPSConnection
     _python2 = False
 
 try:
@@ -35,6 +33,7 @@ except ImportError:
     Launchpad = None
 
 import apport.crashdb
+import apport.resumable_upload
 import apport
 
 default_credentials_path = os.path.expanduser('~/.cache/apport/launchpad.credentials')
@@ -52,6 +51,27 @@ def filter_filename(attachments):
             yield f
 
 
+def _open_hosted_file(launchpad, url):
+    '''Open a Launchpad hosted file, like an attachment's data_link.
+
+    In contrast to HostedFile.open(), this does not read the whole content
+    into memory, but returns the response for reading it in blocks.
+    '''
+    headers = {}
+    launchpad.credentials.authorizeRequest(url, 'GET', None, headers)
+    return urlopen(Request(url, headers=headers))
+
+
+def _copy_blocks(src, dest):
+    '''Copy src file object to dest in blocks.'''
+
+    while True:
+        block = src.read(1048576)
+        if not block:
+            break
+        dest.write(block)
+
+
 def id_set(tasks):
     # same as set(int(i.bug.id) for i in tasks) but faster
     return set(int(i.self_link.split('/').pop()) for i in tasks)
@@ -120,6 +140,9 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
 
         self.__launchpad = None
         self.__lp_distro = None
+        # idle connections of download_many() workers
+        self.__download_connections = []
+        self.__download_connections_lock = threading.Lock()
         self.__lpcache = os.getenv('APPORT_LAUNCHPAD_CACHE', options.get('cache_dir'))
         if not self.__lpcache:
             # use a temporary dir
@@ -130,8 +153,12 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
     def launchpad(self):
         '''Return Launchpad instance.'''
 
-        if self.__launchpad:
-            return self.__launchpad
+        if not self.__launchpad:
+            self.__launchpad = self._connect()
+        return self.__launchpad
+
+    def _connect(self):
+        '''Return a new Launchpad connection.'''
 
         if Launchpad is None:
             sys.stderr.write('ERROR: The launchpadlib Python %s module is not installed. This functionality is not available.\n' % sys.version[0])
@@ -147,12 +174,12 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
             os.makedirs(auth_dir)
 
         try:
-            self.__launchpad = Launchpad.login_with('apport-collect',
-                                                    launchpad_instance,
-                                                    launchpadlib_dir=self.__lpcache,
-                                                    allow_access_levels=['WRITE_PRIVATE'],
-                                                    credentials_file=self.auth,
-                                                    version='1.0')
+            return Launchpad.login_with('apport-collect',
+                                        launchpad_instance,
+                                        launchpadlib_dir=self.__lpcache,
+                                        allow_access_levels=['WRITE_PRIVATE'],
+                                        credentials_file=self.auth,
+                                        version='1.0')
         except Exception as e:
             if hasattr(e, 'content'):
                 msg = e.content
@@ -161,8 +188,6 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
             apport.error('connecting to Launchpad failed: %s\nYou can reset the credentials by removing the file "%s"', msg, self.auth)
             sys.exit(99)  # transient error
 
-        return self.__launchpad
-
     def _get_distro_tasks(self, tasks):
         if not self.distro:
             raise StopIteration
@@ -193,12 +218,31 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
         passed, that is called repeatedly with two arguments: the number of
         bytes already sent, and the total number of bytes to send. This can be
         used to provide a proper upload progress indication on frontends.
+
+        For +storeblob, the MIME form of the report is first written into a
+        temporary file, so that the request has a Content-Length and the
+        progress has a total.
+
+        If the "upload_url" option is set, the report is sent there with the
+        resumable upload protocol of apport.resumable_upload instead of
+        +storeblob, which continues after connection failures. The report is
+        then streamed while its MIME form is generated, so that the total is
+        not known in advance and is passed as None. The server must return the
+        blob token in the X-Launchpad-Blob-Token header of the final response.
         '''
         assert self.accepts(report)
 
-        blob_file = self._generate_upload_blob(report)
-        ticket = upload_blob(blob_file, progress_callback, hostname=self.get_hostname())
-        blob_file.close()
+        if self.options.get('upload_url'):
+            blob = report.iter_mime(**self._upload_blob_options(report))
+            headers = apport.resumable_upload.upload(self.options['upload_url'], blob,
+                                                     progress_callback)
+            ticket = headers.get('X-Launchpad-Blob-Token')
+        else:
+            blob = self._generate_upload_blob(report)
+            try:
+                ticket = upload_blob(blob, progress_callback, hostname=self.get_hostname())
+            finally:
+                blob.close()
         assert ticket
         return ticket
 
@@ -257,11 +301,54 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
         '''
         return 'https://bugs.launchpad.net/bugs/' + str(id)
 
-    def download(self, id):
-        '''Download the problem report from given ID and return a Report.'''
+    def download(self, id, keys=None):
+        '''Download the problem report from given ID and return a Report.
+
+        If keys is given, only the attachments of these fields are downloaded;
+        the fields in the bug description are always present. A requested
+        CoreDump is then uncompressed straight into a file from
+        Report.new_core_spool(), and CoreDump is a file reference to it. Call
+        discard_core_spool() on the report to remove it.
+        '''
+        return self._download(self.launchpad, id, keys)
+
+    def download_many(self, ids, keys=None):
+        '''Download the problem reports of given IDs.
+
+        This downloads bugs and their attachments in parallel, over as many
+        Launchpad connections as the "download_jobs" option says (default: 4).
+        The connections are kept for further calls.
+        '''
+        # log in before starting threads, so that missing credentials are
+        # only asked for once
+        self.launchpad
+
+        def download(id):
+            launchpad = self._take_download_connection()
+            try:
+                return self._download(launchpad, id, keys)
+            finally:
+                with self.__download_connections_lock:
+                    self.__download_connections.append(launchpad)
+
+        return self._download_concurrently(ids, download, int(self.options.get('download_jobs', 4)))
+
+    def _take_download_connection(self):
+        '''Take an idle Launchpad connection for a download_many() worker.
+
+        If there is none, open a new one. Logins happen one at a time, as they
+        share the credentials file and launchpadlib cache directory.
+        '''
+        with self.__download_connections_lock:
+            if self.__download_connections:
+                return self.__download_connections.pop()
+            return self._connect()
+
+    def _download(self, launchpad, id, keys=None):
+        '''Download the problem report from given ID with given connection.'''
 
         report = apport.Report()
-        b = self.launchpad.bugs[id]
+        b = launchpad.bugs[id]
 
         # parse out fields from summary
         m = re.search(r'(ProblemType:.*)$', b.description, re.S)
@@ -315,7 +402,23 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
 
         report['Title'] = b.title
 
-        for attachment in filter_filename(b.attachments):
+        attachments = b.attachments
+        if keys is not None:
+            # decide by title, to not open (and thus download) the others
+            attachments = []
+            for attachment in b.attachments:
+                if os.path.splitext(attachment.title)[0] not in keys:
+                    continue
+                if attachment.title == 'CoreDump.gz':
+                    core = report.new_core_spool()
+                    if self._download_core(launchpad, attachment, core):
+                        report['CoreDump'] = (core,)
+                    else:
+                        report.discard_core_spool()
+                else:
+                    attachments.append(attachment)
+
+        for attachment in filter_filename(attachments):
             key, ext = os.path.splitext(attachment.filename)
             # ignore attachments with invalid keys
             try:
@@ -342,6 +445,35 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
                 raise Exception('Unknown attachment type: ' + attachment.filename)
         return report
 
+    def _download_core(self, launchpad, attachment, path):
+        '''Uncompress a CoreDump.gz attachment into given file.
+
+        Return False if the attachment is broken.
+        '''
+        with open(path, 'wb') as f:
+            for compressed in (True, False):
+                try:
+                    response = _open_hosted_file(launchpad, attachment.data_link)
+                except IOError as e:
+                    apport.error('Broken attachment on bug, ignoring: %s', str(e))
+                    return False
+                try:
+                    if compressed:
+                        _copy_blocks(gzip.GzipFile(fileobj=response), f)
+                    else:
+                        _copy_blocks(response, f)
+                    break
+                except IOError as e:
+                    # some attachments are only called .gz, but are
+                    # uncompressed (LP #574360)
+                    if not compressed or 'Not a gzip' not in str(e):
+                        raise
+                    f.seek(0)
+                    f.truncate()
+                finally:
+                    response.close()
+        return True
+
     def update(self, id, report, comment, change_description=False,
                attachment_comment=None, key_filter=None):
         '''Update the given report ID with all data from report.
@@ -726,8 +858,7 @@ Please continue to report any other bugs you may find.' % master_id,
             if report.has_useful_stacktrace() and ('apport-request-retrace' in master_tags or
                                                    'apport-failed-retrace' in master_tags):
                 self.update(master_id, report, 'Updated stack trace from duplicate bug %i' % id,
-                            key_filter=['Stacktrace', 'ThreadStacktrace',
-                                        'Package', 'Dependencies', 'ProcMaps', 'ProcCmdline'])
+                            key_filter=apport.crashdb.retrace_update_keys)
 
                 master = self.launchpad.bugs[master_id]
                 x = master.tags[:]  # LP#254901 workaround
@@ -936,6 +1067,17 @@ in a dependent package.' % master,
 
         You have to close the returned file object after you are done with it.
         '''
+        # write MIME/Multipart version into temporary file
+        mime = tempfile.TemporaryFile()
+        report.write_mime(mime, **self._upload_blob_options(report))
+        mime.flush()
+        mime.seek(0)
+
+        return mime
+
+    def _upload_blob_options(self, report):
+        '''Return write_mime()/iter_mime() arguments for uploading a report.'''
+
         # set reprocessing tags
         hdr = {}
         hdr['Tags'] = 'apport-%s' % report['ProblemType'].lower()
@@ -967,19 +1109,13 @@ in a dependent package.' % master,
         if 'CheckboxSubmission' in report:
             hdr['HWDB-Submission'] = report['CheckboxSubmission']
 
-        # order in which keys should appear in the temporary file
+        # order in which keys should appear in the MIME blob
         order = ['ProblemType', 'DistroRelease', 'Package', 'Regression', 'Reproducible',
                  'TestedUpstream', 'ProcVersionSignature', 'Uname', 'NonfreeKernelModules']
 
-        # write MIME/Multipart version into temporary file
-        mime = tempfile.TemporaryFile()
-        report.write_mime(mime, extra_headers=hdr,
-                          skip_keys=['Tags', 'LaunchpadPrivate', 'LaunchpadSubscribe'],
-                          priority_fields=order)
-        mime.flush()
-        mime.seek(0)
-
-        return mime
+        return {'extra_headers': hdr,
+                'skip_keys': ['Tags', 'LaunchpadPrivate', 'LaunchpadSubscribe'],
+                'priority_fields': order}
 
     @classmethod
     def _filter_tag_names(klass, tags):
@@ -1002,57 +1138,40 @@ in a dependent package.' % master,
 # Launchpad storeblob API (should go into launchpadlib, see LP #315358)
 #
 
-_https_upload_callback = None
-
+def _form_data_body(boundary, blocks, progress_callback, total):
+    '''Generate a multipart/form-data +storeblob request body.
 
-#
-# This progress code is based on KodakLoader by Jason Hildebrand
-# <jason@opensky.ca>. See http://www.opensky.ca/~jdhildeb/software/kodakloader/
-# for details.
-class HTTPSProgressConnection(HTTPSConnection):
-    '''Implement a HTTPSConnection with an optional callback function for
-    upload progress.'''
-
-    def send(self, data):
-        global _https_upload_callback
-
-        # if callback has not been set, call the old method
-        if not _https_upload_callback:
-            HTTPSConnection.send(self, data)
-            return
-
-        sent = 0
-        total = len(data)
-        chunksize = 1024
-        while sent < total:
-            _https_upload_callback(sent, total)
-            t1 = time.time()
-            HTTPSConnection.send(self, data[sent:(sent + chunksize)])
-            sent += chunksize
-            t2 = time.time()
-
-            # adjust chunksize so that it takes between .5 and 2
-            # seconds to send a chunk
-            if chunksize > 1024:
-                if t2 - t1 < .5:
-                    chunksize <<= 1
-                elif t2 - t1 > 2:
-                    chunksize >>= 1
-
-
-class HTTPSProgressHandler(HTTPSHandler):
-
-    def https_open(self, req):
-        return self.do_open(HTTPSProgressConnection, req)
+    The blob data blocks are wrapped into the field.blob form field as they
+    are consumed. progress_callback is called with the number of blob bytes
+    sent so far whenever the next block is requested.
+    '''
+    yield (b'--' + boundary + b'\r\n'
+           b'Content-Disposition: form-data; name="FORM_SUBMIT"\r\n\r\n'
+           b'1\r\n'
+           b'--' + boundary + b'\r\n'
+           b'Content-Type: application/octet-stream\r\n'
+           b'Content-Disposition: form-data; name="field.blob"; filename="x"\r\n\r\n')
+    sent = 0
+    for block in blocks:
+        if progress_callback:
+            progress_callback(sent, total)
+        yield block
+        sent += len(block)
+    if progress_callback:
+        progress_callback(sent, total)
+    yield b'\r\n--' + boundary + b'--\r\n'
 
 
 def upload_blob(blob, progress_callback=None, hostname='launchpad.net'):
-    '''Upload blob (file-like object) to Launchpad.
+    '''Upload blob to Launchpad.
+
+    blob can be a file-like object, or an iterable of bytes blocks like the
+    ProblemReport.iter_mime() generator. The latter is sent with chunked
+    transfer encoding while it is generated.
 
     progress_callback can be set to a function(sent, total) which is regularly
     called with the number of bytes already sent and total number of bytes to
-    send. It is called every 0.5 to 2 seconds (dynamically adapted to upload
-    bandwidth).
+    send. total is None if the size of the blob is not known in advance.
 
     Return None on error, or the ticket number on success.
 
@@ -1063,34 +1182,23 @@ def upload_blob(blob, progress_callback=None, hostname='launchpad.net'):
     ticket = None
     url = 'https://%s/+storeblob' % hostname
 
-    global _https_upload_callback
-    _https_upload_callback = progress_callback
-
-    # build the form-data multipart/MIME request
-    data = email.mime.multipart.MIMEMultipart()
-
-    submit = email.mime.text.MIMEText('1')
-    submit.add_header('Content-Disposition', 'form-data; name="FORM_SUBMIT"')
-    data.attach(submit)
-
-    form_blob = email.mime.base.MIMEBase('application', 'octet-stream')
-    form_blob.add_header('Content-Disposition', 'form-data; name="field.blob"; filename="x"')
-    form_blob.set_payload(blob.read().decode('ascii'))
-    data.attach(form_blob)
-
-    data_flat = BytesIO()
-    if sys.version_info.major == 2:
-        gen = email.generator.Generator(data_flat, mangle_from_=False)
-    else:
-        gen = email.generator.BytesGenerator(data_flat, mangle_from_=False)
-    gen.flatten(data)
+    (blocks, total) = apport.resumable_upload.blob_blocks(blob)
+    boundary = ('=' * 15 + '%i==' % random.randrange(sys.maxsize)).encode('ASCII')
+    body = _form_data_body(boundary, blocks, progress_callback, total)
 
     # do the request; we need to explicitly set the content type here, as it
     # defaults to x-www-form-urlencoded
-    req = Request(url, data_flat.getvalue())
-    req.add_header('Content-Type', 'multipart/form-data; boundary=' + data.get_boundary())
-    opener = build_opener(HTTPSProgressHandler)
-    result = opener.open(req)
+    if _python2:
+        # urllib2 cannot send iterables
+        body = b''.join(body)
+    req = Request(url, body)
+    req.add_header('Content-Type', 'multipart/form-data; boundary=' + boundary.decode())
+    if total is not None and not _python2:
+        # known size, so that no chunked transfer is needed; the form framing
+        # is what the body generator yields around an empty blob
+        framing = sum(len(b) for b in _form_data_body(boundary, [], None, None))
+        req.add_header('Content-Length', str(total + framing))
+    result = urlopen(req)
     ticket = result.info().get('X-Launchpad-Blob-Token')
 
     assert ticket
@@ -1103,7 +1211,7 @@ def upload_blob(blob, progress_callback=None, hostname='launchpad.net'):
 
 if __name__ == '__main__':
     import unittest, subprocess
-    from unittest.mock import patch
+    from unittest.mock import patch, Mock
 
     crashdb = None
     _segv_report = None
@@ -2022,4 +2130,63 @@ int main() { return f(42); }
 
             return pr
 
+    class _TDownload(unittest.TestCase):
+        '''download() with fake Launchpad objects, without network access'''
+
+        class FakeAttachment:
+            def __init__(self, title, data_link):
+                self.title = title
+                self.data_link = data_link
+
+            @property
+            def data(self):
+                raise AssertionError('attachment %s must not be opened' % self.title)
+
+        def download_core(self, data):
+            class Bug:
+                description = 'ProblemType: Crash\nArchitecture: amd64\nDistroRelease: Ubuntu 14.04'
+                tags = ['apport-crash']
+                title = 'crash crashed with SIGSEGV'
+                date_created = 'Thu Jan  1 00:00:00 2015'
+                attachments = [self.FakeAttachment('Stacktrace.txt', 'http://fake/1'),
+                               self.FakeAttachment('CoreDump.gz', 'http://fake/2')]
+
+            class Launchpad:
+                bugs = {1: Bug()}
+                credentials = Mock()
+
+            db = CrashDatabase('/nonexisting', {'distro': 'ubuntu', 'architecture': 'amd64'})
+            with patch(__name__ + '.urlopen', side_effect=lambda req: BytesIO(data)):
+                return db._download(Launchpad(), 1, ['CoreDump'])
+
+        def test_download_core(self):
+            '''download() of a compressed CoreDump into a spool file'''
+
+            core = b'\x7fELF' + b'\x01' * 10000
+            compressed = BytesIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as gz:
+                gz.write(core)
+
+            r = self.download_core(compressed.getvalue())
+            self.assertEqual(r['ProblemType'], 'Crash')
+            self.assertNotIn('Stacktrace', r)
+            path = r['CoreDump'][0]
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), core)
+            self.assertEqual(r.spool_core(), path)
+
+            r.discard_core_spool()
+            self.assertFalse(os.path.exists(path))
+
+        def test_download_core_uncompressed(self):
+            '''download() of a CoreDump.gz which is not compressed'''
+
+            core = b'\x7fELF' + b'\x02' * 10000
+            r = self.download_core(core)
+            path = r['CoreDump'][0]
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), core)
+            r.discard_core_spool()
+            self.assertFalse(os.path.exists(path))
+
     unittest.main()
@@ -68,11 +68,23 @@ class CrashDatabase(apport.crashdb.CrashDatabase):
         '''
         return self.get_comment_url(report, id)
 
-    def download(self, id):
-        '''Download the problem report from given ID and return a Report.'''
+    def download(self, id, keys=None):
+        '''Download the problem report from given ID and return a Report.
 
+        As all reports are in memory, keys is ignored and the whole report is
+        returned.
+        '''
         return self.reports[id]['report']
 
+    def download_many(self, ids, keys=None):
+        '''Download the problem reports of given IDs.
+
+        This uses as many threads as the "download_jobs" option says (default:
+        1, which keeps the order of ids).
+        '''
+        return self._download_concurrently(ids, lambda id: self.download(id, keys),
+                                           int(self.options.get('download_jobs', 1)))
+
     def get_affected_packages(self, id):
         '''Return list of affected source packages for given ID.'''
 
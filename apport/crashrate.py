@@ -0,0 +1,92 @@
+'''Per-program crash rate ledger for flood protection.
+
+This only uses the standard library, so that it is cheap to use from crash
+handlers.
+'''
+
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os, struct, tempfile, time
+
+# sliding window in seconds in which crashes are counted
+window = 24 * 3600
+
+# number of reports in the window after which further crashes of the same
+# program are dropped
+max_reports = 2
+
+# the ledger keeps the times of that many most recent reports
+max_records = 16
+
+_record = struct.Struct('<d')
+
+
+def ledger_path(report_dir, program, uid):
+    '''Return the ledger file path for a program path and user ID.'''
+
+    return os.path.join(report_dir, '%s.%i.crashrate' % (program.replace('/', '_'), uid))
+
+
+def _read(path, uid):
+    '''Return the list of report times in a ledger file.
+
+    Files which do not belong to uid or root are ignored.
+    '''
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return []
+    try:
+        if os.fstat(fd).st_uid not in (uid, 0):
+            return []
+        data = os.read(fd, _record.size * max_records)
+    finally:
+        os.close(fd)
+    return [_record.unpack_from(data, i)[0]
+            for i in range(0, len(data) - _record.size + 1, _record.size)]
+
+
+def recent_crashes(report_dir, program, uid, now=None):
+    '''Return the number of reports of program by uid in the last window.'''
+
+    if now is None:
+        now = time.time()
+    return len([t for t in _read(ledger_path(report_dir, program, uid), uid)
+                if now - window < t <= now])
+
+
+def record_crash(report_dir, program, uid, now=None):
+    '''Record a new report of program by uid.
+
+    The ledger file is replaced atomically. When running as root, it is
+    given to uid, so that crash handlers running as that user can update it.
+    Errors are ignored, as this must never break crash handling.
+    '''
+    if now is None:
+        now = time.time()
+    path = ledger_path(report_dir, program, uid)
+    times = [t for t in _read(path, uid) if now - window < t <= now]
+    times = (times + [now])[-max_records:]
+
+    try:
+        (fd, tmp) = tempfile.mkstemp(prefix='.crashrate', dir=report_dir)
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join([_record.pack(t) for t in times]))
+            os.fchmod(f.fileno(), 0o640)
+            if os.getuid() == 0 and uid != 0:
+                os.fchown(f.fileno(), uid, -1)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
@@ -9,7 +9,7 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
-import os, glob, subprocess, os.path, time, pwd, sys
+import os, glob, os.path, time, pwd, sys
 
 try:
     from configparser import ConfigParser, NoOptionError, NoSectionError
@@ -18,10 +18,6 @@ except ImportError:
     # Python 2
     from ConfigParser import ConfigParser, NoOptionError, NoSectionError
 
-from problem_report import ProblemReport
-
-from apport.packaging_impl import impl as packaging
-
 report_dir = os.environ.get('APPORT_REPORT_DIR', '/var/crash')
 
 _config_file = '~/.config/apport/settings'
@@ -44,6 +40,8 @@ def find_package_desktopfile(package):
     if package is None:
         return None
 
+    from apport.packaging_impl import impl as packaging
+
     desktopfile = None
 
     for line in packaging.get_files(package):
@@ -97,6 +95,7 @@ def find_file_package(file):
     if not likely_packaged(file):
         return None
 
+    from apport.packaging_impl import impl as packaging
     return packaging.get_file_package(file)
 
 
@@ -252,6 +251,8 @@ def get_recent_crashes(report):
     Return the number of recent crashes (currently, crashes which happened more
     than 24 hours ago are discarded).
     '''
+    from problem_report import ProblemReport
+
     pr = ProblemReport()
     pr.load(report, False, key_filter=['CrashCounter', 'Date'])
     try:
@@ -299,6 +300,8 @@ def check_files_md5(sumfile):
 
     Return a list of files that don't match.
     '''
+    import subprocess
+
     assert os.path.exists(sumfile)
     m = subprocess.Popen(['/usr/bin/md5sum', '-c', sumfile],
                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
@@ -348,6 +351,8 @@ def shared_libraries(path):
     Return a library name -> path mapping, for example 'libc.so.6' ->
     '/lib/x86_64-linux-gnu/libc.so.6'.
     '''
+    import subprocess
+
     libs = {}
 
     ldd = subprocess.Popen(['ldd', path], stdout=subprocess.PIPE,
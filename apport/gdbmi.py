@@ -0,0 +1,172 @@
+'''Minimal gdb/MI client for collecting structured crash data.'''
+
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import subprocess, re
+
+_escapes = {'n': b'\n', 't': b'\t', 'r': b'\r', '"': b'"', '\\': b'\\',
+            'a': b'\a', 'b': b'\b', 'f': b'\f', 'v': b'\v', 'e': b'\033'}
+
+_record_re = re.compile(r'^(\d*)\^(done|running|connected|error|exit),?(.*)$')
+
+
+def parse_cstring(s, pos=0):
+    '''Parse a gdb/MI C string starting at s[pos] (which must be '"').
+
+    Return (string, position after the closing quote).
+    '''
+    if s[pos] != '"':
+        raise ValueError('gdb/MI string expected at position %i: %s' % (pos, s))
+    pos += 1
+    out = bytearray()
+    while pos < len(s):
+        c = s[pos]
+        if c == '"':
+            return (out.decode('UTF-8', errors='replace'), pos + 1)
+        if c == '\\' and pos + 1 < len(s):
+            c = s[pos + 1]
+            if c in '01234567':
+                # octal escape of a raw byte
+                end = pos + 2
+                while end < len(s) and end < pos + 4 and s[end] in '01234567':
+                    end += 1
+                out.append(int(s[pos + 1:end], 8) & 0xFF)
+                pos = end
+            else:
+                out += _escapes.get(c, c.encode('UTF-8'))
+                pos += 2
+            continue
+        out += c.encode('UTF-8')
+        pos += 1
+    raise ValueError('unterminated gdb/MI string: ' + s)
+
+
+def parse_value(s, pos=0):
+    '''Parse a gdb/MI value starting at s[pos].
+
+    Strings are returned as str, tuples as dictionaries, and lists as Python
+    lists. For lists of results (like "[frame={...},frame={...}]") the names
+    are dropped.
+
+    Return (value, position after the value).
+    '''
+    c = s[pos]
+    if c == '"':
+        return parse_cstring(s, pos)
+    if c == '{':
+        return parse_results(s, pos + 1, '}')
+    if c == '[':
+        pos += 1
+        result = []
+        while s[pos] != ']':
+            if s[pos] not in '"{[':
+                # named result in a list; drop the name
+                pos = s.index('=', pos) + 1
+            (value, pos) = parse_value(s, pos)
+            result.append(value)
+            if s[pos] == ',':
+                pos += 1
+        return (result, pos + 1)
+    raise ValueError('invalid gdb/MI value at position %i: %s' % (pos, s))
+
+
+def parse_results(s, pos=0, end=None):
+    '''Parse comma separated gdb/MI "name=value" results starting at s[pos].
+
+    If end is given, parsing stops after that closing character, otherwise at
+    the end of the string.
+
+    Return (dictionary, position after the results).
+    '''
+    result = {}
+    while pos < len(s) and s[pos] != end:
+        eq = s.index('=', pos)
+        name = s[pos:eq]
+        (result[name], pos) = parse_value(s, eq + 1)
+        if pos < len(s) and s[pos] == ',':
+            pos += 1
+    if end is not None:
+        if pos >= len(s):
+            raise ValueError('missing "%s" in gdb/MI record: %s' % (end, s))
+        pos += 1
+    return (result, pos)
+
+
+class Session:
+    '''A running gdb process talking the machine interface.
+
+    Commands are sent one at a time; their textual console output and their
+    result record are collected until gdb reports completion. This allows
+    asking gdb for exactly the data that is needed, instead of parsing the
+    output of batch mode CLI commands.
+    '''
+
+    def __init__(self, gdb_command):
+        '''Start gdb from a command argv list (e.g. Report.gdb_command()).'''
+
+        self.gdb = subprocess.Popen(gdb_command + ['--interpreter=mi2', '-q'],
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+        self.token = 0
+
+    def command(self, cmd):
+        '''Run an MI command.
+
+        Return (success, results, console) with success being False if gdb
+        reported an ^error, results a dictionary of the result record, and
+        console the text gdb wrote to its console and log streams while
+        running the command (this includes startup output for the first
+        command).
+
+        Raise OSError if gdb terminates unexpectedly.
+        '''
+        self.token += 1
+        self.gdb.stdin.write(('%i%s\n' % (self.token, cmd)).encode('UTF-8'))
+        self.gdb.stdin.flush()
+
+        console = []
+        token = str(self.token)
+        while True:
+            line = self.gdb.stdout.readline()
+            if not line:
+                raise OSError('gdb terminated unexpectedly while running ' + cmd)
+            line = line.decode('UTF-8', errors='replace').rstrip('\r\n')
+            if line[:1] in ('~', '&'):
+                console.append(parse_cstring(line, 1)[0])
+                continue
+            m = _record_re.match(line)
+            if m and m.group(1) == token:
+                results = parse_results(m.group(3))[0]
+                return (m.group(2) != 'error', results, ''.join(console))
+            if not line.startswith(('(gdb)', '=', '*', '@', '^')):
+                # raw output from gdb or the inferior not using a stream
+                console.append(line + '\n')
+
+    def console(self, cmd):
+        '''Run a CLI command and return its console output.
+
+        Return None if the command failed.
+        '''
+        (ok, results, out) = self.command('-interpreter-exec console "%s"' %
+                                          cmd.replace('\\', '\\\\').replace('"', '\\"'))
+        if not ok:
+            return None
+        return out
+
+    def close(self):
+        '''Terminate gdb.'''
+
+        try:
+            self.gdb.stdin.write(b'-gdb-exit\n')
+            self.gdb.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.gdb.stdout.close()
+        self.gdb.wait()
@@ -24,6 +24,10 @@ import base64
 import tempfile
 import shutil
 import locale
+import collections
+import threading
+import signal
+import copy
 
 from apport.packaging_impl import impl as packaging
 
@@ -32,6 +36,71 @@ import apport.fileutils
 
 _invalid_key_chars_re = re.compile(r'[^0-9a-zA-Z_.-]')
 
+# (function name, arguments) -> result of host-invariant probes like DMI or
+# lspci; see _session_cached()
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+_session_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _session_cached(function, *args):
+    '''Call function(*args), or return the result of an earlier call.
+
+    This is for probes of the hardware which many hooks need, and which do
+    not change while collecting information for one or more reports (e. g. in
+    whoopsie-upload-all). Do not use it for changing data like dmesg, loaded
+    modules, or package versions, as later reports would get outdated
+    information. Results are kept until clear_session_cache(). Callers get a
+    copy, so that they can modify it.
+    '''
+    key = _session_cache_key(function, *args)
+    result = _session_cache_get(key)
+    if result is None:
+        result = function(*args)
+        _session_cache_set(key, result)
+        result = copy.copy(result)
+    return result
+
+
+def _session_cache_key(function, *args):
+    return (function.__name__, repr(args))
+
+
+def _session_cache_get(key):
+    '''Return a copy of a cached result, or None if there is none.'''
+
+    with _session_cache_lock:
+        if key in _session_cache:
+            _session_cache_stats['hits'] += 1
+            return copy.copy(_session_cache[key])
+        _session_cache_stats['misses'] += 1
+    return None
+
+
+def _session_cache_set(key, result):
+    with _session_cache_lock:
+        _session_cache[key] = result
+
+
+def clear_session_cache():
+    '''Forget cached results of system probes.
+
+    attach_dmi(), pci_devices(), and the lspci output of attach_hardware()
+    only query the hardware once per process, and return the same
+    information for all following reports. Call this when the hardware might
+    have changed since, e. g. after plugging in a PCI device.
+    '''
+    with _session_cache_lock:
+        _session_cache.clear()
+
+
+def session_cache_stats():
+    '''Return a human readable summary of the system probe cache usage.'''
+
+    with _session_cache_lock:
+        return 'hookutils session cache: %i hits, %i misses, %i entries' % (
+            _session_cache_stats['hits'], _session_cache_stats['misses'], len(_session_cache))
+
 
 def path_to_key(path):
     '''Generate a valid report key name from a file path.
@@ -205,6 +274,13 @@ def attach_dmesg(report):
 
 
 def attach_dmi(report):
+    report.update(_session_cached(_dmi_info))
+
+
+def _dmi_info():
+    '''Return a report key -> value map of world readable DMI fields.'''
+
+    info = {}
     dmi_dir = '/sys/class/dmi/id'
     if os.path.isdir(dmi_dir):
         for f in os.listdir(dmi_dir):
@@ -222,7 +298,8 @@ def attach_dmi(report):
             except (OSError, IOError):
                 continue
             if value:
-                report['dmi.' + f.replace('_', '.')] = value
+                info['dmi.' + f.replace('_', '.')] = value
+    return info
 
 
 def attach_hardware(report):
@@ -240,18 +317,42 @@ def attach_hardware(report):
     - prtconf (sparc)
     - pccardctl status/ident
     '''
-    attach_dmesg(report)
+    commands = {
+        'Lsusb': ['lsusb'],
+        'ProcModules': ['sort', '/proc/modules'],
+        'UdevDb': ['udevadm', 'info', '--export-db'],
+    }
+    if not report.get('CurrentDmesg', '').strip():
+        commands['CurrentDmesg'] = ['dmesg']
+    if command_available('prtconf'):
+        commands['Prtconf'] = ['prtconf']
+    if command_available('pccardctl'):
+        commands['PccardctlStatus'] = ['pccardctl', 'status']
+        commands['PccardctlIdent'] = ['pccardctl', 'ident']
+    have_pci = os.path.exists('/sys/bus/pci')
+    if have_pci:
+        # same as pci_devices(), but on a cache miss lspci runs together with
+        # the other commands
+        lspci_key = _session_cache_key(command_outputs, _pci_commands)
+        lspci = _session_cache_get(lspci_key)
+        if lspci is None:
+            commands.update(_pci_commands)
+    outputs = command_outputs(commands)
+    if have_pci:
+        if lspci is None:
+            lspci = dict((k, outputs.pop(k)) for k in _pci_commands)
+            _session_cache_set(lspci_key, lspci)
+        outputs['Lspci'] = lspci['lspci -vvnn']
+
+    for key in ('PccardctlStatus', 'PccardctlIdent'):
+        if key in outputs and not outputs[key].strip():
+            del outputs[key]
+    report.update(outputs)
 
     attach_file(report, '/proc/interrupts', 'ProcInterrupts')
     attach_file(report, '/proc/cpuinfo', 'ProcCpuinfo')
     attach_file(report, '/proc/cmdline', 'ProcKernelCmdLine')
 
-    if os.path.exists('/sys/bus/pci'):
-        report['Lspci'] = command_output(['lspci', '-vvnn'])
-    report['Lsusb'] = command_output(['lsusb'])
-    report['ProcModules'] = command_output(['sort', '/proc/modules'])
-    report['UdevDb'] = command_output(['udevadm', 'info', '--export-db'])
-
     # anonymize partition labels
     labels = report['UdevDb']
     labels = re.sub('ID_FS_LABEL=(.*)', 'ID_FS_LABEL=<hidden>', labels)
@@ -269,17 +370,6 @@ def attach_hardware(report):
         report['MachineType'] = '%s %s' % (report['dmi.sys.vendor'],
                                            report['dmi.product.name'])
 
-    if command_available('prtconf'):
-        report['Prtconf'] = command_output(['prtconf'])
-
-    if command_available('pccardctl'):
-        out = command_output(['pccardctl', 'status']).strip()
-        if out:
-            report['PccardctlStatus'] = out
-        out = command_output(['pccardctl', 'ident']).strip()
-        if out:
-            report['PccardctlIdent'] = out
-
 
 def attach_alsa_old(report):
     ''' (loosely based on http://www.alsa-project.org/alsa-info.sh)
@@ -391,6 +481,110 @@ def command_output(command, input=None, stderr=subprocess.STDOUT,
     return res
 
 
+# run commands in their own process group, so that they can be killed with
+# all their children; preexec_fn is not safe with threads, so only use it
+# where Python does not have start_new_session
+if sys.version_info.major == 2:
+    _new_process_group = {'preexec_fn': os.setpgrp}
+else:
+    _new_process_group = {'start_new_session': True}
+
+
+class _CommandJob(threading.Thread):
+    '''Read the output of a running command, up to a size limit.'''
+
+    def __init__(self, process, max_bytes):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.process = process
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.truncated = False
+        self.timed_out = False
+
+    def run(self):
+        size = 0
+        while True:
+            data = self.process.stdout.read(65536)
+            if not data:
+                break
+            if self.max_bytes is not None and size + len(data) > self.max_bytes:
+                self.chunks.append(data[:self.max_bytes - size])
+                self.truncated = True
+                self.kill()
+                break
+            self.chunks.append(data)
+            size += len(data)
+        self.process.stdout.close()
+        self.process.wait()
+
+    def kill(self):
+        '''Kill the command, including any subprocesses it started.'''
+
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def command_outputs(command_map, timeout=30, max_bytes=10000000,
+                    keep_locale=False, decode_utf8=True):
+    '''Execute multiple commands concurrently and return their outputs.
+
+    command_map is a keyname -> command (list) dictionary. All commands are
+    started at once, so that the total time is bounded by the slowest one
+    instead of the sum of all. Commands which are still running after timeout
+    seconds get killed, and their output is cut off after max_bytes bytes.
+
+    Return a keyname -> output dictionary. Like with command_output(), the
+    outputs of failed or timed out commands are a textual error.
+    '''
+    env = os.environ.copy()
+    if not keep_locale:
+        env['LC_MESSAGES'] = 'C'
+
+    jobs = {}
+    result = {}
+    for (key, command) in command_map.items():
+        try:
+            sp = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, env=env,
+                                  **_new_process_group)
+        except OSError as e:
+            result[key] = 'Error: ' + str(e)
+            continue
+        jobs[key] = _CommandJob(sp, max_bytes)
+        jobs[key].start()
+
+    deadline = time.time() + timeout
+    for job in jobs.values():
+        job.join(max(0, deadline - time.time()))
+        if job.is_alive():
+            job.timed_out = True
+            job.kill()
+            # don't hang on processes which escaped from the process group
+            # and still keep the output pipe open
+            job.join(1)
+
+    for (key, job) in jobs.items():
+        out = b''.join(job.chunks)
+        if job.timed_out:
+            res = (b'Error: command ' + str(command_map[key]).encode() +
+                   b' timed out after ' + str(timeout).encode() + b' seconds: ' + out)
+        elif job.truncated:
+            res = out.strip() + b'\n[output truncated after ' + str(max_bytes).encode() + b' bytes]'
+        elif job.process.returncode == 0:
+            res = out.strip()
+        else:
+            res = (b'Error: command ' + str(command_map[key]).encode() + b' failed with exit code ' +
+                   str(job.process.returncode).encode() + b': ' + out)
+        if decode_utf8:
+            res = res.decode('UTF-8', errors='replace')
+        result[key] = res
+
+    return result
+
+
 def _root_command_prefix():
     if os.getuid() == 0:
         return []
@@ -466,37 +660,80 @@ def attach_root_command_outputs(report, command_map):
         shutil.rmtree(workdir)
 
 
-def __filter_re_process(pattern, process):
-    lines = ''
-    while process.poll() is None:
-        for line in process.stdout:
-            line = line.decode('UTF-8', errors='replace')
-            if pattern.search(line):
-                lines += line
+def __filter_re_process(pattern, process, max_lines=None, max_bytes=None, reverse=False):
+    '''Return the lines of a process' output which match a regex.
+
+    The output is read as a stream. If max_lines or max_bytes are given, at
+    most that many matching lines or bytes are kept: the last ones, or if
+    reverse is True (the process writes the newest lines first), the first
+    ones, in which case reading stops as soon as the budget is reached. The
+    result is always in chronological order.
+    '''
+    lines = collections.deque()
+    size = 0
+    stopped = False
+    for line in process.stdout:
+        if not pattern.search(line.decode('UTF-8', errors='replace')):
+            continue
+        lines.append(line)
+        size += len(line)
+        while lines and ((max_lines is not None and len(lines) > max_lines) or
+                         (max_bytes is not None and size > max_bytes)):
+            if reverse:
+                size -= len(lines.pop())
+                stopped = True
+            else:
+                size -= len(lines.popleft())
+        if stopped:
+            process.terminate()
+            break
     process.stdout.close()
     process.wait()
-    if process.returncode == 0:
-        return lines
-    return ''
+    if process.returncode != 0 and not stopped:
+        return ''
+    if reverse:
+        lines.reverse()
+    return b''.join(lines).decode('UTF-8', errors='replace')
 
 
-def recent_syslog(pattern, path=None):
+def recent_syslog(pattern, path=None, since=None, units=None, identifiers=None,
+                  max_lines=10000, max_bytes=1000000):
     '''Extract recent system messages which match a regex.
 
     pattern should be a "re" object. By default, messages are read from
     the systemd journal, or /var/log/syslog; but when giving "path", messages
     are read from there instead.
+
+    For the journal, the messages can be restricted further by systemd units
+    (list of names for journalctl -u), syslog identifiers (list of names for
+    journalctl -t), and a start time ("since", in any format that journalctl
+    --since understands, like "-1h"). These are much cheaper than filtering
+    with the regex, so use them when possible.
+
+    At most the newest max_lines matching lines, and max_bytes bytes, are
+    returned. The journal is read from the newest messages backwards, and
+    reading stops as soon as either limit is reached.
     '''
+    reverse = False
     if path:
         p = subprocess.Popen(['tail', '-n', '10000', path],
                              stdout=subprocess.PIPE)
     elif os.path.exists('/run/systemd/system'):
-        p = subprocess.Popen(['journalctl', '--system', '--quiet', '-b', '-a'],
-                             stdout=subprocess.PIPE)
+        argv = ['journalctl', '--system', '--quiet', '-b', '-a', '--reverse']
+        if since:
+            argv += ['--since', since]
+        for unit in units or []:
+            argv += ['-u', unit]
+        for identifier in identifiers or []:
+            argv += ['-t', identifier]
+        p = subprocess.Popen(argv, stdout=subprocess.PIPE)
+        reverse = True
     elif os.access('/var/log/syslog', os.R_OK):
         p = subprocess.Popen(['tail', '-n', '10000', '/var/log/syslog'],
                              stdout=subprocess.PIPE)
-    return __filter_re_process(pattern, p)
+    else:
+        return ''
+    return __filter_re_process(pattern, p, max_lines, max_bytes, reverse)
 
 
 def xsession_errors(pattern=None):
@@ -539,15 +776,33 @@ PCI_PROCESSORS = 0x0b
 PCI_SERIAL_BUS = 0x0c
 
 
+# commands which pci_devices() needs to filter devices by class
+_pci_commands = {
+    'lspci -vvmmnn': ['lspci', '-vvmmnn'],
+    'lspci -vvnn': ['lspci', '-vvnn'],
+}
+
+
 def pci_devices(*pci_classes):
     '''Return a text dump of PCI devices attached to the system.'''
 
+    outputs = _session_cached(command_outputs, _pci_commands)
     if not pci_classes:
-        return command_output(['lspci', '-vvnn'])
+        return outputs['lspci -vvnn']
+
+    return _filter_pci_devices(outputs, pci_classes)
+
 
-    result = ''
-    output = command_output(['lspci', '-vvmmnn'])
-    for paragraph in output.split('\n\n'):
+def _filter_pci_devices(outputs, pci_classes):
+    '''Filter lspci output by device class.
+
+    outputs must contain the outputs of _pci_commands. The machine readable
+    output determines the slots of devices with matching classes, and their
+    verbose descriptions are taken from the full lspci output, so that this
+    does not need to call lspci for every device.
+    '''
+    slots = []
+    for paragraph in outputs['lspci -vvmmnn'].split('\n\n'):
         pci_class = None
         slot = None
 
@@ -565,11 +820,13 @@ def pci_devices(*pci_classes):
                 slot = value
 
         if pci_class and slot and pci_class in pci_classes:
-            if result:
-                result += '\n\n'
-            result += command_output(['lspci', '-vvnns', slot]).strip()
+            slots.append(slot)
 
-    return result
+    devices = {}
+    for paragraph in outputs['lspci -vvnn'].split('\n\n'):
+        devices[paragraph.split(' ', 1)[0]] = paragraph.strip()
+
+    return '\n\n'.join([devices[slot] for slot in slots if slot in devices])
 
 
 def usb_devices():
@@ -641,8 +898,7 @@ def attach_gsettings_package(report, package):
 def attach_network(report):
     '''Attach generic network-related information to report.'''
 
-    report['IpRoute'] = command_output(['ip', 'route'])
-    report['IpAddr'] = command_output(['ip', 'addr'])
+    report.update(command_outputs({'IpRoute': ['ip', 'route'], 'IpAddr': ['ip', 'addr']}))
     report['PciNetwork'] = pci_devices(PCI_NETWORK)
     attach_file_if_exists(report, '/etc/network/interfaces', key='IfupdownConfig')
 
@@ -654,7 +910,8 @@ def attach_network(report):
 def attach_wifi(report):
     '''Attach wireless (WiFi) network information to report.'''
 
-    report['WifiSyslog'] = recent_syslog(re.compile(r'(NetworkManager|modem-manager|dhclient|kernel|wpa_supplicant)(\[\d+\])?:'))
+    report['WifiSyslog'] = recent_syslog(re.compile(r'(NetworkManager|modem-manager|dhclient|kernel|wpa_supplicant)(\[\d+\])?:'),
+                                         identifiers=['NetworkManager', 'modem-manager', 'dhclient', 'kernel', 'wpa_supplicant'])
     report['IwConfig'] = re.sub(
         'ESSID:(.*)', 'ESSID:<hidden>',
         re.sub('Encryption key:(.*)', 'Encryption key: <hidden>',
@@ -0,0 +1,60 @@
+'''Fast address lookups in memory mappings, as in /proc/pid/maps.'''
+
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import bisect
+
+
+class VMAIndex:
+    '''Sorted index of memory mappings.
+
+    This is built once from a list of (start, end, data) tuples, where data
+    is an arbitrary value describing the mapping (such as the ELF path).
+    Lookups use binary search, so that resolving stack addresses of processes
+    with lots of mappings does not need to scan all of them.
+
+    Mappings must not overlap, which is always the case for
+    /proc/pid/maps.
+    '''
+
+    def __init__(self, vmas):
+        '''Build index from an iterable of (start, end, data) tuples.'''
+
+        self.vmas = sorted(vmas, key=lambda vma: vma[0])
+        self.starts = [vma[0] for vma in self.vmas]
+
+    def __len__(self):
+        return len(self.vmas)
+
+    def find(self, addr, inclusive_end=False):
+        '''Return the (start, end, data) tuple of the mapping containing addr.
+
+        By default mappings cover the address range [start, end). If
+        inclusive_end is True, end is considered part of the mapping as well;
+        if it is also the start of the next mapping, the lower mapping wins.
+
+        Return None if addr is not in any mapping.
+        '''
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if inclusive_end and i > 0 and self.vmas[i - 1][1] == addr:
+            return self.vmas[i - 1]
+        if i < 0:
+            return None
+        vma = self.vmas[i]
+        if addr < vma[1] or (inclusive_end and addr == vma[1]):
+            return vma
+        return None
+
+    def find_all(self, addrs, inclusive_end=False):
+        '''Resolve a sequence of addresses in one call.
+
+        Return a list with the result of find() for each address, in the
+        same order.
+        '''
+        return [self.find(addr, inclusive_end) for addr in addrs]
@@ -10,24 +10,18 @@
 # the full text of the license.
 
 import subprocess, tempfile, os.path, re, pwd, grp, os, time
-import fnmatch, glob, traceback, errno, sys, atexit, locale, imp
+import fnmatch, glob, traceback, errno, sys, atexit, locale, imp, shutil
+import threading, copy, itertools
 
-import xml.dom, xml.dom.minidom
-from xml.parsers.expat import ExpatError
+import xml.dom
 
-if sys.version > '3':
-    _python2 = False
-    from urllib.error import URLError
-    from urllib.request import urlopen
-    (urlopen, URLError)  # pyflakes
-else:
-    _python2 = True
-    from urllib import urlopen
-    URLError = IOError
+_python2 = sys.version < '3'
 
 import problem_report
 import apport
 import apport.fileutils
+import apport.gdbmi
+from apport.procmaps import VMAIndex
 from apport.packaging_impl import impl as packaging
 
 _data_dir = os.environ.get('APPORT_DATA_DIR', '/usr/share/apport')
@@ -35,6 +29,9 @@ _hook_dir = '%s/package-hooks/' % (_data_dir)
 _common_hook_dir = '%s/general-hooks/' % (_data_dir)
 _opt_dir = '/opt'
 
+# directory for unpacked core dumps; point this to a tmpfs to avoid disk I/O
+_core_spool_dir = os.environ.get('APPORT_CORE_SPOOL_DIR')
+
 # path of the ignore file
 _ignore_file = '~/.apport-ignore.xml'
 
@@ -42,6 +39,32 @@ _ignore_file = '~/.apport-ignore.xml'
 _blacklist_dir = '/etc/apport/blacklist.d'
 _whitelist_dir = '/etc/apport/whitelist.d'
 
+# path -> cached contents of black/whitelist dirs and ignore file
+_ignore_cache = {}
+
+# bug pattern URL -> (ETag, Last-Modified, document, _BugPatterns)
+_bug_pattern_cache = {}
+
+# hook path -> ((inode, size, mtime), namespace of the executed hook)
+_hook_cache = {}
+
+# hook directory -> ((inode, size, mtime), sorted list of hook paths)
+_hook_dir_cache = {}
+
+# maximum run time of a general hook in seconds; time spent waiting for
+# answers to interactive questions does not count
+_general_hook_timeout = 60
+
+# package information is cached until the package database status changes
+_package_status_file = '/var/lib/dpkg/status'
+
+# [status file validator, {(function name, package): (time, result, error)}]
+_package_info_cache = [None, {}]
+
+# modified files do not change the package status; maximum age of cached
+# results in seconds
+_modified_files_max_age = 60
+
 # programs that we consider interpreters
 interpreters = ['sh', 'bash', 'dash', 'csh', 'tcsh', 'python*',
                 'ruby*', 'php', 'perl*', 'mono*', 'awk']
@@ -51,14 +74,50 @@ interpreters = ['sh', 'bash', 'dash', 'csh', 'tcsh', 'python*',
 #
 
 
+def _package_info(function, package):
+    '''Call packaging.<function>(package), with caching.
+
+    Results (and ValueErrors) are kept until the package status file changes;
+    thus reports for several crashes of the same program do not need to query
+    the packaging system again. Results of get_modified_files() additionally
+    expire after _modified_files_max_age seconds.
+    '''
+    try:
+        validator = _file_validator(_package_status_file)
+    except OSError:
+        return getattr(packaging, function)(package)
+
+    if _package_info_cache[0] != validator:
+        _package_info_cache[0] = validator
+        _package_info_cache[1] = {}
+    cache = _package_info_cache[1]
+
+    now = time.time()
+    cached = cache.get((function, package))
+    if cached and (function != 'get_modified_files' or
+                   now - cached[0] < _modified_files_max_age):
+        (t, result, error) = cached
+    else:
+        result = error = None
+        try:
+            result = getattr(packaging, function)(package)
+        except ValueError as e:
+            error = e
+        cache[(function, package)] = (now, result, error)
+
+    if error is not None:
+        raise error
+    return result
+
+
 def _transitive_dependencies(package, depends_set):
     '''Recursively add dependencies of package to depends_set.'''
 
     try:
-        packaging.get_version(package)
+        _package_info('get_version', package)
     except ValueError:
         return
-    for d in packaging.get_dependencies(package):
+    for d in _package_info('get_dependencies', package):
         if d not in depends_set:
             depends_set.add(d)
             _transitive_dependencies(d, depends_set)
@@ -112,67 +171,325 @@ def _command_output(command, input=None):
             str(command), sp.returncode, out))
 
 
-def _check_bug_pattern(report, pattern):
-    '''Check if given report matches the given bug pattern XML DOM node.
+class _BugPatterns:
+    '''Compiled bug pattern document.
 
-    Return the bug URL on match, otherwise None.
+    The XML document is parsed once, and all regular expressions are compiled
+    on first use and kept. Patterns are indexed by their first required report
+    key, so that checking a report only looks at the patterns whose keys the
+    report actually has.
     '''
-    if _python2:
-        if not pattern.attributes.has_key('url'):
-            return None
-    else:
-        if 'url' not in pattern.attributes:
-            return None
 
-    for c in pattern.childNodes:
-        # regular expression condition
-        if c.nodeType == xml.dom.Node.ELEMENT_NODE and c.nodeName == 're':
-            try:
-                key = c.attributes['key'].nodeValue
-            except KeyError:
+    def __init__(self, patterns):
+        '''Parse given bug pattern XML string.
+
+        Raise ValueError if it is not valid XML.
+        '''
+        import xml.dom.minidom
+        from xml.parsers.expat import ExpatError
+
+        try:
+            if _python2:
+                patterns = patterns.encode('UTF-8')
+            dom = xml.dom.minidom.parseString(patterns)
+        except (ExpatError, UnicodeEncodeError) as e:
+            raise ValueError('invalid bug patterns: ' + str(e))
+
+        # list of (bug URL, required keys, [(key, regexp), ...]), in document
+        # order
+        self.patterns = []
+        # first required key -> list of indexes into self.patterns
+        self.index = {}
+        # indexes of patterns which do not require any key
+        self.unconditional = []
+        # (regexp, binary) -> compiled RE, or None if it is invalid
+        self._re_cache = {}
+
+        for pattern in dom.getElementsByTagName('pattern'):
+            if not pattern.hasAttribute('url'):
                 continue
-            if key not in report:
-                return None
-            c.normalize()
-            if c.hasChildNodes() and c.childNodes[0].nodeType == xml.dom.Node.TEXT_NODE:
-                regexp = c.childNodes[0].nodeValue
-                if _python2:
-                    regexp = regexp.encode('UTF-8')
-                v = report[key]
-                if isinstance(v, problem_report.CompressedValue):
-                    v = v.get_value()
-                    if not _python2:
-                        regexp = regexp.encode('UTF-8')
-                elif isinstance(v, bytes):
-                    if not _python2:
-                        regexp = regexp.encode('UTF-8')
-                try:
-                    re_c = re.compile(regexp)
-                except:
+            url = pattern.getAttribute('url')
+            if _python2:
+                url = url.encode('UTF-8')
+
+            keys = []
+            conditions = []
+            for c in pattern.childNodes:
+                if c.nodeType != xml.dom.Node.ELEMENT_NODE or c.nodeName != 're':
                     continue
-                if not re_c.search(v):
-                    return None
+                if not c.hasAttribute('key'):
+                    continue
+                key = c.getAttribute('key')
+                if key not in keys:
+                    keys.append(key)
+                c.normalize()
+                if c.hasChildNodes() and c.childNodes[0].nodeType == xml.dom.Node.TEXT_NODE:
+                    conditions.append((key, c.childNodes[0].nodeValue))
+
+            idx = len(self.patterns)
+            self.patterns.append((url, keys, conditions))
+            if keys:
+                self.index.setdefault(keys[0], []).append(idx)
+            else:
+                self.unconditional.append(idx)
+
+        dom.unlink()
+
+    def _compile(self, regexp, binary):
+        '''Return compiled regexp for str or bytes values.
 
+        Return None if the expression is invalid.
+        '''
+        try:
+            return self._re_cache[(regexp, binary)]
+        except KeyError:
+            pass
+
+        try:
+            if binary:
+                re_c = re.compile(regexp.encode('UTF-8'))
+            else:
+                re_c = re.compile(regexp)
+        except re.error:
+            re_c = None
+        self._re_cache[(regexp, binary)] = re_c
+        return re_c
+
+    def match(self, report):
+        '''Check given report against all patterns.
+
+        Return the bug URL of the first matching pattern, or None.
+        '''
+        candidates = list(self.unconditional)
+        for key, idxs in self.index.items():
+            if key in report:
+                candidates += idxs
+        candidates.sort()
+
+        # uncompressed values of the report, fetched on demand
+        values = {}
+
+        for idx in candidates:
+            (url, keys, conditions) = self.patterns[idx]
+            for key in keys:
+                if key not in report:
+                    break
+            else:
+                for (key, regexp) in conditions:
+                    try:
+                        v = values[key]
+                    except KeyError:
+                        v = report[key]
+                        if isinstance(v, problem_report.CompressedValue):
+                            v = v.get_value()
+                        values[key] = v
+                    re_c = self._compile(regexp, _python2 or isinstance(v, bytes))
+                    if re_c is None:
+                        continue
+                    if not re_c.search(v):
+                        break
+                else:
+                    return url
+
+        return None
+
+
+def _load_bug_patterns(url):
+    '''Fetch and compile bug patterns from given URL.
+
+    Compiled patterns are cached per URL. Later requests send the HTTP
+    validators (ETag, Last-Modified) of the cached copy, so that an unchanged
+    document neither gets downloaded nor parsed again; for servers or URL
+    schemes without validators, the document is only parsed again if its
+    contents changed.
+
+    Return a _BugPatterns object, or None if the URL could not be loaded or
+    does not have valid bug patterns.
+    '''
+    # urllib is expensive to import and only needed here
     if _python2:
-        return pattern.attributes['url'].nodeValue.encode('UTF-8')
+        from urllib import urlopen
+        URLError = HTTPError = IOError
     else:
-        return pattern.attributes['url'].nodeValue
+        from urllib.error import URLError, HTTPError
+        from urllib.request import urlopen, Request
 
+    cached = _bug_pattern_cache.get(url)
 
-def _check_bug_patterns(report, patterns):
     try:
         if _python2:
-            patterns = patterns.encode('UTF-8')
-        dom = xml.dom.minidom.parseString(patterns)
-    except (ExpatError, UnicodeEncodeError):
+            f = urlopen(url)
+        else:
+            headers = {}
+            if cached and cached[0]:
+                headers['If-None-Match'] = cached[0]
+            if cached and cached[1]:
+                headers['If-Modified-Since'] = cached[1]
+            f = urlopen(Request(url, headers=headers))
+        etag = f.info().get('ETag')
+        last_modified = f.info().get('Last-Modified')
+        patterns = f.read().decode('UTF-8', errors='replace')
+        f.close()
+    except HTTPError as e:
+        if cached and getattr(e, 'code', None) == 304:
+            return cached[3]
+        return None
+    except (IOError, URLError):
+        # doesn't exist or failed to load
         return None
 
-    for pattern in dom.getElementsByTagName('pattern'):
-        url = _check_bug_pattern(report, pattern)
-        if url:
-            return url
+    if '<title>404 Not Found' in patterns:
+        return None
+
+    if cached and cached[2] == patterns:
+        matcher = cached[3]
+    else:
+        try:
+            matcher = _BugPatterns(patterns)
+        except ValueError:
+            _bug_pattern_cache.pop(url, None)
+            return None
+
+    _bug_pattern_cache[url] = (etag, last_modified, patterns, matcher)
+    return matcher
+
 
-    return None
+def _ignore_file_path():
+    '''Return the path of the per-user ignore file.
+
+    $HOME is temporarily unset, as this gets the wrong home dir for e. g.
+    sudo.
+    '''
+    orig_home = os.getenv('HOME')
+    if orig_home is not None:
+        del os.environ['HOME']
+    path = os.path.expanduser(_ignore_file)
+    if orig_home is not None:
+        os.environ['HOME'] = orig_home
+    return path
+
+
+def _file_validator(path):
+    '''Return a tuple which changes whenever the given file changes.
+
+    Raise OSError if the file does not exist.
+    '''
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _read_list_dir(dir):
+    '''Return the set of all lines of all files in dir.
+
+    This is used for the system-wide black- and whitelists. The lines of every
+    file are cached, and only read again if that file changed. Return an empty
+    set if dir does not exist.
+    '''
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return set()
+
+    # name -> (validator, set of lines)
+    cached = _ignore_cache.get(dir, {})
+    files = {}
+    for name in names:
+        path = os.path.join(dir, name)
+        try:
+            validator = _file_validator(path)
+        except OSError:
+            continue
+        if name in cached and cached[name][0] == validator:
+            files[name] = cached[name]
+            continue
+        try:
+            with open(path) as fd:
+                files[name] = (validator, set([line.strip() for line in fd]))
+        except IOError:
+            continue
+
+    _ignore_cache[dir] = files
+    entries = set()
+    for (validator, lines) in files.values():
+        entries.update(lines)
+    return entries
+
+
+def _read_ignores(path):
+    '''Return the entries of the per-user ignore file.
+
+    This returns a program path → mtime map. The file is only parsed again if
+    it changed since the last call.
+
+    Raises ValueError if the file exists but is invalid XML.
+    '''
+    try:
+        validator = _file_validator(path)
+    except OSError:
+        return {}
+
+    cached = _ignore_cache.get(path)
+    if cached and cached[0] == validator:
+        return cached[1]
+
+    import xml.dom.minidom
+    from xml.parsers.expat import ExpatError
+
+    ignores = {}
+    if os.access(path, os.R_OK) and validator[1] > 0:
+        try:
+            dom = xml.dom.minidom.parse(path)
+        except ExpatError as e:
+            raise ValueError('%s has invalid format: %s' % (_ignore_file, str(e)))
+        for ignore in dom.getElementsByTagName('ignore'):
+            try:
+                mtime = float(ignore.getAttribute('mtime'))
+            except ValueError:
+                continue
+            program = ignore.getAttribute('program')
+            ignores[program] = max(mtime, ignores.get(program, mtime))
+        dom.unlink()
+
+    _ignore_cache[path] = (validator, ignores)
+    return ignores
+
+
+def _append_ignore(path, program, mtime):
+    '''Add an entry to an existing ignore file without rewriting it.
+
+    This inserts a new <ignore> element in front of the closing root tag, and
+    updates the cache of _read_ignores().
+
+    Return False if the file does not end in the expected way; then the caller
+    needs to rewrite the whole file.
+    '''
+    from xml.sax.saxutils import quoteattr
+
+    closing = b'</apport>'
+    try:
+        with open(path, 'rb+') as fd:
+            fd.seek(0, os.SEEK_END)
+            size = fd.tell()
+            tail_start = max(0, size - 64)
+            fd.seek(tail_start)
+            tail = fd.read()
+            pos = tail.rfind(closing)
+            if pos < 0 or tail[pos + len(closing):].strip():
+                return False
+            fd.seek(tail_start + pos)
+            entry = '  <ignore mtime=%s program=%s/>\n' % (
+                quoteattr(mtime), quoteattr(program))
+            fd.write(entry.encode('UTF-8') + closing + b'\n')
+            fd.truncate()
+    except (IOError, OSError):
+        return False
+
+    cached = _ignore_cache.get(path)
+    if cached:
+        ignores = dict(cached[1])
+        ignores[program] = float(mtime)
+        _ignore_cache[path] = (_file_validator(path), ignores)
+    return True
 
 
 def _dom_remove_space(node):
@@ -186,14 +503,47 @@ def _dom_remove_space(node):
             _dom_remove_space(c)
 
 
+def _list_hooks(dir):
+    '''Return the sorted list of *.py hook files in dir.
+
+    The list is cached until the directory changes.
+    '''
+    try:
+        validator = _file_validator(dir)
+    except OSError:
+        return []
+    cached = _hook_dir_cache.get(dir)
+    if cached and cached[0] == validator:
+        return cached[1]
+    hooks = sorted(glob.glob(os.path.join(dir, '*.py')))
+    _hook_dir_cache[dir] = (validator, hooks)
+    return hooks
+
+
+def _load_hook(hook):
+    '''Return the global namespace of a hook file.
+
+    Hooks are compiled and executed once; the namespace is cached until the
+    file changes. Errors from loading the hook are passed on.
+    '''
+    validator = _file_validator(hook)
+    cached = _hook_cache.get(hook)
+    if cached and cached[0] == validator:
+        return cached[1]
+    symb = {}
+    with open(hook) as fd:
+        exec(compile(fd.read(), hook, 'exec'), symb)
+    _hook_cache[hook] = (validator, symb)
+    return symb
+
+
 def _run_hook(report, ui, hook):
     if not os.path.exists(hook):
         return False
 
-    symb = {}
+    start = time.time()
     try:
-        with open(hook) as fd:
-            exec(compile(fd.read(), hook, 'exec'), symb)
+        symb = _load_hook(hook)
         try:
             symb['add_info'](report, ui)
         except TypeError as e:
@@ -210,6 +560,186 @@ def _run_hook(report, ui, hook):
         report['HookError_' + hookname] = traceback.format_exc()
         apport.error('hook %s crashed:', hook)
         traceback.print_exc()
+    finally:
+        timing = '%s: %.3fs' % (hook, time.time() - start)
+        if report.get('_HookTimings'):
+            report['_HookTimings'] += '\n' + timing
+        else:
+            report['_HookTimings'] = timing
+
+    return False
+
+
+class _HookUIProxy:
+    '''Wrap the UI object for a hook running with a deadline.
+
+    Calls are serialized, so that concurrently running hooks do not ask
+    interactive questions at the same time. The time spent in them is
+    tracked, as it does not count towards the hook's deadline. Once the hook
+    is abandoned, it cannot use the UI any more.
+    '''
+    _lock = threading.Lock()
+
+    def __init__(self, ui):
+        self._ui = ui
+        self.ui_time = 0
+        self.busy_since = None
+        self.closed = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._ui, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.busy_since = time.time()
+            try:
+                with self._lock:
+                    if self.closed:
+                        # quietly end the hook, its results are discarded
+                        raise StopIteration
+                    return attr(*args, **kwargs)
+            finally:
+                self.ui_time += time.time() - self.busy_since
+                self.busy_since = None
+
+        return call
+
+    def __str__(self):
+        return str(self._ui)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+
+
+class _HookJob(threading.Thread):
+    '''Run a hook in a thread, on a private copy of the report.'''
+
+    def __init__(self, report, ui, hook):
+        threading.Thread.__init__(self, name=hook)
+        # hooks which exceed their deadline must not block exiting
+        self.daemon = True
+        self.hook = hook
+        self.report = copy.copy(report)
+        self.report.data = report.data.copy()
+        self.report.data.pop('_HookTimings', None)
+        self.orig_data = self.report.data.copy()
+        self.ui = ui is not None and _HookUIProxy(ui) or None
+        self.stop = False
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        threading.Thread.start(self)
+
+    def run(self):
+        self.stop = _run_hook(self.report, self.ui, self.hook)
+
+    def wait(self, timeout):
+        '''Wait until the hook finished.
+
+        Return False if it ran for more than timeout seconds, not counting
+        the time spent in UI calls. The hook cannot use the UI any more then.
+        '''
+        while self.is_alive():
+            remaining = self.start_time + timeout - time.time()
+            if self.ui is not None:
+                remaining += self.ui.ui_time
+                if self.ui.busy_since is not None:
+                    remaining = max(remaining, 1)
+            if remaining <= 0:
+                self.abandon()
+                return False
+            self.join(remaining)
+        return True
+
+    def abandon(self):
+        '''Do not let the hook use the UI any more.'''
+
+        if self.ui is not None:
+            self.ui.close()
+
+    def timing(self):
+        '''Return the _HookTimings line of the finished hook.'''
+
+        return self.report.data.pop('_HookTimings', None)
+
+    def changes(self):
+        '''Return the set of keys which the finished hook changed.'''
+
+        missing = object()
+        changed = set()
+        for k in set(self.orig_data) | set(self.report.data):
+            old = self.orig_data.get(k, missing)
+            new = self.report.data.get(k, missing)
+            if old is not new and (old is missing or new is missing or old != new):
+                changed.add(k)
+        return changed
+
+
+def _add_hook_timing(report, timing):
+    if not timing:
+        return
+    if report.get('_HookTimings'):
+        report['_HookTimings'] += '\n' + timing
+    else:
+        report['_HookTimings'] = timing
+
+
+def _hook_timed_out(report, hook, timeout):
+    hookname = os.path.splitext(os.path.basename(hook))[0].replace('-', '_')
+    report['HookError_' + hookname] = 'hook timed out after %i seconds' % timeout
+    apport.error('hook %s timed out', hook)
+    _add_hook_timing(report, '%s: timed out' % hook)
+
+
+def _run_hooks_deadline(report, ui, hooks, timeout):
+    '''Run hooks concurrently, each with a deadline.
+
+    All hooks start at the same time, each on a private copy of report.
+    Their changes are merged into report in the order of hooks. A hook which
+    changed a key that an earlier hook changed as well (such as appending to
+    Tags) is run again on its own, on the merged report, so that it sees the
+    earlier changes. Hooks which run longer than timeout seconds are
+    abandoned, their changes are discarded and recorded as a HookError_*
+    field.
+
+    Like _run_hook(), return True if a hook requested to stop the report
+    filing process; the changes of the hooks after it are discarded then.
+    '''
+    jobs = [_HookJob(report, ui, hook) for hook in hooks]
+    for job in jobs:
+        job.start()
+
+    try:
+        merged = set()
+        for job in jobs:
+            if not job.wait(timeout):
+                _hook_timed_out(report, job.hook, timeout)
+                continue
+            _add_hook_timing(report, job.timing())
+            changes = job.changes()
+            if changes & merged:
+                job = _HookJob(report, ui, job.hook)
+                job.start()
+                if not job.wait(timeout):
+                    _hook_timed_out(report, job.hook, timeout)
+                    continue
+                _add_hook_timing(report, job.timing())
+                changes = job.changes()
+            for k in changes:
+                if k in job.report.data:
+                    report.data[k] = job.report.data[k]
+                else:
+                    del report.data[k]
+            merged |= changes
+            if job.stop:
+                return True
+    finally:
+        # hooks which are discarded or still running must not ask questions
+        for job in jobs:
+            job.abandon()
 
     return False
 
@@ -218,6 +748,67 @@ def _run_hook(report, ui, hook):
 #
 
 
+def _anonymization_patterns():
+    '''Return identifying strings of the current user and host.
+
+    This is a list of (string, replacement, after_space) tuples, in order of
+    precedence. Strings are replaced where they form whole words; if
+    after_space is True, they are also replaced after a space when the string
+    starts with a non-word character.
+    '''
+    patterns = []
+    if (os.getuid() > 0):
+        # do not replace "root"
+        p = pwd.getpwuid(os.getuid())
+        if len(p[0]) >= 2:
+            patterns.append((p[0], 'username', False))
+        patterns.append((p[5], '/home/username', False))
+
+        for s in p[4].split(','):
+            s = s.strip()
+            if len(s) > 2:
+                patterns.append((s, 'User Name', True))
+
+    hostname = os.uname()[1]
+    if len(hostname) >= 2:
+        patterns.append((hostname, 'hostname', False))
+
+    return patterns
+
+
+def _anonymizer(patterns):
+    '''Build a function which replaces all patterns in a string.
+
+    patterns is a list as returned by _anonymization_patterns(). They are
+    combined into one regular expression, so that a value is scanned only
+    once instead of once per pattern; the name of the alternative which
+    matched selects the replacement. The expression starts with a lookahead
+    for the possible first characters, which lets the regex engine skip over
+    all other positions quickly.
+
+    The returned function takes a string and returns (new string, number of
+    replacements). Return None if there are no patterns.
+    '''
+    patterns = [p for p in patterns if p[0]]
+    if not patterns:
+        return None
+
+    alternatives = []
+    replacements = {}
+    for (i, (string, repl, after_space)) in enumerate(patterns):
+        alternatives.append(r'(?P<a%i>%s%s\b)' % (
+            i, after_space and r'(?:\b|(?<=\s))' or r'\b', re.escape(string)))
+        replacements['a%i' % i] = repl
+    first_chars = set([p[0][0] for p in patterns])
+    combined = re.compile('(?=[%s])(?:%s)' % (
+        ''.join([re.escape(c) for c in sorted(first_chars)]), '|'.join(alternatives)))
+
+    def replace(match):
+        return replacements[match.lastgroup]
+
+    return lambda value: combined.subn(replace, value)
+
+
 class Report(problem_report.ProblemReport):
     '''A problem report specific to apport (crash or bug).
 
@@ -236,6 +827,7 @@ class Report(problem_report.ProblemReport):
         problem_report.ProblemReport.__init__(self, type, date)
         self.pid = None
         self._proc_maps_cache = None
+        self._core_spool = None
 
     def _customized_package_suffix(self, package):
         '''Return a string suitable for appending to Package/Dependencies.
@@ -244,12 +836,12 @@ class Report(problem_report.ProblemReport):
         return ' [modified: ...]' with a list of modified files.
         '''
         suffix = ''
-        mod = packaging.get_modified_files(package)
+        mod = _package_info('get_modified_files', package)
         if mod:
             suffix += ' [modified: %s]' % ' '.join(mod)
         try:
-            if not packaging.is_distro_package(package):
-                origin = packaging.get_package_origin(package)
+            if not _package_info('is_distro_package', package):
+                origin = _package_info('get_package_origin', package)
                 if origin:
                     suffix += ' [origin: %s]' % origin
                 else:
@@ -270,7 +862,7 @@ class Report(problem_report.ProblemReport):
         Return determined package version (None for uninstalled).
         '''
         try:
-            version = packaging.get_version(package)
+            version = _package_info('get_version', package)
         except ValueError:
             # package not installed
             version = None
@@ -291,6 +883,8 @@ class Report(problem_report.ProblemReport):
         - Dependencies: package names and versions of all dependencies and
           pre-dependencies; this also checks if the files are unmodified and
           appends a list of all modified files
+
+        Package information is cached until the package database changes.
         '''
         if not package:
             # the kernel does not have a executable path but a package
@@ -305,14 +899,14 @@ class Report(problem_report.ProblemReport):
 
         if version or 'SourcePackage' not in self:
             try:
-                self['SourcePackage'] = packaging.get_source(package)
+                self['SourcePackage'] = _package_info('get_source', package)
             except ValueError:
                 # might not exist for non-free third-party packages
                 pass
         if not version:
             return
 
-        self['PackageArchitecture'] = packaging.get_architecture(package)
+        self['PackageArchitecture'] = _package_info('get_architecture', package)
 
         # get set of all transitive dependencies
         dependencies = set([])
@@ -322,7 +916,7 @@ class Report(problem_report.ProblemReport):
         self['Dependencies'] = ''
         for dep in sorted(dependencies):
             try:
-                v = packaging.get_version(dep)
+                v = _package_info('get_version', dep)
             except ValueError:
                 # can happen with uninstalled alternate dependencies
                 continue
@@ -723,6 +1317,13 @@ class Report(problem_report.ProblemReport):
         for part in parts:
             self[value_keys.pop(0)] = part.replace('\n\n', '\n.\n').strip()
 
+        self._postprocess_gdb_info()
+
+    def _postprocess_gdb_info(self):
+        '''Clean up assertion messages and derive fields from Stacktrace.
+
+        This is shared between add_gdb_info() and add_gdb_info_mi().
+        '''
         # glib's assertion has precedence, since it internally uses
         # abort(), and then glib's __abort_msg is bogus
         if 'GLibAssertionMessage' in self:
@@ -754,6 +1355,135 @@ class Report(problem_report.ProblemReport):
             if addr_signature:
                 self['StacktraceAddressSignature'] = addr_signature
 
+    def add_gdb_info_mi(self, rootdir=None, stack_depth=2000,
+                        thread_depth=50, max_threads=10, with_locals=False,
+                        structured=False):
+        '''Add information from gdb, using its machine interface.
+
+        This adds the same fields as add_gdb_info(), but talks to a single gdb
+        process through gdb/MI, so that the number of threads and their depth
+        can be limited. This is considerably faster for processes with many
+        threads. The text fields are produced by the same gdb commands as in
+        add_gdb_info(), so that the crash signatures derived from them are
+        identical for the same core dump.
+
+        stack_depth limits the number of frames in Stacktrace, thread_depth
+        the number of frames per thread in ThreadStacktrace. If max_threads is
+        not None, ThreadStacktrace only contains that many threads (the
+        crashing thread first, then the others in descending order). If
+        with_locals is False, local variables are not printed ("bt" instead of
+        "bt full"). The defaults are sufficient for computing StacktraceTop
+        and crash signatures; with max_threads=None, thread_depth=2000 and
+        with_locals=True, the fields are the same as from add_gdb_info().
+
+        If structured is True, also return a dictionary with the structured
+        data: 'threads' maps thread IDs to dictionaries with 'target-id' and
+        'frames' (list of gdb/MI frame dictionaries, with an additional 'args'
+        list), 'current-thread-id' is the crashing thread, and 'registers' is
+        a list of (name, value) pairs. This needs additional gdb/MI queries
+        for every thread. Otherwise, or if the report has no CoreDump or
+        ExecutablePath, return None.
+
+        Raises a IOError if the core dump is invalid/truncated, or OSError if
+        calling gdb fails.
+        '''
+        if 'CoreDump' not in self or 'ExecutablePath' not in self:
+            return None
+
+        bt = with_locals and 'bt full' or 'bt'
+        fields = {}
+        gdb = apport.gdbmi.Session(self.gdb_command(rootdir))
+        try:
+            (ok, info, startup) = gdb.command('-thread-info')
+
+            # check for truncated stack trace
+            if 'is truncated: expected core file size' in startup:
+                warnings = '\n'.join([l for l in startup.splitlines() if 'Warning:' in l])
+                reason = 'Invalid core dump: ' + warnings.strip()
+                self['UnreportableReason'] = reason
+                raise IOError(reason)
+            if not ok or not info.get('threads'):
+                raise OSError('Error: gdb could not read threads: %s' %
+                              info.get('msg', startup))
+
+            current = info.get('current-thread-id', info['threads'][0]['id'])
+            others = sorted([t['id'] for t in info['threads'] if t['id'] != current],
+                            key=int, reverse=True)
+            thread_ids = [current] + others
+            if max_threads is not None:
+                thread_ids = thread_ids[:max_threads]
+            target_ids = dict((t['id'], t.get('target-id', '')) for t in info['threads'])
+
+            # text fields with the CLI commands of add_gdb_info(), one command
+            # for all threads; this needs to happen while the crashing thread
+            # is still selected
+            gdb.console('set backtrace limit %i' % stack_depth)
+            fields['Stacktrace'] = gdb.console(bt)
+            gdb.console('set backtrace limit %i' % thread_depth)
+            if max_threads is None:
+                fields['ThreadStacktrace'] = gdb.console('thread apply all ' + bt)
+            else:
+                fields['ThreadStacktrace'] = gdb.console(
+                    'thread apply %s %s' % (' '.join(thread_ids), bt))
+            for (name, cmd) in [('Registers', 'info registers'),
+                                ('Disassembly', 'x/16i $pc'),
+                                ('AssertionMessage', 'print __abort_msg->msg'),
+                                ('GLibAssertionMessage', 'print __glib_assert_msg'),
+                                ('NihAssertionMessage', 'print (char*) __nih_abort_msg')]:
+                fields[name] = gdb.console(cmd)
+
+            for (name, value) in fields.items():
+                if value is not None:
+                    # like add_gdb_info() does with the batch output
+                    self[name] = value.replace('\n\n', '\n.\n').strip()
+            self._postprocess_gdb_info()
+
+            if not structured:
+                return None
+
+            result = {'threads': {}, 'current-thread-id': current}
+            for thread in thread_ids:
+                depth = (thread == current) and max(stack_depth, thread_depth) or thread_depth
+                result['threads'][thread] = {
+                    'target-id': target_ids[thread],
+                    'frames': self._gdb_mi_frames(gdb, thread, depth)}
+
+            # registers
+            (ok, names, out) = gdb.command('-data-list-register-names')
+            names = ok and names['register-names'] or []
+            (ok, values, out) = gdb.command('-data-list-register-values x')
+            result['registers'] = []
+            if ok:
+                for v in values['register-values']:
+                    name = names[int(v['number'])] if int(v['number']) < len(names) else ''
+                    if name and v['value'].startswith('0x'):
+                        result['registers'].append((name, v['value']))
+        finally:
+            gdb.close()
+
+        return result
+
+    @classmethod
+    def _gdb_mi_frames(klass, gdb, thread, depth):
+        '''Get the topmost depth frames of a thread from a gdb/MI session.'''
+
+        (ok, res, out) = gdb.command('-stack-list-frames --thread %s 0 %i' %
+                                     (thread, depth - 1))
+        if not ok:
+            return []
+        frames = res['stack']
+
+        (ok, res, out) = gdb.command('-stack-list-arguments --thread %s 2 0 %i' %
+                                     (thread, depth - 1))
+        args = {}
+        if ok:
+            for f in res['stack-args']:
+                args[f['level']] = [(a['name'], a.get('value', '...')) for a in f['args']]
+
+        for f in frames:
+            f['args'] = args.get(f['level'], [])
+        return frames
+
     def _gen_stacktrace_top(self):
         '''Build field StacktraceTop as the top five functions of Stacktrace.
 
@@ -824,6 +1554,15 @@ class Report(problem_report.ProblemReport):
         ui)' that takes and modifies a Report, and gets an UserInterface
         reference for interactivity.
 
+        Hooks are only compiled and loaded once, and kept until the hook file
+        changes; so their module level code only runs once per process. The
+        wall time of each hook is recorded in the _HookTimings field.
+
+        The general hooks run concurrently, each with a deadline of
+        _general_hook_timeout seconds (not counting interactive questions);
+        their changes are merged in file name order. Package hooks run after
+        them, without a deadline.
+
         return True if the hook requested to stop the report filing process,
         False otherwise.
         '''
@@ -865,10 +1604,10 @@ class Report(problem_report.ProblemReport):
                 hook_dirs.append(os.path.join(opt_path, 'share', 'apport', 'package-hooks'))
                 opt_path = os.path.dirname(opt_path)
 
-        # common hooks
-        for hook in glob.glob(_common_hook_dir + '/*.py'):
-            if _run_hook(self, ui, hook):
-                return True
+        # common hooks get a deadline, so that a hung one does not block
+        if _run_hooks_deadline(self, ui, _list_hooks(_common_hook_dir),
+                               _general_hook_timeout):
+            return True
 
         # binary package hook
         if package:
@@ -889,6 +1628,9 @@ class Report(problem_report.ProblemReport):
 
         Return bug URL on match, or None otherwise.
 
+        The downloaded patterns are compiled once and cached for the lifetime
+        of the process; unchanged documents are not parsed again.
+
         The url must refer to a valid XML document with the following syntax:
         root element := <patterns>
         patterns := <pattern url="http://bug.url"> *
@@ -910,22 +1652,11 @@ class Report(problem_report.ProblemReport):
         if not url:
             return
 
-        try:
-            f = urlopen(url)
-            patterns = f.read().decode('UTF-8', errors='replace')
-            f.close()
-        except (IOError, URLError):
-            # doesn't exist or failed to load
-            return
-
-        if '<title>404 Not Found' in patterns:
-            return
+        patterns = _load_bug_patterns(url)
+        if patterns is None:
+            return None
 
-        url = _check_bug_patterns(self, patterns)
-        if url:
-            return url
-
-        return None
+        return patterns.match(self)
 
     def _get_ignore_dom(self):
         '''Read ignore list XML file and return a DOM tree.
@@ -934,12 +1665,10 @@ class Report(problem_report.ProblemReport):
 
         Raises ValueError if the file exists but is invalid XML.
         '''
-        orig_home = os.getenv('HOME')
-        if orig_home is not None:
-            del os.environ['HOME']
-        ifpath = os.path.expanduser(_ignore_file)
-        if orig_home is not None:
-            os.environ['HOME'] = orig_home
+        import xml.dom.minidom
+        from xml.parsers.expat import ExpatError
+
+        ifpath = _ignore_file_path()
         if not os.access(ifpath, os.R_OK) or os.path.getsize(ifpath) == 0:
             # create a document from scratch
             dom = xml.dom.getDOMImplementation().createDocument(None, 'apport', None)
@@ -972,54 +1701,31 @@ class Report(problem_report.ProblemReport):
         assert 'ExecutablePath' in self
 
         # check blacklist
-        try:
-            for f in os.listdir(_blacklist_dir):
-                try:
-                    with open(os.path.join(_blacklist_dir, f)) as fd:
-                        for line in fd:
-                            if line.strip() == self['ExecutablePath']:
-                                return True
-                except IOError:
-                    continue
-        except OSError:
-            pass
+        if self['ExecutablePath'] in _read_list_dir(_blacklist_dir):
+            return True
 
         # check whitelist
-        try:
-            whitelist = set()
-            for f in os.listdir(_whitelist_dir):
-                try:
-                    with open(os.path.join(_whitelist_dir, f)) as fd:
-                        for line in fd:
-                            whitelist.add(line.strip())
-                except IOError:
-                    continue
-
-            if whitelist and self['ExecutablePath'] not in whitelist:
-                return True
-        except OSError:
-            pass
+        whitelist = _read_list_dir(_whitelist_dir)
+        if whitelist and self['ExecutablePath'] not in whitelist:
+            return True
 
         try:
-            dom = self._get_ignore_dom()
+            ignores = _read_ignores(_ignore_file_path())
         except (ValueError, KeyError):
             apport.error('Could not get ignore file:')
             traceback.print_exc()
             return False
 
+        if self['ExecutablePath'] not in ignores:
+            return False
+
         try:
             cur_mtime = int(os.stat(self['ExecutablePath']).st_mtime)
         except OSError:
             # if it does not exist any more, do nothing
             return False
 
-        # search for existing entry and update it
-        for ignore in dom.getElementsByTagName('ignore'):
-            if ignore.getAttribute('program') == self['ExecutablePath']:
-                if float(ignore.getAttribute('mtime')) >= cur_mtime:
-                    return True
-
-        return False
+        return ignores[self['ExecutablePath']] >= cur_mtime
 
     def mark_ignore(self):
         '''Ignore future crashes of this executable.
@@ -1033,7 +1739,6 @@ class Report(problem_report.ProblemReport):
         '''
         assert 'ExecutablePath' in self
 
-        dom = self._get_ignore_dom()
         try:
             mtime = str(int(os.stat(self['ExecutablePath']).st_mtime))
         except OSError as e:
@@ -1043,6 +1748,16 @@ class Report(problem_report.ProblemReport):
             else:
                 raise
 
+        # fast path: append new entries to an existing file in place
+        ignore_file_path = _ignore_file_path()
+        if self['ExecutablePath'] not in _read_ignores(ignore_file_path) and \
+                os.path.exists(ignore_file_path) and \
+                os.path.getsize(ignore_file_path) > 0 and \
+                _append_ignore(ignore_file_path, self['ExecutablePath'], mtime):
+            return
+
+        dom = self._get_ignore_dom()
+
         # search for existing entry and update it
         for ignore in dom.getElementsByTagName('ignore'):
             if ignore.getAttribute('program') == self['ExecutablePath']:
@@ -1055,17 +1770,11 @@ class Report(problem_report.ProblemReport):
             e.setAttribute('mtime', mtime)
             dom.documentElement.appendChild(e)
 
-        # write back file; temporarily unset $HOME, as this gets the wrong home
-        # dir for e. g. sudo
-        orig_home = os.getenv('HOME')
-        if orig_home is not None:
-            del os.environ['HOME']
-        ignore_file_path = os.path.expanduser(_ignore_file)
-        if orig_home is not None:
-            os.environ['HOME'] = orig_home
-
+        # write back file; the rewrite might not change the file's
+        # validator, so drop the cached entries explicitly
         with open(ignore_file_path, 'w') as fd:
             dom.writexml(fd, addindent='  ', newl='\n')
+        _ignore_cache.pop(ignore_file_path, None)
 
         dom.unlink()
 
@@ -1410,31 +2119,37 @@ class Report(problem_report.ProblemReport):
         if 'ProcMaps' not in self or 'Stacktrace' not in self or 'Signal' not in self:
             return None
 
+        def addresses():
+            for line in self['Stacktrace'].splitlines():
+                if line.startswith('#'):
+                    addr = line.split()[1]
+                    if not addr.startswith('0x'):
+                        continue
+                    addr = int(addr, 16)  # we do want to know about ValueErrors here, so don't catch
+                    # ignore impossibly low addresses; these are usually artifacts
+                    # from gdb when not having debug symbols
+                    if addr < 0x1000:
+                        continue
+                    yield addr
+
+        # stack unwinding chops off ~ 5 functions, and we need some more
+        # accuracy because we do not have symbols; but beyond a depth of 15
+        # we get too much noise, so we can abort there; resolve as many
+        # addresses at once as are still missing for that
+        addrs = addresses()
         stack = []
         failed = 0
-        for line in self['Stacktrace'].splitlines():
-            if line.startswith('#'):
-                addr = line.split()[1]
-                if not addr.startswith('0x'):
-                    continue
-                addr = int(addr, 16)  # we do want to know about ValueErrors here, so don't catch
-                # ignore impossibly low addresses; these are usually artifacts
-                # from gdb when not having debug symbols
-                if addr < 0x1000:
-                    continue
-                offset = self._address_to_offset(addr)
+        while len(stack) < 15:
+            batch = list(itertools.islice(addrs, 15 - len(stack)))
+            if not batch:
+                break
+            for offset in self._addresses_to_offsets(batch):
                 if offset:
                     # avoid ':' in ELF paths, we use that as separator
                     stack.append(offset.replace(':', '..'))
                 else:
                     failed += 1
 
-            # stack unwinding chops off ~ 5 functions, and we need some more
-            # accuracy because we do not have symbols; but beyond a depth of 15
-            # we get too much noise, so we can abort there
-            if len(stack) >= 15:
-                break
-
         # we only accept a small minority (< 20%) of failed resolutions, otherwise we
         # discard
         if failed > 0 and len(stack) / failed < 4:
@@ -1456,39 +2171,95 @@ class Report(problem_report.ProblemReport):
         from attributes which contain data read from the environment, and
         removes the ProcCwd attribute completely.
         '''
-        replacements = []
-        if (os.getuid() > 0):
-            # do not replace "root"
-            p = pwd.getpwuid(os.getuid())
-            if len(p[0]) >= 2:
-                replacements.append((re.compile(r'\b%s\b' % re.escape(p[0])), 'username'))
-            replacements.append((re.compile(r'\b%s\b' % re.escape(p[5])), '/home/username'))
-
-            for s in p[4].split(','):
-                s = s.strip()
-                if len(s) > 2:
-                    replacements.append((re.compile(r'(\b|\s)%s\b' % re.escape(s)), r'\1User Name'))
-
-        hostname = os.uname()[1]
-        if len(hostname) >= 2:
-            replacements.append((re.compile(r'\b%s\b' % re.escape(hostname)), 'hostname'))
+        anonymizer = _anonymizer(_anonymization_patterns())
 
         try:
             del self['ProcCwd']
         except KeyError:
             pass
 
+        if not anonymizer:
+            return
+
         for k in self:
             is_proc_field = k.startswith('Proc') and k not in [
                 'ProcCpuinfo', 'ProcMaps', 'ProcStatus', 'ProcInterrupts', 'ProcModules']
             if is_proc_field or 'Stacktrace' in k or k in ['Traceback', 'PythonArgs', 'Title', 'JournalErrors']:
                 if not hasattr(self[k], 'isspace'):
                     continue
-                for (pattern, repl) in replacements:
-                    if type(self[k]) == bytes:
-                        self[k] = pattern.sub(repl, self[k].decode('UTF-8', errors='replace')).encode('UTF-8')
-                    else:
-                        self[k] = pattern.sub(repl, self[k])
+                if type(self[k]) == bytes:
+                    (value, n) = anonymizer(self[k].decode('UTF-8', errors='replace'))
+                    if n:
+                        self[k] = value.encode('UTF-8')
+                else:
+                    (value, n) = anonymizer(self[k])
+                    if n:
+                        self[k] = value
+
+    def spool_core(self, file=None):
+        '''Unpack CoreDump into a file for tools like gdb.
+
+        If CoreDump is a file reference, this just returns its path. Otherwise
+        the core dump is written into a file from new_core_spool(). It is
+        reused as long as CoreDump does not change, so that calling gdb
+        several times does not unpack the core dump again.
+
+        If file is given, it must be the report file (opened in binary mode)
+        this report was loaded from; the core dump is then uncompressed
+        straight from the file, without going through the in-memory value.
+
+        Return the path of the unpacked core dump, or None if the report does
+        not have a CoreDump.
+        '''
+        if 'CoreDump' not in self:
+            return None
+        value = self['CoreDump']
+        if isinstance(value, tuple):
+            # value is a file path
+            return value[0]
+
+        if self._core_spool and self._core_spool[0] is value and \
+                os.path.exists(self._core_spool[1]):
+            return self._core_spool[1]
+
+        core = self.new_core_spool()
+        if file is not None:
+            file.seek(0)
+            self.extract_keys(file, 'CoreDump', os.path.dirname(core))
+        else:
+            with open(core, 'wb') as f:
+                if hasattr(value, 'find'):
+                    f.write(value)
+                else:
+                    value.write(f)
+
+        self._core_spool = (value, core)
+        return core
+
+    def new_core_spool(self):
+        '''Return the path of a new file for an unpacked core dump.
+
+        The file is in a new directory in the temporary directory, or in
+        $APPORT_CORE_SPOOL_DIR if set (this can point to a tmpfs). It replaces
+        the previous one of this report, and is removed by
+        discard_core_spool(), or when the program exits.
+        '''
+        self.discard_core_spool()
+        spool = tempfile.mkdtemp(prefix='apport_core_', dir=_core_spool_dir)
+        atexit.register(shutil.rmtree, spool, True)
+        core = os.path.join(spool, 'CoreDump')
+        self._core_spool = (None, core)
+        return core
+
+    def discard_core_spool(self):
+        '''Remove the file with the unpacked core dump of this report.
+
+        Long running programs should call this when they are done with a
+        report, to not keep the core dump on disk until they exit.
+        '''
+        if self._core_spool:
+            shutil.rmtree(os.path.dirname(self._core_spool[1]), True)
+            self._core_spool = None
 
     def gdb_command(self, sandbox):
         '''Build gdb command for this report.
@@ -1530,21 +2301,7 @@ class Report(problem_report.ProblemReport):
         command += ['--ex', 'file "%s"' % executable]
 
         if 'CoreDump' in self:
-            if hasattr(self['CoreDump'], 'find'):
-                (fd, core) = tempfile.mkstemp(prefix='apport_core_')
-                atexit.register(os.unlink, core)
-                os.write(fd, self['CoreDump'])
-                os.close(fd)
-            elif hasattr(self['CoreDump'], 'gzipvalue'):
-                (fd, core) = tempfile.mkstemp(prefix='apport_core_')
-                atexit.register(os.unlink, core)
-                os.close(fd)
-                with open(core, 'wb') as f:
-                    self['CoreDump'].write(f)
-            else:
-                # value is a file path
-                core = self['CoreDump'][0]
-
+            core = self.spool_core()
             command += ['--ex', 'core-file ' + core]
 
         return command
@@ -1563,24 +2320,36 @@ class Report(problem_report.ProblemReport):
         Return 'path+offset' when found, or None if address is not in any
         mapped range.
         '''
-        self._build_proc_maps_cache()
+        return self._addresses_to_offsets([addr])[0]
 
-        for (start, end, elf) in self._proc_maps_cache:
-            if start <= addr and end >= addr:
-                return '%s+%x' % (elf, addr - start)
+    def _addresses_to_offsets(self, addrs):
+        '''Resolve a list of memory addresses to ELF names and offsets.
 
-        return None
+        This is the batch version of _address_to_offset(), and returns a list
+        of 'path+offset' strings or None, in the order of addrs.
+        '''
+        self._build_proc_maps_cache()
+
+        result = []
+        vmas = self._proc_maps_cache.find_all(addrs, inclusive_end=True)
+        for (addr, vma) in zip(addrs, vmas):
+            if vma:
+                result.append('%s+%x' % (vma[2], addr - vma[0]))
+            else:
+                result.append(None)
+        return result
 
     def _build_proc_maps_cache(self):
         '''Generate self._proc_maps_cache from ProcMaps field.
 
-        This only gets done once.
+        This is a VMAIndex of (start, end, ELF path) mappings. This only gets
+        done once.
         '''
         if self._proc_maps_cache:
             return
 
         assert 'ProcMaps' in self
-        self._proc_maps_cache = []
+        vmas = []
         # library paths might have spaces, so we need to make some assumptions
         # about the intermediate fields. But we know that in between the pre-last
         # data field and the path there are many spaces, while between the
@@ -1600,8 +2369,9 @@ class Report(problem_report.ProblemReport):
                 # but complain otherwise, as this means we encounter an
                 # architecture or new kernel version where the format changed
                 assert m, 'cannot parse ProcMaps line: ' + line
-            self._proc_maps_cache.append((int(m.group(1), 16),
-                                          int(m.group(2), 16), m.group(3)))
+            vmas.append((int(m.group(1), 16), int(m.group(2), 16), m.group(3)))
+
+        self._proc_maps_cache = VMAIndex(vmas)
 
     @classmethod
     def get_logind_session(klass, pid):
@@ -0,0 +1,294 @@
+'''Resumable chunked HTTP uploads.
+
+This implements the client side of the core protocol of tus
+(https://tus.io/protocols/resumable-upload.html) with the "creation" and
+"creation-defer-length" extensions:
+
+ - A POST request to the upload URL creates an upload resource, whose URL is
+   returned in the Location: header. The size of the data is given in
+   Upload-Length:, or if it is not known in advance (for generated data),
+   deferred with "Upload-Defer-Length: 1".
+ - PATCH requests to the resource append data at the given Upload-Offset:.
+   The response has the new offset. If the size was deferred, it is sent
+   along with the last data.
+ - A HEAD request to the resource returns the current Upload-Offset:, so that
+   an interrupted upload can continue where the server left off.
+
+The data is sent in chunks. Only the current chunk is kept in memory until
+the server confirmed it, so that the memory needed for resuming is bounded
+by the chunk size even for generated data of unknown size.
+'''
+
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os, sys, time, socket
+
+if sys.version_info.major == 2:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit, urljoin
+    _python2 = True
+else:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit, urljoin
+    _python2 = False
+
+tus_version = '1.0.0'
+
+# maximum size of the data sent in one PATCH request
+chunk_size = 4 * 1048576
+
+# chunks are written to the connection in blocks of that size; progress is
+# reported for each
+send_block_size = 65536
+
+# statuses of failed requests which are worth retrying: 409 means that the
+# offset did not match the server's, which is fixed by asking it again
+_retry_statuses = (408, 409, 423, 429)
+
+
+class UploadError(Exception):
+    '''An upload failed, and retrying did not help or cannot help.'''
+    pass
+
+
+def blob_blocks(blob):
+    '''Generate the data of a blob in blocks.
+
+    blob can be a file-like object or an iterable of bytes blocks. Return a
+    (generator, total size) pair; the size is None if it is not known in
+    advance.
+    '''
+    if not hasattr(blob, 'read'):
+        return (iter(blob), None)
+
+    try:
+        total = os.fstat(blob.fileno()).st_size - blob.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        total = None
+
+    def read_blocks():
+        while True:
+            block = blob.read(1048576)
+            if not block:
+                break
+            yield block
+    return (read_blocks(), total)
+
+
+def _chunks(blocks, size):
+    '''Generate (chunk, last) pairs of at most size bytes from blocks.
+
+    Blocks are only read as far as needed to know whether a chunk is the
+    last one.
+    '''
+    buf = bytearray()
+    for block in blocks:
+        buf.extend(block)
+        while len(buf) > size:
+            yield (bytes(buf[:size]), False)
+            del buf[:size]
+    yield (bytes(buf), True)
+
+
+class _Connection:
+    '''Persistent HTTP(S) connection, which is reopened after errors.'''
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.conn = None
+        self.server = None
+
+    def request(self, method, url, body=None, headers={}):
+        '''Send a request and return the response.
+
+        The response body is read and discarded.
+        '''
+        parts = urlsplit(url)
+        if self.conn is None or self.server != (parts.scheme, parts.netloc):
+            self.close()
+            if parts.scheme == 'https':
+                self.conn = HTTPSConnection(parts.netloc, timeout=self.timeout)
+            else:
+                self.conn = HTTPConnection(parts.netloc, timeout=self.timeout)
+            self.server = (parts.scheme, parts.netloc)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if _python2 and body is not None and not isinstance(body, bytes):
+            # httplib cannot send iterables
+            body = b''.join(body)
+
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            response.read()
+        except Exception:
+            self.close()
+            raise
+        return response
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class _Transient(Exception):
+    '''A request failed in a way which is worth retrying.'''
+    pass
+
+
+def _check_status(what, response, statuses):
+    '''Check that a response has one of the expected statuses.
+
+    Raise _Transient for failures which are worth retrying (server errors,
+    and offset conflicts which are fixed by asking the server again), and
+    UploadError for all others.
+    '''
+    if response.status in statuses:
+        return
+    message = '%s failed: %i %s' % (what, response.status, response.reason)
+    if response.status >= 500 or response.status in _retry_statuses:
+        raise _Transient(message)
+    raise UploadError(message)
+
+
+def _offset(response, low, high):
+    '''Return the Upload-Offset of a response.
+
+    It must be between low and high, as the server cannot lose confirmed data
+    nor have more than was sent.
+    '''
+    try:
+        offset = int(response.getheader('Upload-Offset'))
+    except (TypeError, ValueError):
+        raise _Transient('invalid Upload-Offset: %s' % response.getheader('Upload-Offset'))
+    if not low <= offset <= high:
+        raise UploadError('server has upload offset %i, expected %i to %i' % (offset, low, high))
+    return offset
+
+
+def _send_blocks(chunk, pos, offset, total, progress_callback):
+    '''Generate the rest of a chunk from pos on in blocks, reporting progress.
+
+    offset is the position of chunk[pos] in the whole upload.
+    '''
+    for i in range(pos, len(chunk), send_block_size):
+        if progress_callback:
+            progress_callback(offset + i - pos, total)
+        yield chunk[i:i + send_block_size]
+
+
+def upload(url, blob, progress_callback=None, headers={}, retries=5,
+           backoff=1.0, timeout=60):
+    '''Upload blob to a resumable upload server.
+
+    url is the upload creation URL of the server. blob can be a file-like
+    object, or an iterable of bytes blocks like ProblemReport.iter_mime(),
+    which is only consumed as far as needed.
+
+    progress_callback can be set to a function(sent, total) which is
+    regularly called with the number of bytes already sent and total number
+    of bytes to send. total is None if the size of the blob is not known in
+    advance. After an interruption, sent goes back to what the server
+    confirmed.
+
+    headers are sent with every request, e. g. for authentication.
+
+    Failed requests (network errors, timeouts, and server errors) are retried
+    up to retries times in a row, waiting backoff seconds before the first
+    retry and doubling that for each further one. The upload then continues
+    at the offset which the server has.
+
+    Return the headers of the final response (of the request which completed
+    the upload). Raise an UploadError if the upload fails.
+    '''
+    (blocks, total) = blob_blocks(blob)
+    conn = _Connection(timeout)
+    tus_headers = dict(headers)
+    tus_headers['Tus-Resumable'] = tus_version
+
+    def retry(attempt, error):
+        if attempt > retries:
+            raise UploadError('upload to %s failed after %i retries: %s' % (url, retries, error))
+        time.sleep(backoff * 2 ** (attempt - 1))
+
+    # create upload resource
+    create_headers = dict(tus_headers)
+    if total is None:
+        create_headers['Upload-Defer-Length'] = '1'
+    else:
+        create_headers['Upload-Length'] = str(total)
+    attempt = 0
+    while True:
+        try:
+            response = conn.request('POST', url, b'', create_headers)
+            _check_status('creating upload', response, (201,))
+            if not response.getheader('Location'):
+                raise UploadError('server did not return an upload location')
+            break
+        except (socket.error, HTTPException, _Transient) as e:
+            attempt += 1
+            retry(attempt, e)
+    location = urljoin(url, response.getheader('Location'))
+
+    try:
+        offset = 0
+        for (chunk, last) in _chunks(blocks, chunk_size):
+            start = offset
+            end = start + len(chunk)
+            final = None
+            resync = False
+            length_sent = total is not None
+            attempt = 0
+            while True:
+                try:
+                    if resync:
+                        response = conn.request('HEAD', location, None, tus_headers)
+                        _check_status('getting upload offset', response, (200, 204))
+                        offset = _offset(response, start, end)
+                        resync = False
+                        if offset == end and not last:
+                            break
+                        # the length must only be declared once
+                        length_sent = length_sent or bool(response.getheader('Upload-Length'))
+                        # if the server already has everything, the response
+                        # to the final request got lost; send an empty one to
+                        # get a final response (with the server's result
+                        # headers) again
+
+                    patch_headers = dict(tus_headers)
+                    patch_headers['Upload-Offset'] = str(offset)
+                    patch_headers['Content-Type'] = 'application/offset+octet-stream'
+                    patch_headers['Content-Length'] = str(end - offset)
+                    if last and not length_sent:
+                        patch_headers['Upload-Length'] = str(end)
+                    body = _send_blocks(chunk, offset - start, offset, total, progress_callback)
+                    response = conn.request('PATCH', location, body, patch_headers)
+                    _check_status('sending data', response, (200, 204))
+                    new_offset = _offset(response, offset, end)
+                    if new_offset == offset and offset < end:
+                        raise _Transient('server did not accept any data')
+                    offset = new_offset
+                    attempt = 0
+                    if progress_callback:
+                        progress_callback(offset, total)
+                    if offset == end:
+                        final = response
+                        break
+                except (socket.error, HTTPException, _Transient) as e:
+                    # the server might have stored a part of the data
+                    resync = True
+                    attempt += 1
+                    retry(attempt, e)
+    finally:
+        conn.close()
+
+    return final.msg
@@ -1216,7 +1216,11 @@ class UserInterface:
 
         def progress_callback(sent, total):
             global __upload_progress
-            __upload_progress = float(sent) / total
+            if total:
+                __upload_progress = float(sent) / total
+            else:
+                # size not known in advance
+                __upload_progress = None
 
         # drop internal/uninteresting keys, that start with "_"
         for k in list(self.report):
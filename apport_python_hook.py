@@ -53,6 +53,10 @@ def apport_excepthook(exc_type, exc_obj, exc_tb):
         if not enabled():
             return
 
+        if os.environ.get('APPORT_PYTHON_HOOK_MINIMAL'):
+            write_minimal_report(exc_type, exc_obj, exc_tb)
+            return
+
         try:
             from cStringIO import StringIO
             StringIO  # pyflakes
@@ -60,21 +64,11 @@ def apport_excepthook(exc_type, exc_obj, exc_tb):
             from io import StringIO
 
         import re, traceback
-        from apport.fileutils import likely_packaged, get_recent_crashes
-
-        # apport will look up the package from the executable path.
-        try:
-            binary = os.path.realpath(os.path.join(os.getcwd(), sys.argv[0]))
-        except (TypeError, AttributeError, IndexError):
-            # the module has mutated sys.argv, plan B
-            try:
-                binary = os.readlink('/proc/%i/exe' % os.getpid())
-            except OSError:
-                return
+        from apport.fileutils import likely_packaged
+        import apport.crashrate
 
-        # for interactive python sessions, sys.argv[0] == ''; catch that and
-        # other irregularities
-        if not os.access(binary, os.X_OK) or not os.path.isfile(binary):
+        binary = _crashed_binary()
+        if not binary:
             return
 
         # filter out binaries in user accessible paths
@@ -121,15 +115,14 @@ def apport_excepthook(exc_type, exc_obj, exc_tb):
         mangled_program = re.sub('/', '_', binary)
         # get the uid for now, user name later
         user = os.getuid()
-        pr_filename = '%s/%s.%i.crash' % (os.environ.get(
-            'APPORT_REPORT_DIR', '/var/crash'), mangled_program, user)
+        report_dir = os.environ.get('APPORT_REPORT_DIR', '/var/crash')
+        pr_filename = '%s/%s.%i.crash' % (report_dir, mangled_program, user)
         crash_counter = 0
         if os.path.exists(pr_filename):
             if apport.fileutils.seen_report(pr_filename):
                 # flood protection
-                with open(pr_filename, 'rb') as f:
-                    crash_counter = get_recent_crashes(f) + 1
-                if crash_counter > 1:
+                crash_counter = apport.crashrate.recent_crashes(report_dir, binary, user)
+                if crash_counter >= apport.crashrate.max_reports:
                     return
 
                 # remove the old file, so that we can create the new one with
@@ -143,6 +136,7 @@ def apport_excepthook(exc_type, exc_obj, exc_tb):
             pr['CrashCounter'] = str(crash_counter)
         with os.fdopen(os.open(pr_filename,
                                os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o640), 'wb') as f:
+            apport.crashrate.record_crash(report_dir, binary, user)
             pr.write(f)
 
     finally:
@@ -152,6 +146,142 @@ def apport_excepthook(exc_type, exc_obj, exc_tb):
             sys.__excepthook__(exc_type, exc_obj, exc_tb)
 
 
+def _crashed_binary():
+    '''Return the path of the crashed program.
+
+    Return None if it cannot be determined or is not an executable file.
+    '''
+    # apport will look up the package from the executable path.
+    try:
+        binary = os.path.realpath(os.path.join(os.getcwd(), sys.argv[0]))
+    except (TypeError, AttributeError, IndexError):
+        # the module has mutated sys.argv, plan B
+        try:
+            binary = os.readlink('/proc/%i/exe' % os.getpid())
+        except OSError:
+            return None
+
+    # for interactive python sessions, sys.argv[0] == ''; catch that and
+    # other irregularities
+    if not os.access(binary, os.X_OK) or not os.path.isfile(binary):
+        return None
+    return binary
+
+
+def _read_proc(name):
+    '''Read a /proc/self file, return '' on failure.'''
+
+    try:
+        with open('/proc/self/' + name, 'rb') as f:
+            return f.read().decode('UTF-8', 'replace')
+    except (IOError, OSError):
+        return ''
+
+
+def write_minimal_report(exc_type, exc_obj, exc_tb):
+    '''Write a compact crash report for an uncaught exception.
+
+    This is used instead of the full report if $APPORT_PYTHON_HOOK_MINIMAL is
+    set. Apart from a few standard library modules it only needs
+    apport.crashrate, does not collect ProcMaps or UserGroups, and does not
+    check the ignore lists. This keeps the overhead low for crash looping services;
+    the report gets completed later on by the UI or whoopsie-upload-all like
+    every other crash report.
+    '''
+    import time, traceback
+    import apport.crashrate
+
+    binary = _crashed_binary()
+    # filter out binaries in user accessible paths, like
+    # apport.fileutils.likely_packaged()
+    if not binary or not binary.startswith(('/bin/', '/boot', '/etc/', '/initrd',
+                                            '/lib', '/sbin/', '/opt', '/usr/',
+                                            '/var')) or \
+            binary.startswith(('/usr/local/', '/var/lib/')):
+        return
+
+    report = {'ProblemType': 'Crash', 'Date': time.asctime()}
+
+    if hasattr(exc_obj, 'get_dbus_name'):
+        name = exc_obj.get_dbus_name()
+        if name == 'org.freedesktop.DBus.Error.NoReply':
+            # see apport_excepthook()
+            return
+        elif name != 'org.freedesktop.DBus.Error.ServiceUnknown':
+            report['_PythonExceptionQualifier'] = name
+    if exc_type == OSError and exc_obj.errno is not None:
+        report['_PythonExceptionQualifier'] = str(exc_obj.errno)
+
+    report['Traceback'] = ''.join(traceback.format_exception(
+        exc_type, exc_obj, exc_tb)).strip()
+    report['ExecutablePath'] = binary
+    report['ExecutableTimestamp'] = str(int(os.stat(binary).st_mtime))
+    try:
+        report['InterpreterPath'] = os.readlink('/proc/self/exe')
+    except OSError:
+        pass
+    try:
+        report['ProcCwd'] = os.getcwd()
+    except OSError:
+        pass
+    cmdline = _read_proc('cmdline').rstrip('\0')
+    report['ProcCmdline'] = cmdline.replace('\\', '\\\\').replace(' ', '\\ ').replace('\0', ' ')
+    report['ProcStatus'] = _read_proc('status').strip()
+
+    # same filtering as apport.report.Report.add_proc_environ()
+    env = []
+    for var in ['SHELL', 'TERM', 'LANGUAGE', 'LANG', 'LC_CTYPE', 'LC_COLLATE',
+                'LC_TIME', 'LC_NUMERIC', 'LC_MONETARY', 'LC_MESSAGES',
+                'LC_PAPER', 'LC_NAME', 'LC_ADDRESS', 'LC_TELEPHONE',
+                'LC_MEASUREMENT', 'LC_IDENTIFICATION', 'LOCPATH', 'PYTHONPATH',
+                'PYTHONHOME']:
+        if var in os.environ:
+            env.append('%s=%s' % (var, os.environ[var]))
+    path = os.environ.get('PATH')
+    if path and ('/home' in path or '/tmp' in path):
+        env.append('PATH=(custom, user)')
+    elif path and path != '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/usr/games':
+        env.append('PATH=(custom, no user)')
+    for var in ['XDG_RUNTIME_DIR', 'LD_PRELOAD', 'LD_LIBRARY_PATH']:
+        if var in os.environ:
+            env.append(var + '=<set>')
+    report['ProcEnviron'] = '\n'.join(env)
+    if 'XDG_CURRENT_DESKTOP' in os.environ:
+        report['CurrentDesktop'] = os.environ['XDG_CURRENT_DESKTOP']
+    try:
+        report['PythonArgs'] = '%r' % sys.argv
+    except AttributeError:
+        pass
+
+    report_dir = os.environ.get('APPORT_REPORT_DIR', '/var/crash')
+    pr_filename = '%s/%s.%i.crash' % (report_dir, binary.replace('/', '_'), os.getuid())
+    if os.path.exists(pr_filename):
+        st = os.stat(pr_filename)
+        if st.st_atime <= st.st_mtime and st.st_size > 0:
+            # don't clobber existing unseen report
+            return
+        # flood protection
+        crash_counter = apport.crashrate.recent_crashes(report_dir, binary, os.getuid())
+        if crash_counter >= apport.crashrate.max_reports:
+            return
+        os.unlink(pr_filename)
+        if crash_counter:
+            report['CrashCounter'] = str(crash_counter)
+
+    # same layout as problem_report.ProblemReport.write()
+    out = []
+    for key in ['ProblemType'] + sorted(k for k in report if k != 'ProblemType'):
+        value = report[key]
+        if '\n' in value:
+            out.append('%s:\n %s\n' % (key, value.replace('\n', '\n ')))
+        else:
+            out.append('%s: %s\n' % (key, value))
+    with os.fdopen(os.open(pr_filename,
+                           os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o640), 'wb') as f:
+        apport.crashrate.record_crash(report_dir, binary, os.getuid())
+        f.write(''.join(out).encode('UTF-8'))
+
+
 def dbus_service_unknown_analysis(exc_obj, report):
     from glob import glob
     import subprocess, re
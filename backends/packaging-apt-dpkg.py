@@ -12,12 +12,13 @@ This is used on Debian and derivatives such as Ubuntu.
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
-import subprocess, os, glob, stat, sys, tempfile, shutil, time
+import subprocess, os, glob, stat, sys, tempfile, shutil, time, atexit
 import errno
 import hashlib
 import json
 
 from contextlib import closing
+from multiprocessing.pool import ThreadPool
 
 import warnings
 warnings.filterwarnings('ignore', 'apt API not stable yet', FutureWarning)
@@ -52,6 +53,9 @@ class __AptDpkgPackageInfo(PackageInfo):
         self._launchpad_base = 'https://api.launchpad.net/devel'
         self._archive_url = self._launchpad_base + '/%s/main_archive'
         self._ppa_archive_url = self._launchpad_base + '/~%(user)s/+archive/%(distro)s/%(ppaname)s'
+        self._md5_cache_file = '/var/cache/apport/md5sums.json'
+        self._md5_cache = None
+        self._md5_cache_dirty = False
 
     def __del__(self):
         try:
@@ -1077,33 +1081,131 @@ Debug::NoLocking "true";
             raise ValueError('package does not exist')
 
     def _check_files_md5(self, sumfile):
-        '''Internal function for calling md5sum.
-
-        This is separate from get_modified_files so that it is automatically
-        testable.
+        '''Check files against a list of md5sums.
+
+        sumfile is either the path of a file in md5sum format, or its
+        contents as a byte array. Relative paths are relative to the root
+        directory. Return the list of paths (as they appear in sumfile) whose
+        contents do not match; missing or unreadable files are ignored.
+
+        Checksums are calculated in-process in a thread pool. Verified
+        checksums are kept in a persistent cache (_md5_cache_file) together
+        with the file's inode, size, mtime, and ctime, so that unchanged
+        files do not need to be read again. New checksums are written back
+        once when the process exits.
         '''
         if os.path.exists(sumfile):
-            m = subprocess.Popen(['/usr/bin/md5sum', '-c', sumfile],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                 cwd='/', env={})
-            out = m.communicate()[0].decode('UTF-8', errors='replace')
+            with open(sumfile, 'rb') as fd:
+                sums = fd.read()
         else:
             assert type(sumfile) == bytes, 'md5sum list value must be a byte array'
-            m = subprocess.Popen(['/usr/bin/md5sum', '-c'],
-                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, cwd='/', env={})
-            out = m.communicate(sumfile)[0].decode('UTF-8', errors='replace')
+            sums = sumfile
 
-        # if md5sum succeeded, don't bother parsing the output
-        if m.returncode == 0:
-            return []
+        files = []
+        for line in sums.splitlines():
+            # "<md5>  <path>" or "<md5> *<path>"
+            if len(line) < 35 or line[32:33] != b' ':
+                continue
+            files.append((line[:32].decode('ASCII', errors='replace').lower(),
+                          line[34:]))
+
+        cache = self._load_md5_cache()
+        results = {}
+        todo = []
+        for (md5, path) in files:
+            abspath = os.path.join(b'/', path)
+            try:
+                st = os.stat(abspath)
+            except OSError:
+                continue
+            key = abspath.decode('UTF-8', errors='replace')
+            validator = [st.st_ino, st.st_size, st.st_mtime, st.st_ctime]
+            cached = cache.get(key)
+            if cached and cached[:4] == validator:
+                results[path] = cached[4]
+            else:
+                todo.append((path, abspath, key, validator))
 
-        mismatches = []
-        for l in out.splitlines():
-            if l.endswith('FAILED'):
-                mismatches.append(l.rsplit(':', 1)[0])
+        def md5_file(args):
+            (path, abspath, key, validator) = args
+            m = hashlib.md5()
+            try:
+                with open(abspath, 'rb') as fd:
+                    while True:
+                        block = fd.read(1048576)
+                        if not block:
+                            break
+                        m.update(block)
+            except (IOError, OSError):
+                return (args, None)
+            return (args, m.hexdigest())
 
-        return mismatches
+        if todo:
+            pool = ThreadPool(min(len(todo), 8))
+            try:
+                for ((path, abspath, key, validator), md5) in pool.map(md5_file, todo):
+                    if md5 is not None:
+                        results[path] = md5
+                        cache[key] = validator + [md5]
+                        if not self._md5_cache_dirty:
+                            self._md5_cache_dirty = True
+                            atexit.register(self._save_md5_cache)
+            finally:
+                pool.close()
+
+        return [path.decode('UTF-8', errors='replace') for (md5, path) in files
+                if path in results and results[path] != md5]
+
+    def _load_md5_cache(self):
+        '''Return the persistent md5 verification cache.
+
+        This maps a file path to [inode, size, mtime, ctime, md5].
+        '''
+        if self._md5_cache is None:
+            try:
+                with open(self._md5_cache_file) as fd:
+                    self._md5_cache = json.load(fd)
+                if not isinstance(self._md5_cache, dict):
+                    self._md5_cache = {}
+            except (IOError, OSError, ValueError):
+                self._md5_cache = {}
+        return self._md5_cache
+
+    def _save_md5_cache(self):
+        '''Write back the md5 verification cache, if permissions allow.
+
+        The cache directory is created if it does not exist yet.
+
+        Entries of files which went away or changed since they were verified
+        are dropped, so that the cache does not grow without bounds.
+        '''
+        if not self._md5_cache_dirty:
+            return
+        self._md5_cache_dirty = False
+
+        cache = {}
+        for (path, entry) in self._md5_cache.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry[:4] == [st.st_ino, st.st_size, st.st_mtime, st.st_ctime]:
+                cache[path] = entry
+
+        cache_dir = os.path.dirname(self._md5_cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o755)
+            (fd, tmp) = tempfile.mkstemp(prefix='.md5sums', dir=cache_dir)
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self._md5_cache_file)
+        except (IOError, OSError):
+            os.unlink(tmp)
 
     @classmethod
     def _get_primary_mirror_from_apt_sources(klass, apt_sources):
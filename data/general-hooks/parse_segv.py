@@ -14,6 +14,8 @@
 
 import sys, re, logging, io
 
+from apport.procmaps import VMAIndex
+
 
 class ParseSegv(object):
     def __init__(self, registers, disassembly, maps, debug=False):
@@ -35,11 +37,12 @@ class ParseSegv(object):
 
         self.stack_vma = None
         self.maps = self.parse_maps(maps)
+        self.vma_index = VMAIndex([(vma['start'], vma['end'], vma) for vma in self.maps])
 
     def find_vma(self, addr):
-        for vma in self.maps:
-            if addr >= vma['start'] and addr < vma['end']:
-                return vma
+        vma = self.vma_index.find(addr)
+        if vma:
+            return vma[2]
         return None
 
     def parse_maps(self, maps_str):
@@ -11,21 +11,74 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
-import zlib, base64, time, sys, gzip, struct, os
-from email.encoders import encode_base64
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
+import zlib, base64, time, sys, gzip, struct, os, random, codecs
 from io import BytesIO
 
 if sys.version[0] < '3':
     from UserDict import IterableUserDict as UserDict
     UserDict  # pyflakes
+    _encodebytes = base64.encodestring
     _python2 = True
 else:
     from collections import UserDict
+    _encodebytes = base64.encodebytes
     _python2 = False
 
+# control characters which are not whitespace, as single byte strings
+_binary_chars = [bytes(bytearray([c])) for c in range(32) if not chr(c).isspace()]
+
+
+def _mime_header_value(value):
+    '''Return a MIME header value as bytes, RFC 2047 encoded if necessary.'''
+
+    try:
+        return value.encode('ASCII')
+    except UnicodeError:
+        from email.header import Header
+        return Header(value, 'UTF-8').encode().encode('ASCII')
+
+
+def _mime_part_header(content_type, disposition):
+    '''Return the header block of a base64 encoded MIME part.'''
+
+    return (b'Content-Type: ' + content_type + b'\nMIME-Version: 1.0\n'
+            b'Content-Transfer-Encoding: base64\n'
+            b'Content-Disposition: ' + disposition + b'\n\n')
+
+
+def _base64_lines(blocks):
+    '''Generate base64 encoded MIME body lines from an iterable of bytes blocks.
+
+    Lines are 76 characters long, so encoding happens in multiples of 57
+    bytes; the remainder of a block is carried over to the next one.
+    '''
+    rest = b''
+    for block in blocks:
+        if rest:
+            block = rest + block
+        cut = len(block) - len(block) % 57
+        rest = block[cut:]
+        # keep the encoded blocks small
+        for i in range(0, cut, 57 * 16384):
+            yield _encodebytes(block[i:min(i + 57 * 16384, cut)])
+    if rest:
+        yield _encodebytes(rest)
+
+
+def _utf8_blocks(value, size=1048576):
+    '''Generate the UTF-8 encoding of a text value in blocks.
+
+    Invalid UTF-8 sequences in byte arrays are replaced.
+    '''
+    if type(value) == bytes:
+        decoder = codecs.getincrementaldecoder('UTF-8')('replace')
+        for i in range(0, len(value), size):
+            yield decoder.decode(value[i:i + size]).encode('UTF-8')
+        yield decoder.decode(b'', True).encode('UTF-8')
+    else:
+        for i in range(0, len(value), size):
+            yield value[i:i + size].encode('UTF-8')
+
 
 class CompressedValue:
     '''Represent a ProblemReport value which is gzip compressed.'''
@@ -127,6 +180,9 @@ class ProblemReport(UserDict):
         self.data.clear()
         key = None
         value = None
+        # continuation data of the current key, joined once at the end, as
+        # appending to immutable bytes is quadratic
+        chunks = None
         b64_block = False
         bd = None
         if key_filter:
@@ -142,40 +198,33 @@ class ProblemReport(UserDict):
                 if b64_block:
                     block = base64.b64decode(line)
                     if bd:
-                        value += bd.decompress(block)
+                        chunks.append(bd.decompress(block))
+                    elif binary == 'compressed':
+                        # check gzip header; if absent, we have legacy zlib
+                        # data
+                        if not chunks and not block.startswith(b'\037\213\010'):
+                            value.legacy_zlib = True
+                        chunks.append(block)
                     else:
-                        if binary == 'compressed':
-                            # check gzip header; if absent, we have legacy zlib
-                            # data
-                            if value.gzipvalue == b'' and not block.startswith(b'\037\213\010'):
-                                value.legacy_zlib = True
-                            value.gzipvalue += block
+                        # lazy initialization of bd
+                        # skip gzip header, if present
+                        if block.startswith(b'\037\213\010'):
+                            bd = zlib.decompressobj(-zlib.MAX_WBITS)
+                            chunks.append(bd.decompress(self._strip_gzip_header(block)))
                         else:
-                            # lazy initialization of bd
-                            # skip gzip header, if present
-                            if block.startswith(b'\037\213\010'):
-                                bd = zlib.decompressobj(-zlib.MAX_WBITS)
-                                value = bd.decompress(self._strip_gzip_header(block))
-                            else:
-                                # legacy zlib-only format used default block
-                                # size
-                                bd = zlib.decompressobj()
-                                value += bd.decompress(block)
+                            # legacy zlib-only format used default block
+                            # size
+                            bd = zlib.decompressobj()
+                            chunks.append(bd.decompress(block))
                 else:
-                    if len(value) > 0:
-                        value += b'\n'
                     if line.endswith(b'\n'):
-                        value += line[1:-1]
+                        chunks.append(line[1:-1])
                     else:
-                        value += line[1:]
+                        chunks.append(line[1:])
             else:
-                if b64_block:
-                    if bd:
-                        value += bd.flush()
-                    b64_block = False
-                    bd = None
                 if key:
                     assert value is not None
+                    value = self._join_value(value, chunks, b64_block, bd)
                     if remaining_keys is not None:
                         try:
                             remaining_keys.remove(key)
@@ -187,21 +236,23 @@ class ProblemReport(UserDict):
                             pass
                     else:
                         self.data[key] = self._try_unicode(value)
+                b64_block = False
+                bd = None
 
                 (key, value) = line.split(b':', 1)
                 if not _python2:
                     key = key.decode('ASCII')
                 value = value.strip()
+                chunks = []
                 if value == b'base64':
                     if binary == 'compressed':
                         value = CompressedValue(key.encode())
-                        value.gzipvalue = b''
                     else:
                         value = b''
                     b64_block = True
 
         if key is not None:
-            self.data[key] = self._try_unicode(value)
+            self.data[key] = self._try_unicode(self._join_value(value, chunks, b64_block, bd))
 
         self.old_keys = set(self.data.keys())
 
@@ -278,28 +329,43 @@ class ProblemReport(UserDict):
 
     @classmethod
     def _is_binary(klass, string):
-        '''Check if the given strings contains binary data.'''
+        '''Check if the given strings contains binary data.
 
-        if _python2:
-            return klass._is_binary_py2(string)
-
-        if type(string) == bytes:
-            for c in string:
-                if c < 32 and not chr(c).isspace():
-                    return True
+        This is the case if it contains control characters which are not
+        whitespace. Unicode strings are never binary.
+        '''
+        if type(string) != bytes:
+            return False
+        # one memchr() scan per character is much faster than a Python loop
+        # over all bytes, or a regular expression character class
+        for c in _binary_chars:
+            if c in string:
+                return True
         return False
 
     @classmethod
-    def _is_binary_py2(klass, string):
-        '''Check if the given strings contains binary data. (Python 2)'''
+    def _join_value(klass, value, chunks, b64_block, bd):
+        '''Assemble a value read by load().
 
-        if type(string) == unicode:
-            return False
+        value is the part after the key on the first line (or a
+        CompressedValue for compressed binary data), chunks the list of data
+        from the continuation lines, and bd the decompressor of a binary
+        value.
+        '''
+        if b64_block:
+            if isinstance(value, CompressedValue):
+                value.gzipvalue = b''.join(chunks)
+                return value
+            if bd:
+                chunks.append(bd.flush())
+            return b''.join(chunks)
 
-        for c in string:
-            if c < ' ' and not c.isspace():
-                return True
-        return False
+        # lines are separated by newlines, but leading empty lines are dropped
+        lines = [value] + chunks
+        first = 0
+        while first < len(lines) and not lines[first]:
+            first += 1
+        return b'\n'.join(lines[first:])
 
     @classmethod
     def _try_unicode(klass, value):
@@ -527,9 +593,26 @@ class ProblemReport(UserDict):
 
         priority_fields is a set/list specifying the order in which keys should
         appear in the destination file.
+
+        The message is written incrementally, see iter_mime().
         '''
         self._assert_bin_mode(file)
 
+        for block in self.iter_mime(attach_treshold, extra_headers, skip_keys,
+                                    priority_fields):
+            file.write(block)
+
+    def iter_mime(self, attach_treshold=5, extra_headers={}, skip_keys=None,
+                  priority_fields=None):
+        '''Generate MIME/Multipart RFC 2822 formatted data.
+
+        This is a generator of bytes blocks which together are the output of
+        write_mime() (see there for the arguments). Attachments are produced
+        part by part while the generator is consumed: file references are
+        read and compressed in blocks, and the gzip data of CompressedValues
+        is used as it is. This can be passed directly to an uploader which
+        sends the data with chunked transfer encoding.
+        '''
         keys = sorted(self.data.keys())
 
         text = ''
@@ -547,97 +630,135 @@ class ProblemReport(UserDict):
                     keys.insert(counter, priority_field)
                     counter += 1
 
+        # first pass: collect the short text values for the inline part, and
+        # the keys which become attachments
         for k in keys:
             if skip_keys and k in skip_keys:
                 continue
             v = self.data[k]
-            attach_value = None
 
-            # compressed values are ready for attaching in gzip form
-            if isinstance(v, CompressedValue):
-                attach_value = v.gzipvalue
+            # compressed values, file references, and binary values are
+            # attached in gzip form
+            if isinstance(v, CompressedValue) or not hasattr(v, 'find') or \
+                    self._is_binary(v):
+                attachments.append((k, True))
+                continue
 
-            # if it's a tuple, we have a file reference; read the contents
-            # and gzip it
-            elif not hasattr(v, 'find'):
-                attach_value = ''
-                if hasattr(v[0], 'read'):
-                    f = v[0]  # file-like object
-                else:
-                    f = open(v[0], 'rb')  # file name
-                if k.endswith('.gz'):
-                    attach_value = f.read()
-                else:
-                    io = BytesIO()
-                    gf = gzip.GzipFile(k, mode='wb', fileobj=io, mtime=0)
-                    while True:
-                        block = f.read(1048576)
-                        if block:
-                            gf.write(block)
-                        else:
-                            gf.close()
-                            break
-                    attach_value = io.getvalue()
-                f.close()
+            # plain text value
+            size = len(v)
+            if size > 1000:
+                # too large, separate attachment
+                attachments.append((k, False))
+                continue
 
-            # binary value
-            elif self._is_binary(v):
-                if k.endswith('.gz'):
-                    attach_value = v
-                else:
-                    attach_value = CompressedValue(v, k).gzipvalue
+            # ensure that byte arrays are valid UTF-8
+            if type(v) == bytes:
+                v = v.decode('UTF-8', 'replace')
+            # convert unicode to UTF-8 str
+            if _python2:
+                assert isinstance(v, unicode)
+            else:
+                assert isinstance(v, str)
+
+            lines = len(v.splitlines())
+            if lines == 1:
+                v = v.rstrip()
+                text += k + ': ' + v + '\n'
+            elif lines <= attach_treshold:
+                text += k + ':\n '
+                if not v.endswith('\n'):
+                    v += '\n'
+                text += v.strip().replace('\n', '\n ') + '\n'
+            else:
+                # too many lines, separate attachment
+                attachments.append((k, False))
+
+        boundary = ('=' * 15 + '%i==' % random.randrange(sys.maxsize)).encode('ASCII')
 
-            # if we have an attachment value, create an attachment
-            if attach_value:
-                att = MIMEBase('application', 'x-gzip')
+        header = [b'Content-Type: multipart/mixed; boundary="' + boundary + b'"',
+                  b'MIME-Version: 1.0']
+        for k, v in extra_headers.items():
+            header.append(k.encode('ASCII') + b': ' + _mime_header_value(v))
+        yield b'\n'.join(header) + b'\n\n'
+
+        # initial text attachment
+        yield b'--' + boundary + b'\n' + _mime_part_header(
+            b'text/plain; charset="utf-8"', b'inline')
+        for block in _base64_lines([text.encode('UTF-8')]):
+            yield block
+
+        for (k, gz) in attachments:
+            v = self.data[k]
+            if gz:
                 if k.endswith('.gz'):
-                    att.add_header('Content-Disposition', 'attachment', filename=k)
+                    filename = k
                 else:
-                    att.add_header('Content-Disposition', 'attachment', filename=k + '.gz')
-                att.set_payload(attach_value)
-                encode_base64(att)
-                attachments.append(att)
+                    filename = k + '.gz'
+                yield b'\n--' + boundary + b'\n' + _mime_part_header(
+                    b'application/x-gzip', b'attachment; filename="' + filename.encode('UTF-8') + b'"')
+                blocks = self._gzip_blocks(k, v)
             else:
-                # plain text value
-                size = len(v)
-
-                # ensure that byte arrays are valid UTF-8
-                if type(v) == bytes:
-                    v = v.decode('UTF-8', 'replace')
-                # convert unicode to UTF-8 str
-                if _python2:
-                    assert isinstance(v, unicode)
-                else:
-                    assert isinstance(v, str)
-
-                lines = len(v.splitlines())
-                if size <= 1000 and lines == 1:
-                    v = v.rstrip()
-                    text += k + ': ' + v + '\n'
-                elif size <= 1000 and lines <= attach_treshold:
-                    text += k + ':\n '
-                    if not v.endswith('\n'):
-                        v += '\n'
-                    text += v.strip().replace('\n', '\n ') + '\n'
-                else:
-                    # too large, separate attachment
-                    att = MIMEText(v, _charset='UTF-8')
-                    att.add_header('Content-Disposition', 'attachment', filename=k + '.txt')
-                    attachments.append(att)
+                yield b'\n--' + boundary + b'\n' + _mime_part_header(
+                    b'text/plain; charset="utf-8"',
+                    b'attachment; filename="' + k.encode('UTF-8') + b'.txt"')
+                blocks = _utf8_blocks(v)
 
-        # create initial text attachment
-        att = MIMEText(text, _charset='UTF-8')
-        att.add_header('Content-Disposition', 'inline')
-        attachments.insert(0, att)
+            for block in _base64_lines(blocks):
+                yield block
 
-        msg = MIMEMultipart()
-        for k, v in extra_headers.items():
-            msg.add_header(k, v)
-        for a in attachments:
-            msg.attach(a)
+        yield b'\n--' + boundary + b'--\n'
+
+    @classmethod
+    def _gzip_blocks(klass, key, value):
+        '''Generate the gzip compressed data of a binary value.
 
-        file.write(msg.as_string().encode('UTF-8'))
-        file.write(b'\n')
+        value can be a CompressedValue, a bytes value, or a file reference
+        tuple (which is closed at the end). Data which already is gzip
+        compressed (CompressedValues, and values of keys ending in .gz) is
+        passed through unchanged.
+        '''
+        if isinstance(value, CompressedValue):
+            if value.legacy_zlib:
+                yield CompressedValue(value.get_value(), key).gzipvalue
+            else:
+                yield value.gzipvalue
+            return
+
+        if hasattr(value, 'find'):
+            f = BytesIO(value)
+        elif hasattr(value[0], 'read'):
+            f = value[0]  # file-like object
+        else:
+            f = open(value[0], 'rb')  # file name
+
+        try:
+            if key.endswith('.gz'):
+                while True:
+                    block = f.read(1048576)
+                    if not block:
+                        break
+                    yield block
+                return
+
+            # same format as gzip.GzipFile(key, mtime=0) writes
+            yield b'\037\213\010\010\000\000\000\000\002\377' + key.encode('UTF-8') + b'\000'
+            crc = zlib.crc32(b'')
+            size = 0
+            bc = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zlib.DEF_MEM_LEVEL, 0)
+            while True:
+                block = f.read(1048576)
+                if not block:
+                    break
+                size += len(block)
+                crc = zlib.crc32(block, crc)
+                outblock = bc.compress(block)
+                if outblock:
+                    yield outblock
+            yield (bc.flush() + struct.pack('<L', crc & 0xFFFFFFFF) +
+                   struct.pack('<L', size & 0xFFFFFFFF))
+        finally:
+            f.close()
 
     def __setitem__(self, k, v):
         assert hasattr(k, 'isalnum')
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# Benchmark Report.anonymize() on large thread stack traces: one combined scan
+# per value against one re.sub() pass per identifying string (the previous
+# implementation).
+#
+# Run from the source tree root: python3 test/benchmarks/anonymize.py [MB]
+#
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import sys, os, re, pwd, time
+
+sys.path.insert(0, os.getcwd())
+import apport.report
+
+# identity of a user with a full GECOS field
+user = ('joe', 'x', 1000, 1000, 'Joe Doe,Room 42,+1 555 1234,+1 555 4321', '/home/joe', '/bin/sh')
+hostname = 'joebox'
+
+frame = ('#%i  0x00007f0c2a3b4c5d in g_main_context_dispatch (context=0x55d0c8a0) '
+         'at /home/joe/src/glib/gmain.c:3203\n'
+         '        dispatch = 0x7f0c2a3b0000 <g_idle_dispatch>\n'
+         '        source = "joebox:%i"\n')
+
+
+def stack_trace(size):
+    '''Return a ThreadStacktrace like string of about size bytes.'''
+
+    frames = []
+    length = 0
+    i = 0
+    while length < size:
+        f = frame % (i % 50, i)
+        if i % 50 == 0:
+            f = '\nThread %i (Thread 0x7f0c1 (LWP %i)):\n' % (i, i) + f
+        frames.append(f)
+        length += len(f)
+        i += 1
+    return ''.join(frames)
+
+
+def sequential(patterns, value):
+    '''Previous implementation: one pass per pattern.'''
+
+    for (pattern, repl) in patterns:
+        value = re.sub(pattern, repl, value)
+    return value
+
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return (time.time() - start, result)
+
+
+def main():
+    size = int(float(len(sys.argv) > 1 and sys.argv[1] or 8) * 1000000)
+
+    orig_getuid = os.getuid
+    orig_getpwuid = pwd.getpwuid
+    orig_uname = os.uname
+    uname = os.uname()
+    os.getuid = lambda: user[2]
+    pwd.getpwuid = lambda uid: user
+    os.uname = lambda: (uname[0], hostname, uname[2], uname[3], uname[4])
+    try:
+        patterns = apport.report._anonymization_patterns()
+    finally:
+        os.getuid = orig_getuid
+        pwd.getpwuid = orig_getpwuid
+        os.uname = orig_uname
+
+    value = stack_trace(size)
+    print('%i patterns, %.1f MB ThreadStacktrace' % (len(patterns), len(value) / 1000000.))
+
+    # regular expressions of the previous implementation
+    old_patterns = []
+    for (string, repl, after_space) in patterns:
+        if after_space:
+            old_patterns.append((r'(\b|\s)%s\b' % re.escape(string), r'\1' + repl))
+        else:
+            old_patterns.append((r'\b%s\b' % re.escape(string), repl))
+    (t_seq, expected) = timed(sequential, old_patterns, value)
+    (t_comb, (result, n)) = timed(apport.report._anonymizer(patterns), value)
+    assert result == expected
+
+    print('per-pattern passes: %7.1f ms, %6.1f MB/s' % (t_seq * 1000, len(value) / t_seq / 1000000))
+    print('combined scan:      %7.1f ms, %6.1f MB/s, %i replacements' % (
+        t_comb * 1000, len(value) / t_comb / 1000000, n))
+
+
+if __name__ == '__main__':
+    main()
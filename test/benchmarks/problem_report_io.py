@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# Benchmarks for problem_report: binary detection, and writing and loading
+# reports with large text and binary fields. Loading is checked to scale
+# linearly: a four times bigger report must not take much more than four
+# times as long. For MIME generation, the peak memory allocation is shown,
+# which must stay well below the size of the attachments.
+#
+# Run from the source tree root:
+#   python3 test/benchmarks/problem_report_io.py [--size MB] [--lines N] [--binary-mb MB]
+#
+# Use --binary-mb 1024 for the full size run (needs about 3 GB of RAM).
+#
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import sys, os, time, argparse, tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.getcwd())
+import problem_report
+
+
+def is_binary_loop(string):
+    '''Previous per-byte implementation of ProblemReport._is_binary().'''
+
+    for c in string:
+        if c < 32 and not chr(c).isspace():
+            return True
+    return False
+
+
+def text_value(size):
+    line = b'#12 0x00007f0c2a3b4c5d in g_main_context_dispatch () at gmain.c:3203\n'
+    return line * (size // len(line))
+
+
+def binary_value(size):
+    # control character at the very end, so that the whole value is scanned
+    return text_value(size) + b'\x01'
+
+
+def best(f, *args, **kwargs):
+    '''Return best time of a few runs of f(*args, **kwargs).'''
+
+    runs = kwargs.pop('runs', 3)
+    times = []
+    for i in range(runs):
+        start = time.time()
+        f(*args, **kwargs)
+        times.append(time.time() - start)
+    return min(times)
+
+
+class PatternFile:
+    '''Read-only file-like object with size bytes of core dump like data.'''
+
+    block = os.urandom(4096) + b'\0' * 12288
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+        blocks = self.block * (size // len(self.block) + 1)
+        return blocks[:size]
+
+    def close(self):
+        pass
+
+
+def report(name, size, seconds):
+    print('%-32s %8.2f ms %9.1f MB/s' % (name, seconds * 1000, size / seconds / 1000000))
+
+
+def bench_is_binary(size):
+    for (name, value) in [('text', text_value(size)), ('binary', binary_value(size))]:
+        report('_is_binary() loop, %s' % name, len(value), best(is_binary_loop, value))
+        report('_is_binary(), %s' % name, len(value),
+               best(problem_report.ProblemReport._is_binary, value))
+
+
+def bench_write(size):
+    pr = problem_report.ProblemReport()
+    pr['ThreadStacktrace'] = text_value(size).decode()
+    pr['Binary'] = binary_value(size)
+    out = BytesIO()
+    pr.write(out)
+
+    report('write()', len(out.getvalue()), best(pr.write, BytesIO()))
+
+
+class NullFile:
+    '''Binary file-like object which discards written data.'''
+
+    mode = 'wb'
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def bench_write_mime(size):
+    pr = problem_report.ProblemReport()
+    pr['ThreadStacktrace'] = text_value(size).decode()
+    pr['ZValue'] = problem_report.CompressedValue(binary_value(size))
+
+    def write_mime(out):
+        pr['CoreDump'] = (PatternFile(size),)
+        pr.write_mime(out)
+        return out
+
+    report('write_mime()', write_mime(NullFile()).size, best(write_mime, NullFile()))
+
+    tracemalloc.start()
+    write_mime(NullFile())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('  peak allocation %.1f MB for %.1f MB of fields' % (peak / 1000000., 3 * size / 1000000.))
+
+
+def text_report(lines):
+    '''Return a written report with a text field of given number of lines.'''
+
+    pr = problem_report.ProblemReport()
+    pr['ThreadStacktrace'] = text_value(lines * 69).decode()
+    out = BytesIO()
+    pr.write(out)
+    return out.getvalue()
+
+
+def binary_report(size):
+    '''Return a written report with a binary field of given size.'''
+
+    pr = problem_report.ProblemReport()
+    pr['CoreDump'] = (PatternFile(size),)
+    out = BytesIO()
+    pr.write(out)
+    return out.getvalue()
+
+
+def bench_load_scaling(name, make_report, size, unit):
+    '''Load reports of size and 4 * size; return True if this scales linearly.
+
+    unit is the number of bytes of a size unit of the field.
+    '''
+    def load(data):
+        problem_report.ProblemReport().load(BytesIO(data))
+
+    times = []
+    for s in (size, 4 * size):
+        data = make_report(s)
+        times.append(best(load, data, runs=1))
+        report('load(), %s %i' % (name, s), s * unit, times[-1])
+        del data
+
+    ratio = times[1] / times[0]
+    # linear would be 4, quadratic 16; leave room for noise
+    linear = ratio < 6
+    print('  4x input: %.1fx time, %s' % (ratio, linear and 'linear' or 'NOT LINEAR'))
+    return linear
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=float, default=8,
+                        help='MB of data for _is_binary() and write() (default: %(default)s)')
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='lines of the smaller text field for load() (default: %(default)s)')
+    parser.add_argument('--binary-mb', type=int, default=64,
+                        help='MB of the larger binary field for load() (default: %(default)s)')
+    args = parser.parse_args()
+
+    size = int(args.size * 1000000)
+    bench_is_binary(size)
+    bench_write(size)
+    bench_write_mime(size)
+
+    linear = bench_load_scaling('text lines', text_report, args.lines, 69)
+    linear = bench_load_scaling('binary MB', lambda mb: binary_report(mb * 1048576),
+                                max(1, args.binary_mb // 4), 1048576) and linear
+    if not linear:
+        sys.exit('load() does not scale linearly')
+
+
+if __name__ == '__main__':
+    main()
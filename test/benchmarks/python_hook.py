@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# Benchmark the Python crash hook: latency of handling an uncaught exception
+# and the number of modules it imports, for the full and the minimal
+# ($APPORT_PYTHON_HOOK_MINIMAL) report.
+#
+# Run from the source tree root: python3 test/benchmarks/python_hook.py [runs]
+#
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os, sys, subprocess, tempfile, shutil
+
+# executed in the crashing process; prints "<seconds> <imported modules>"
+script = '''#!%s
+import sys, time
+import apport_python_hook
+
+before = set(sys.modules)
+try:
+    raise RuntimeError('benchmark')
+except RuntimeError:
+    start = time.time()
+    apport_python_hook.apport_excepthook(*sys.exc_info())
+    duration = time.time() - start
+print('%%f %%i' %% (duration, len(set(sys.modules) - before)))
+''' % sys.executable
+
+
+def measure(path, env, runs):
+    '''Return list of (seconds, imports) for runs crashes.'''
+
+    results = []
+    for i in range(runs):
+        out = subprocess.check_output([path], env=env, stderr=subprocess.DEVNULL)
+        (duration, imports) = out.decode().split()
+        results.append((float(duration), int(imports)))
+        for f in os.listdir(env['APPORT_REPORT_DIR']):
+            os.unlink(os.path.join(env['APPORT_REPORT_DIR'], f))
+    return results
+
+
+def main():
+    runs = len(sys.argv) > 1 and int(sys.argv[1]) or 20
+
+    # the hook ignores programs in user writable paths like /tmp
+    workdir = tempfile.mkdtemp(dir='/var/tmp')
+    try:
+        path = os.path.join(workdir, 'crash')
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+        report_dir = os.path.join(workdir, 'reports')
+        os.mkdir(report_dir)
+
+        env = os.environ.copy()
+        env['APPORT_REPORT_DIR'] = report_dir
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.getcwd()] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+        env.pop('APPORT_PYTHON_HOOK_MINIMAL', None)
+
+        for (name, minimal) in [('full', False), ('minimal', True)]:
+            if minimal:
+                env['APPORT_PYTHON_HOOK_MINIMAL'] = '1'
+            results = sorted(measure(path, env, runs))
+            print('%-8s median %7.2f ms, max %7.2f ms, %i modules imported' % (
+                name, results[len(results) // 2][0] * 1000,
+                results[-1][0] * 1000, max(r[1] for r in results)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
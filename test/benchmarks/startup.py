@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# Benchmark program startup: time, RSS, and number of modules for the module
+# imports of the core dump handler (data/apport), apport-cli, and the Python
+# crash hook.
+#
+# The top-level import statements are taken from the programs themselves, so
+# that this follows changes to them; each measurement runs in a fresh
+# interpreter.
+#
+# Run from the source tree root: python3 test/benchmarks/startup.py [runs]
+#
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os, sys, ast, subprocess
+
+programs = [
+    ('data/apport', 'data/apport', None),
+    ('apport-cli', 'bin/apport-cli', None),
+    ('python hook', None, 'import apport_python_hook\napport_python_hook.install()\n'),
+]
+
+# executed in a fresh interpreter; prints "<seconds> <max RSS KiB> <modules>"
+measure_script = '''
+import sys, time, resource
+before = set(sys.modules)
+start = time.time()
+exec(compile(sys.stdin.read(), 'startup', 'exec'), {'__name__': 'startup'})
+duration = time.time() - start
+print('%f %i %i' % (duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    len(set(sys.modules) - before)))
+'''
+
+
+def _is_import(node):
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return True
+    # "try: import foo / except ImportError: ..." fallbacks
+    if isinstance(node, ast.Try):
+        return all(_is_import(n) for n in node.body)
+    return False
+
+
+def program_imports(path):
+    '''Return source code of the top-level imports of a Python program.'''
+
+    with open(path) as f:
+        source = f.read()
+    lines = source.splitlines(True)
+    code = []
+    for node in ast.parse(source).body:
+        if _is_import(node):
+            code += lines[node.lineno - 1:node.end_lineno]
+    return ''.join(code)
+
+
+def measure(code, env, runs):
+    '''Return list of (seconds, max RSS KiB, modules) for runs imports of code.'''
+
+    results = []
+    for i in range(runs):
+        p = subprocess.Popen([sys.executable, '-c', measure_script], env=env,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        out = p.communicate(code.encode())[0]
+        if p.returncode != 0:
+            sys.exit('failed to import:\n' + code)
+        (duration, rss, modules) = out.decode().split()
+        results.append((float(duration), int(rss), int(modules)))
+    return results
+
+
+def main():
+    runs = len(sys.argv) > 1 and int(sys.argv[1]) or 20
+
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+
+    base_rss = min(r[1] for r in measure('', env, 5))
+    for (name, path, code) in programs:
+        if path:
+            code = program_imports(path)
+        results = sorted(measure(code, env, runs))
+        print('%-12s median %7.2f ms, max %7.2f ms, +%6.1f MB RSS, %i modules imported' % (
+            name, results[len(results) // 2][0] * 1000, results[-1][0] * 1000,
+            (max(r[1] for r in results) - base_rss) / 1024., max(r[2] for r in results)))
+
+
+if __name__ == '__main__':
+    main()
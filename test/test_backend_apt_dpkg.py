@@ -1,5 +1,5 @@
 import unittest, gzip, imp, subprocess, tempfile, shutil, os, os.path, time
-import glob, sys
+import glob, sys, json
 from apt import apt_pkg
 
 try:
@@ -50,9 +50,16 @@ class T(unittest.TestCase):
         # reset internal caches between tests
         impl._apt_cache = None
         impl._sandbox_apt_cache = None
+        self.orig_md5_cache_file = impl._md5_cache_file
+        impl._md5_cache_file = os.path.join(self.workdir, 'md5sums.json')
+        impl._md5_cache = None
+        impl._md5_cache_dirty = False
 
     def tearDown(self):
         impl.configuration = self.orig_conf
+        impl._md5_cache_file = self.orig_md5_cache_file
+        impl._md5_cache = None
+        impl._md5_cache_dirty = False
         shutil.rmtree(self.workdir)
 
     def test_check_files_md5(self):
@@ -92,6 +99,58 @@ class T(unittest.TestCase):
         finally:
             shutil.rmtree(td)
 
+    def test_check_files_md5_cache(self):
+        '''_check_files_md5() verification cache'''
+
+        f = os.path.join(self.workdir, 'test.txt')
+        with open(f, 'w') as fd:
+            fd.write('Some stuff')
+        gone = os.path.join(self.workdir, 'gone.txt')
+        with open(gone, 'w') as fd:
+            fd.write('More stuff')
+        sums = (b'2e41290da2fa3f68bd3313174467e3b5  ' + f.encode() + b'\n' +
+                b'f6423dfbc4faf022e58b4d3f5ff71a70  ' + gone.encode() + b'\n')
+        self.assertEqual(impl._check_files_md5(sums), [])
+        # only written back at the end
+        self.assertFalse(os.path.exists(impl._md5_cache_file))
+        self.assertEqual(impl._check_files_md5(sums), [])
+        self.assertFalse(os.path.exists(impl._md5_cache_file))
+
+        # entries of files which went away are dropped
+        os.unlink(gone)
+        impl._save_md5_cache()
+        self.assertTrue(os.path.exists(impl._md5_cache_file))
+
+        # unchanged files are not read again, so a bogus cached value shows
+        impl._md5_cache = None
+        with open(impl._md5_cache_file) as fd:
+            cache = json.load(fd)
+        self.assertEqual(cache[f][4], '2e41290da2fa3f68bd3313174467e3b5')
+        self.assertEqual(list(cache), [f])
+        cache[f][4] = '0' * 32
+        with open(impl._md5_cache_file, 'w') as fd:
+            json.dump(cache, fd)
+        self.assertEqual(impl._check_files_md5(sums), [f])
+
+        # changed files are checked again
+        time.sleep(0.01)
+        with open(f, 'w') as fd:
+            fd.write('Some stuff')
+        self.assertEqual(impl._check_files_md5(sums), [])
+
+    def test_check_files_md5_cache_dir(self):
+        '''_check_files_md5() creates the cache directory'''
+
+        impl._md5_cache_file = os.path.join(self.workdir, 'cache', 'apport', 'md5sums.json')
+        f = os.path.join(self.workdir, 'test.txt')
+        with open(f, 'w') as fd:
+            fd.write('Some stuff')
+        sums = b'2e41290da2fa3f68bd3313174467e3b5  ' + f.encode() + b'\n'
+        self.assertEqual(impl._check_files_md5(sums), [])
+        impl._save_md5_cache()
+        with open(impl._md5_cache_file) as fd:
+            self.assertEqual(list(json.load(fd)), [f])
+
     def test_get_version(self):
         '''get_version().'''
 
@@ -92,6 +92,9 @@ echo "$@" >> %s''' % self.apport_retrace_log)
 
         self.assertFalse(os.path.isdir(os.path.join(self.workdir, 'dupdb', 'sig')))
 
+        # dummy crashes do not have address signatures
+        self.assertIn('pre-retrace duplicate check saved 0 retraces', out)
+
     def test_crashes_error(self):
         '''Crash retracing if apport-retrace fails on bug #1'''
 
@@ -1,5 +1,5 @@
 # coding: UTF-8
-import unittest, tempfile, shutil, os.path, copy
+import unittest, tempfile, shutil, os.path, copy, io, threading, time
 
 import apport
 from apport.crashdb_impl.memory import CrashDatabase
@@ -118,6 +118,136 @@ databases = {
 
         self.assertRaises(IndexError, self.crashes.download, 5)
 
+    def test_download_many(self):
+        '''download_many()'''
+
+        results = list(self.crashes.download_many([4, 0, 5, 2]))
+        self.assertEqual([id for (id, r) in results], [4, 0, 5, 2])
+        self.assertEqual(results[0][1]['SourcePackage'], 'pygoo')
+        self.assertEqual(results[1][1]['SourcePackage'], 'foo')
+        self.assertTrue(isinstance(results[2][1], IndexError))
+        self.assertEqual(results[3][1]['SourcePackage'], 'bar')
+
+        self.assertEqual(list(self.crashes.download_many([])), [])
+
+        # parallel downloads
+        self.crashes.options['download_jobs'] = '3'
+        results = dict(self.crashes.download_many(range(6)))
+        self.assertEqual(sorted(results), list(range(6)))
+        self.assertEqual(results[3]['SourcePackage'], 'pygoo')
+        self.assertTrue(isinstance(results[5], IndexError))
+
+    def test_download_keys(self):
+        '''download() with selected keys'''
+
+        requested = []
+        download = self.crashes.download
+
+        def record_download(id, keys=None):
+            requested.append((id, keys))
+            return download(id, keys)
+        self.crashes.download = record_download
+
+        # the memory backend has all fields at hand anyway
+        r = self.crashes.download(0, ['Stacktrace'])
+        self.assertEqual(r['SourcePackage'], 'foo')
+
+        # download_many() passes them on
+        keys = apport.crashdb.duplicate_check_keys
+        results = list(self.crashes.download_many([4, 2], keys))
+        self.assertEqual([id for (id, r) in results], [4, 2])
+        self.assertEqual(requested[1:], [(4, keys), (2, keys)])
+        self.assertEqual(list(apport.crashdb.CrashDatabase.download_many(self.crashes, [2], keys)),
+                         [(2, results[1][1])])
+        self.assertEqual(requested[-1], (2, keys))
+
+        # the duplicate check only needs the fields for the signatures
+        self.crashes.init_duplicate_db(':memory:')
+        self.crashes.check_duplicate(0)
+        self.assertEqual(requested[-1], (0, keys))
+
+    def test_check_duplicate_partial(self):
+        '''check_duplicate() passes on all needed fields of a partial download'''
+
+        # simulate a backend which only downloads the requested fields
+        download = self.crashes.download
+
+        def partial_download(id, keys=None):
+            report = download(id)
+            partial = apport.Report(report['ProblemType'])
+            for k in keys:
+                if k in report:
+                    partial[k] = report[k]
+            return partial
+        self.crashes.download = partial_download
+
+        closed = []
+        self.crashes.close_duplicate = lambda report, id, master: closed.append(report)
+
+        full = download(1)
+        full['ThreadStacktrace'] = 'Thread 1\n#0 foo (i=1) at crash.c:42'
+        full['Dependencies'] = 'libc6 2.11'
+        full['ProcCmdline'] = 'crash -v'
+        full['CoreDump'] = b'\x01' * 1000
+
+        self.crashes.init_duplicate_db(':memory:')
+        self.assertEqual(self.crashes.check_duplicate(0), None)
+        self.assertEqual(self.crashes.check_duplicate(1), (0, None))
+        self.assertEqual(len(closed), 1)
+        for k in apport.crashdb.retrace_update_keys:
+            self.assertEqual(closed[0].get(k), full.get(k), k)
+        self.assertNotIn('CoreDump', closed[0])
+
+    def test_download_concurrently(self):
+        '''_download_concurrently() bounds threads and waiting reports'''
+
+        lock = threading.Lock()
+        running = [0, 0]  # current, maximum
+        done = []
+        slow = threading.Event()
+
+        def download(id):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            if id == 0:
+                # first one arrives last
+                slow.wait(5)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+                done.append(id)
+            if id == 7:
+                raise ValueError('broken')
+            return 'report %i' % id
+
+        gen = self.crashes._download_concurrently(range(20), download, 3)
+        results = []
+        for (id, report) in gen:
+            results.append((id, report))
+            if len(results) == 19:
+                # all others arrived
+                slow.set()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[-1], (0, 'report 0'))
+        self.assertEqual(dict(results)[1], 'report 1')
+        self.assertTrue(isinstance(dict(results)[7], ValueError))
+        self.assertEqual(running[1], 3)
+
+        # the workers do not run ahead of a slow consumer
+        del done[:]
+        gen = self.crashes._download_concurrently(range(1, 20), download, 3)
+        next(gen)
+        time.sleep(0.3)
+        self.assertLessEqual(len(done), 1 + 3 + 3)
+        gen.close()
+
+        # errors which are not an Exception are raised
+        def exit(id):
+            raise SystemExit(99)
+        gen = self.crashes._download_concurrently([1], exit, 3)
+        self.assertRaises(SystemExit, next, gen)
+
     def test_get_affected_packages(self):
         self.assertEqual(self.crashes.get_affected_packages(0), ['foo'])
         self.assertEqual(self.crashes.get_affected_packages(1), ['foo'])
@@ -606,6 +736,114 @@ databases = {
 
         self.assertEqual(self.crashes._duplicate_db_dump(), {})
 
+    def test_check_duplicate_similar_address_sig(self):
+        '''check_duplicate() with similar address signatures'''
+
+        self.crashes.init_duplicate_db(':memory:')
+
+        def make_report(libpath, last_addr):
+            r = apport.Report()
+            r['SourcePackage'] = 'bash'
+            r['Package'] = 'bash 5'
+            r['ExecutablePath'] = '/bin/bash'
+            r['Signal'] = '11'
+            r['ProcMaps'] = '''
+00400000-004df000 r-xp 00000000 08:02 1044485                            /bin/bash
+7f491fa8f000-7f491fc24000 r-xp 00000000 08:02 522605                     %s
+''' % libpath
+            r['Stacktrace'] = '''
+#0  0x00007f491fac5687 in kill ()
+#1  0x000000000042eb76 in ?? ()
+#2  0x00000000004324d8 in ??
+#3  0x00000000004707e3 in parse_and_execute ()
+#4  0x0000000000470800 in ?? ()
+#5  0x0000000000470900 in ?? ()
+#6  0x0000000000470a00 in ?? ()
+#7  0x%016x in _start ()
+''' % last_addr
+            return r
+
+        r = make_report('/lib/x86_64-linux-gnu/libc-2.13.so', 0x41d703)
+        (prefix, frames) = self.crashes.address_signature_frames(r.crash_signature_addresses())
+        self.assertEqual(prefix, '/bin/bash:11')
+        self.assertEqual(frames[0], 'libc-2.13.so+36687')
+        self.assertEqual(len(self.crashes.address_signature_grams(r.crash_signature_addresses())), 6)
+
+        r_id = self.crashes.upload(r)
+        self.assertEqual(self.crashes.check_duplicate(r_id), None)
+
+        # last frame differs, and libc is in a different directory
+        r2 = make_report('/usr/lib/x86_64-linux-gnu/libc-2.13.so', 0x41d7ff)
+        self.assertNotEqual(r.crash_signature_addresses(), r2.crash_signature_addresses())
+        self.assertEqual(self.crashes._duplicate_search_address_signature(r2.crash_signature_addresses()), None)
+        (id, similarity) = self.crashes._duplicate_search_similar_address_signature(
+            r2.crash_signature_addresses(), 0.8)
+        self.assertEqual(id, r_id)
+        self.assertAlmostEqual(similarity, 5 / 6.)
+        self.assertEqual(self.crashes._duplicate_search_similar_address_signature(
+            r2.crash_signature_addresses(), 0.9), None)
+
+        # not used by check_duplicate() unless enabled
+        r2_id = self.crashes.upload(r2)
+        self.assertEqual(self.crashes.check_duplicate(r2_id), None)
+        self.crashes.duplicate_db_remove(r2_id)
+
+        self.crashes.options['address_similarity'] = 0.8
+        r3 = make_report('/lib/libc-2.13.so', 0x41d7fe)
+        r3_id = self.crashes.upload(r3)
+        self.assertEqual(self.crashes.check_duplicate(r3_id), (r_id, None))
+        # now the master knows r3's exact signature
+        self.assertEqual(self.crashes._duplicate_search_address_signature(r3.crash_signature_addresses()), r_id)
+
+        # different executable never matches
+        r4 = make_report('/lib/libc-2.13.so', 0x41d7fe)
+        r4['ExecutablePath'] = '/bin/sh'
+        self.assertEqual(self.crashes._duplicate_search_similar_address_signature(
+            r4.crash_signature_addresses(), 0.1), None)
+
+    def test_check_duplicate_address_signature(self):
+        '''check_duplicate_address_signature()'''
+
+        self.crashes.init_duplicate_db(':memory:')
+
+        r = apport.Report()
+        r['SourcePackage'] = 'bash'
+        r['Package'] = 'bash 5'
+        r['ExecutablePath'] = '/bin/bash'
+        r['Signal'] = '11'
+        r['ProcMaps'] = '''
+00400000-004df000 r-xp 00000000 08:02 1044485                            /bin/bash
+7f491fa8f000-7f491fc24000 r-xp 00000000 08:02 522605                     /lib/x86_64-linux-gnu/libc-2.13.so
+'''
+        r['Stacktrace'] = '''
+#0  0x00007f491fac5687 in kill ()
+#1  0x000000000042eb76 in ?? ()
+#2  0x00000000004324d8 in ??
+#3  0x00000000004707e3 in parse_and_execute ()
+#4  0x000000000041d703 in _start ()
+'''
+        r_id = self.crashes.upload(r)
+
+        # unknown crash does not change anything
+        self.assertEqual(self.crashes.check_duplicate_address_signature(r_id, r), None)
+        self.assertEqual(self.crashes.duplicate_of(r_id), None)
+        self.assertEqual(self.crashes.check_duplicate(r_id), None)
+
+        # the crash itself is not a duplicate of itself
+        self.assertEqual(self.crashes.check_duplicate_address_signature(r_id, r), None)
+
+        r2 = copy.copy(r)
+        r2_id = self.crashes.upload(r2)
+        self.assertEqual(self.crashes.check_duplicate_address_signature(r2_id, r2), r_id)
+        self.assertEqual(self.crashes.duplicate_of(r2_id), r_id)
+
+        # reports without address signature are never duplicates
+        r3 = apport.Report()
+        r3['ExecutablePath'] = '/bin/bash'
+        r3['Signal'] = '11'
+        r3_id = self.crashes.upload(r3)
+        self.assertEqual(self.crashes.check_duplicate_address_signature(r3_id, r3), None)
+
     def test_duplicate_db_publish_long_sigs(self):
         '''duplicate_db_publish() with very long signatures'''
 
@@ -660,6 +898,48 @@ databases = {
                          {self.crashes.download(0).crash_signature(): (0, None),
                           self.crashes.download(2).crash_signature(): (99, None)})
 
+    def test_duplicate_db_export_import(self):
+        '''duplicate_db_export() and duplicate_db_import()'''
+
+        self.crashes.init_duplicate_db(':memory:')
+        self.assertEqual(self.crashes.check_duplicate(0), None)
+        self.assertEqual(self.crashes.check_duplicate(2), None)
+        self.crashes._duplicate_db_add_address_signature('/bin/foo:11:/lib/libc.so+1234', 0)
+        self.crashes.duplicate_db_fixed(2, '1.1')
+        cur = self.crashes.duplicate_db.cursor()
+        cur.execute("UPDATE crashes SET last_change = '2016-01-01 00:00:00' WHERE crash_id = 0")
+        self.crashes.duplicate_db.commit()
+        dump = self.crashes._duplicate_db_dump(True)
+
+        out = io.StringIO()
+        self.assertEqual(self.crashes.duplicate_db_export(out, batch_size=1), 3)
+
+        # import into a new database
+        other = CrashDatabase(None, {})
+        other.init_duplicate_db(':memory:')
+        self.assertEqual(other.duplicate_db_import(out.getvalue().splitlines(), batch_size=2), 3)
+        self.assertEqual(other._duplicate_db_dump(True), dump)
+        self.assertEqual(other._duplicate_search_address_signature('/bin/foo:11:/lib/libc.so+1234'), 0)
+
+        # filter by time stamp
+        out = io.StringIO()
+        self.assertEqual(self.crashes.duplicate_db_export(out, since='2016-06-01'), 1)
+        self.assertIn('"id": 2', out.getvalue())
+
+        # merging keeps newer entries and updates older ones
+        cur = other.duplicate_db.cursor()
+        cur.execute("UPDATE crashes SET fixed_version = '1.0', last_change = '2015-01-01 00:00:00' WHERE crash_id = 0")
+        cur.execute("UPDATE crashes SET fixed_version = '2.0', last_change = '2099-01-01 00:00:00' WHERE crash_id = 2")
+        other.duplicate_db.commit()
+        out = io.StringIO()
+        self.crashes.duplicate_db_export(out)
+        other.duplicate_db_import(out.getvalue().splitlines())
+        merged = other._duplicate_db_dump()
+        self.assertEqual(merged[self.crashes.download(0).crash_signature()], (0, None))
+        self.assertEqual(merged[self.crashes.download(2).crash_signature()], (2, '2.0'))
+
+        self.assertRaises(ValueError, other.duplicate_db_import, ['{"type": "crash"}'])
+
     def test_db_corruption(self):
         '''Detection of DB file corruption'''
 
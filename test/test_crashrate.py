@@ -0,0 +1,69 @@
+import unittest, tempfile, shutil, os
+
+import apport.crashrate
+
+
+class T(unittest.TestCase):
+    def setUp(self):
+        self.report_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.report_dir)
+
+    def test_sliding_window(self):
+        '''recent_crashes() counts reports in the sliding window'''
+
+        uid = os.getuid()
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid), 0)
+
+        apport.crashrate.record_crash(self.report_dir, '/bin/foo', uid, now=1000)
+        apport.crashrate.record_crash(self.report_dir, '/bin/foo', uid, now=2000)
+        self.assertTrue(os.path.exists(os.path.join(self.report_dir, '_bin_foo.%i.crashrate' % uid)))
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid, now=2000), 2)
+        self.assertEqual(apport.crashrate.recent_crashes(
+            self.report_dir, '/bin/foo', uid, now=1000 + apport.crashrate.window), 1)
+        self.assertEqual(apport.crashrate.recent_crashes(
+            self.report_dir, '/bin/foo', uid, now=2000 + apport.crashrate.window), 0)
+
+        # separate per program and user
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/bar', uid, now=2000), 0)
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid + 1, now=2000), 0)
+
+        # no leftover temporary files
+        self.assertEqual(len(os.listdir(self.report_dir)), 1)
+
+    def test_max_records(self):
+        '''ledger size is bounded'''
+
+        uid = os.getuid()
+        for i in range(apport.crashrate.max_records * 2):
+            apport.crashrate.record_crash(self.report_dir, '/bin/foo', uid, now=1000 + i)
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid, now=2000),
+                         apport.crashrate.max_records)
+        self.assertEqual(os.path.getsize(apport.crashrate.ledger_path(self.report_dir, '/bin/foo', uid)),
+                         apport.crashrate.max_records * 8)
+
+    def test_broken(self):
+        '''invalid ledgers and directories'''
+
+        uid = os.getuid()
+        path = apport.crashrate.ledger_path(self.report_dir, '/bin/foo', uid)
+        with open(path, 'wb') as f:
+            f.write(b'abc')
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid), 0)
+        os.unlink(path)
+
+        # symlinks are not followed
+        other = os.path.join(self.report_dir, 'other')
+        apport.crashrate.record_crash(self.report_dir, '/bin/bar', uid)
+        os.rename(apport.crashrate.ledger_path(self.report_dir, '/bin/bar', uid), other)
+        os.symlink(other, path)
+        self.assertEqual(apport.crashrate.recent_crashes(self.report_dir, '/bin/foo', uid), 0)
+
+        # does not fail for nonexisting directories
+        apport.crashrate.record_crash('/nonexisting', '/bin/foo', uid)
+        self.assertEqual(apport.crashrate.recent_crashes('/nonexisting', '/bin/foo', uid), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
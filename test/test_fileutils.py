@@ -1,4 +1,4 @@
-import unittest, tempfile, os, shutil, time, sys, pwd
+import unittest, tempfile, os, shutil, time, sys, pwd, subprocess
 
 import problem_report
 import apport.fileutils
@@ -396,6 +396,20 @@ f6423dfbc4faf022e58b4d3f5ff71a70  %s
         self.assertFalse(apport.fileutils.links_with_shared_library('/etc', 'libc'))
         self.assertFalse(apport.fileutils.links_with_shared_library('/etc/passwd', 'libc'))
 
+    def test_lazy_import(self):
+        '''importing fileutils does not load the report machinery'''
+
+        out = subprocess.check_output([sys.executable, '-c', '''import sys
+import apport, apport.fileutils, apport.crashrate
+print(sorted(m for m in ('apport.report', 'problem_report', 'apport.packaging_impl') if m in sys.modules))
+'''], env={'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(apport.__file__)))})
+        self.assertEqual(out.decode().strip(), '[]')
+
+        # attributes are still available
+        self.assertTrue(hasattr(apport.Report, 'add_proc_info'))
+        self.assertTrue(hasattr(apport.packaging, 'get_version'))
+        self.assertNotIsInstance(apport.packaging, type(sys))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+import apport.gdbmi
+
+
+class T(unittest.TestCase):
+    def test_parse_cstring(self):
+        '''parse_cstring() with escapes'''
+
+        self.assertEqual(apport.gdbmi.parse_cstring('"hello"'), ('hello', 7))
+        self.assertEqual(apport.gdbmi.parse_cstring(r'"a\"b\\c\n"x'), ('a"b\\c\n', 11))
+        self.assertEqual(apport.gdbmi.parse_cstring(r'"\303\244\t"')[0], '\xe4\t')
+        self.assertRaises(ValueError, apport.gdbmi.parse_cstring, '"unterminated')
+        self.assertRaises(ValueError, apport.gdbmi.parse_cstring, 'noquote')
+
+    def test_parse_results(self):
+        '''parse_results() with tuples and lists'''
+
+        (res, pos) = apport.gdbmi.parse_results(
+            'stack=[frame={level="0",addr="0x00000000004004f6",func="f",'
+            'file="crash.c",line="3"},frame={level="1",addr="0x400510",'
+            'func="main",from="/lib/libc.so.6"}],empty=[],names=["rax","",'
+            '"rbx"]')
+        self.assertEqual(res['stack'], [
+            {'level': '0', 'addr': '0x00000000004004f6', 'func': 'f',
+             'file': 'crash.c', 'line': '3'},
+            {'level': '1', 'addr': '0x400510', 'func': 'main',
+             'from': '/lib/libc.so.6'}])
+        self.assertEqual(res['empty'], [])
+        self.assertEqual(res['names'], ['rax', '', 'rbx'])
+
+        (res, pos) = apport.gdbmi.parse_results('a={b={c="1"}},d="2"')
+        self.assertEqual(res, {'a': {'b': {'c': '1'}}, 'd': '2'})
+
+        self.assertEqual(apport.gdbmi.parse_results(''), ({}, 0))
+        self.assertRaises(ValueError, apport.gdbmi.parse_results, 'a={b="1"', 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
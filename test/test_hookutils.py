@@ -1,5 +1,5 @@
 # coding: UTF-8
-import unittest, tempfile, locale, subprocess, re, shutil, os.path, sys
+import unittest, tempfile, locale, subprocess, re, shutil, os.path, sys, time
 
 import apport.hookutils
 
@@ -7,6 +7,7 @@ import apport.hookutils
 class T(unittest.TestCase):
     def setUp(self):
         self.workdir = tempfile.mkdtemp()
+        apport.hookutils.clear_session_cache()
 
     def tearDown(self):
         shutil.rmtree(self.workdir)
@@ -311,6 +312,36 @@ class T(unittest.TestCase):
         self.assertGreater(len(data), 100000)
         self.assertLess(len(data), 1000000)
 
+    def test_recent_syslog_limits(self):
+        '''recent_syslog with line and size limits'''
+
+        log = os.path.join(self.workdir, 'syslog')
+        with open(log, 'w') as f:
+            for i in range(1000):
+                f.write('Apr 20 11:30:00 komputer kernel: message %i\n' % i)
+                f.write('Apr 20 11:30:00 komputer foo: unrelated %i\n' % i)
+
+        data = apport.hookutils.recent_syslog(re.compile('kernel'), path=log, max_lines=3)
+        self.assertEqual(data, 'Apr 20 11:30:00 komputer kernel: message 997\n'
+                         'Apr 20 11:30:00 komputer kernel: message 998\n'
+                         'Apr 20 11:30:00 komputer kernel: message 999\n')
+
+        data = apport.hookutils.recent_syslog(re.compile('kernel'), path=log, max_bytes=100)
+        self.assertEqual(data, 'Apr 20 11:30:00 komputer kernel: message 998\n'
+                         'Apr 20 11:30:00 komputer kernel: message 999\n')
+
+        self.assertEqual(len(apport.hookutils.recent_syslog(re.compile('kernel'), path=log).splitlines()), 1000)
+
+    def test_filter_process_reverse(self):
+        '''filtering newest-first output stops at the limit'''
+
+        filter_process = getattr(apport.hookutils, '__filter_re_process')
+        p = subprocess.Popen(['sh', '-c', 'i=0; while true; do i=$((i+1)); echo "kernel: $i"; done'],
+                             stdout=subprocess.PIPE)
+        data = filter_process(re.compile('kernel'), p, max_lines=3, reverse=True)
+        self.assertEqual(data, 'kernel: 3\nkernel: 2\nkernel: 1\n')
+        self.assertNotEqual(p.returncode, None)
+
     @unittest.skipIf(apport.hookutils.apport.hookutils.in_session_of_problem(apport.Report()) is None, 'no logind session')
     def test_in_session_of_problem(self):
         '''in_session_of_problem()'''
@@ -443,6 +474,165 @@ GdkPixbuf-CRITICAL **: gdk_pixbuf_scale_simple: another standard glib assertion
         out = apport.hookutils.command_output(['cat'], input=b'hello')
         self.assertEqual(out, 'hello')
 
+    def test_command_outputs(self):
+        '''command_outputs()'''
+
+        start = time.time()
+        out = apport.hookutils.command_outputs({
+            'One': ['sh', '-c', 'sleep 0.5; echo one'],
+            'Two': ['sh', '-c', 'sleep 0.5; echo two >&2'],
+            'Fail': ['sh', '-c', 'echo broken; exit 3'],
+            'Missing': ['/non existing'],
+            'Env': ['env'],
+        })
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(out['One'], 'one')
+        self.assertEqual(out['Two'], 'two')
+        self.assertTrue(out['Fail'].startswith('Error: command'), out['Fail'])
+        self.assertIn('exit code 3: broken', out['Fail'])
+        self.assertTrue(out['Missing'].startswith('Error: [Errno 2]'))
+        self.assertIn('LC_MESSAGES=C', out['Env'])
+
+        # timeout
+        start = time.time()
+        out = apport.hookutils.command_outputs({'Slow': ['sh', '-c', 'echo started; sleep 10']},
+                                               timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(out['Slow'].startswith('Error: command'), out['Slow'])
+        self.assertIn('timed out after 0.5 seconds: started', out['Slow'])
+
+        # output cap
+        out = apport.hookutils.command_outputs({'Yes': ['yes']}, max_bytes=1000,
+                                               decode_utf8=False)
+        self.assertTrue(out['Yes'].startswith(b'y\ny\n'))
+        self.assertTrue(out['Yes'].endswith(b'\n[output truncated after 1000 bytes]'))
+        self.assertLess(len(out['Yes']), 1100)
+
+    def test_session_cache(self):
+        '''hardware probes are cached for the session'''
+
+        stats = apport.hookutils._session_cache_stats
+        hits = stats['hits']
+        calls = []
+
+        def probe(arg):
+            calls.append(arg)
+            return [arg]
+
+        self.assertEqual(apport.hookutils._session_cached(probe, 1), [1])
+        self.assertEqual(len(calls), 1)
+
+        # cached; callers get their own copy
+        result = apport.hookutils._session_cached(probe, 1)
+        self.assertEqual(result, [1])
+        self.assertEqual(len(calls), 1)
+        result.append(2)
+        self.assertEqual(apport.hookutils._session_cached(probe, 1), [1])
+        self.assertEqual(stats['hits'], hits + 2)
+        self.assertIn('1 entries', apport.hookutils.session_cache_stats())
+
+        # different arguments
+        self.assertEqual(apport.hookutils._session_cached(probe, 2), [2])
+        self.assertEqual(len(calls), 2)
+
+        apport.hookutils.clear_session_cache()
+        self.assertEqual(apport.hookutils._session_cached(probe, 1), [1])
+        self.assertEqual(len(calls), 3)
+
+        # DMI is read once
+        r1 = {}
+        r2 = {}
+        apport.hookutils.attach_dmi(r1)
+        hits = stats['hits']
+        apport.hookutils.attach_dmi(r2)
+        self.assertEqual(r1, r2)
+        self.assertEqual(stats['hits'], hits + 1)
+
+    def test_attach_hardware_lspci(self):
+        '''attach_hardware() runs lspci with the other commands, once'''
+
+        if not os.path.exists('/sys/bus/pci'):
+            self.skipTest('no PCI bus')
+
+        batches = []
+
+        def command_outputs(commands):
+            batches.append(sorted(commands))
+            return dict((k, ' '.join(c)) for (k, c) in commands.items())
+
+        apport.hookutils.clear_session_cache()
+        orig_command_outputs = apport.hookutils.command_outputs
+        apport.hookutils.command_outputs = command_outputs
+        try:
+            r1 = {}
+            r2 = {}
+            apport.hookutils.attach_hardware(r1)
+            apport.hookutils.attach_hardware(r2)
+            self.assertEqual(apport.hookutils.pci_devices(), 'lspci -vvnn')
+        finally:
+            apport.hookutils.command_outputs = orig_command_outputs
+            apport.hookutils.clear_session_cache()
+
+        self.assertEqual(len(batches), 2)
+        self.assertIn('lspci -vvnn', batches[0])
+        self.assertIn('Lsusb', batches[0])
+        self.assertNotIn('lspci -vvnn', batches[1])
+        self.assertEqual(r1['Lspci'], 'lspci -vvnn')
+        self.assertEqual(r2['Lspci'], 'lspci -vvnn')
+        self.assertNotIn('lspci -vvmmnn', r1)
+
+    def test_dmesg_not_cached(self):
+        '''attach_dmesg() reads current dmesg for every report'''
+
+        outputs = ['[1.0] boot', '[2.0] crash[42]: segfault']
+        orig_command_output = apport.hookutils.command_output
+        apport.hookutils.command_output = lambda command, *args, **kwargs: outputs.pop(0)
+        try:
+            r1 = {}
+            r2 = {}
+            apport.hookutils.attach_dmesg(r1)
+            apport.hookutils.attach_dmesg(r2)
+        finally:
+            apport.hookutils.command_output = orig_command_output
+        self.assertEqual(r1['CurrentDmesg'], '[1.0] boot')
+        self.assertEqual(r2['CurrentDmesg'], '[2.0] crash[42]: segfault')
+
+    def test_filter_pci_devices(self):
+        '''filtering lspci output by class'''
+
+        outputs = {
+            'lspci -vvmmnn': '''Slot:\t00:02.0
+Class:\tVGA compatible controller [0300]
+Vendor:\tIntel Corporation [8086]
+
+Slot:\t00:19.0
+Class:\tEthernet controller [0200]
+Vendor:\tIntel Corporation [8086]
+
+Slot:\t03:00.0
+Class:\tNetwork controller [0280]
+Vendor:\tIntel Corporation [8086]''',
+            'lspci -vvnn': '''00:02.0 VGA compatible controller [0300]: Intel Corporation [8086:0166]
+\tKernel driver in use: i915
+
+00:19.0 Ethernet controller [0200]: Intel Corporation [8086:1502]
+\tKernel driver in use: e1000e
+
+03:00.0 Network controller [0280]: Intel Corporation [8086:0085]
+\tKernel driver in use: iwlwifi
+'''}
+        filter_pci = getattr(apport.hookutils, '_filter_pci_devices')
+        self.assertEqual(filter_pci(outputs, (apport.hookutils.PCI_NETWORK,)),
+                         '''00:19.0 Ethernet controller [0200]: Intel Corporation [8086:1502]
+\tKernel driver in use: e1000e
+
+03:00.0 Network controller [0280]: Intel Corporation [8086:0085]
+\tKernel driver in use: iwlwifi''')
+        self.assertEqual(filter_pci(outputs, (apport.hookutils.PCI_DISPLAY,)),
+                         '''00:02.0 VGA compatible controller [0300]: Intel Corporation [8086:0166]
+\tKernel driver in use: i915''')
+        self.assertEqual(filter_pci(outputs, (apport.hookutils.PCI_MULTIMEDIA,)), '')
+
     @classmethod
     def _get_mem_usage(klass):
         '''Get current memory usage in kB'''
@@ -1,5 +1,5 @@
 # vim: set encoding=UTF-8 fileencoding=UTF-8 :
-import unittest, tempfile, os, shutil, email, gzip, time, sys
+import unittest, tempfile, os, shutil, email, email.header, gzip, time, sys
 
 from io import BytesIO
 import problem_report
@@ -98,6 +98,23 @@ class T(unittest.TestCase):
         self.assertEqual(pr['Bin'], bin_data)
         self.assertEqual(pr['Large'], large_val.decode('ASCII'))
 
+    def test_is_binary(self):
+        '''_is_binary()'''
+
+        is_binary = problem_report.ProblemReport._is_binary
+        self.assertFalse(is_binary(b''))
+        self.assertFalse(is_binary(b'plain text\n\twith\r\x0b\x0cwhitespace \xe2\x99\xa5'))
+        if sys.version < '3':
+            self.assertFalse(is_binary('unicode \x01'.decode('ASCII')))
+        else:
+            self.assertFalse(is_binary('unicode \x01'))
+        self.assertTrue(is_binary(bin_data))
+        self.assertTrue(is_binary(b'\x00'))
+        self.assertTrue(is_binary(b'text' * 100000 + b'\x1b[0m'))
+        for c in range(32):
+            self.assertEqual(is_binary(bytes(bytearray([c]))), not chr(c).isspace(), c)
+        self.assertFalse(is_binary(b'\x7f\xff'))
+
     def test_write(self):
         '''write() and proper formatting.'''
 
@@ -999,6 +1016,72 @@ ProblemType: Crash
 Date: now!
 ''')
 
+    def test_iter_mime(self):
+        '''iter_mime() streams attachments.'''
+
+        class BlockFile(BytesIO):
+            def __init__(self, data):
+                BytesIO.__init__(self, data)
+                self.reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return BytesIO.read(self, size)
+
+        data = os.urandom(500000) * 6
+        f = BlockFile(data)
+
+        pr = problem_report.ProblemReport(date='now!')
+        pr['Greeting'] = 'hello'
+        pr['CoreDump'] = (f,)
+        pr['ZValue'] = problem_report.CompressedValue(bin_data)
+        pr['LegacyZValue'] = problem_report.CompressedValue()
+        pr['LegacyZValue'].gzipvalue = problem_report.zlib.compress(b'legacy')
+        pr['LegacyZValue'].legacy_zlib = True
+
+        if sys.version < '3':
+            subscribers = 'jöe'.decode('UTF-8')
+        else:
+            subscribers = 'jöe'
+        gen = pr.iter_mime(extra_headers={'Subscribers': subscribers})
+        blocks = [next(gen)]
+        # the file is not read before its part is generated
+        self.assertEqual(f.reads, 0)
+        self.assertTrue(blocks[0].startswith(b'Content-Type: multipart/mixed'))
+        for block in gen:
+            blocks.append(block)
+        # the file is read in blocks, not at once
+        self.assertGreater(f.reads, 2)
+        self.assertTrue(f.closed)
+
+        # CompressedValue's gzip data are used unchanged
+        self.assertIn(problem_report._encodebytes(pr['ZValue'].gzipvalue),
+                      b''.join(blocks))
+
+        msg = email.message_from_binary_file(BytesIO(b''.join(blocks)))
+        [(value, charset)] = email.header.decode_header(msg['Subscribers'])
+        self.assertEqual(value.decode(charset), subscribers)
+        parts = [p for p in msg.walk()]
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(parts[1].get_payload(decode=True),
+                         b'ProblemType: Crash\nDate: now!\nGreeting: hello\n')
+        self.assertEqual(parts[2].get_filename(), 'CoreDump.gz')
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(parts[2].get_payload(decode=True))).read(),
+                         data)
+        self.assertEqual(parts[3].get_filename(), 'LegacyZValue.gz')
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(parts[3].get_payload(decode=True))).read(),
+                         b'legacy')
+        self.assertEqual(parts[4].get_filename(), 'ZValue.gz')
+        self.assertEqual(parts[4].get_payload(decode=True), pr['ZValue'].gzipvalue)
+
+        # same as write_mime() output, apart from the boundary
+        pr['CoreDump'] = (BytesIO(data),)
+        out = BytesIO()
+        pr.write_mime(out, extra_headers={'Subscribers': subscribers})
+        boundary = msg.get_boundary().encode()
+        out_boundary = email.message_from_binary_file(BytesIO(out.getvalue())).get_boundary().encode()
+        self.assertEqual(out.getvalue().replace(out_boundary, boundary), b''.join(blocks))
+
     def test_updating(self):
         '''new_keys() and write() with only_new=True.'''
 
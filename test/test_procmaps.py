@@ -0,0 +1,57 @@
+import unittest
+
+from apport.procmaps import VMAIndex
+
+
+class T(unittest.TestCase):
+    def setUp(self):
+        # deliberately unsorted
+        self.index = VMAIndex([(0x7f00, 0x8000, 'libc'),
+                               (0x1000, 0x2000, 'exe'),
+                               (0x2000, 0x2800, 'exe-data'),
+                               (0x4000, 0x5000, 'heap')])
+
+    def test_find(self):
+        '''find() with half-open ranges'''
+
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.find(0), None)
+        self.assertEqual(self.index.find(0xfff), None)
+        self.assertEqual(self.index.find(0x1000), (0x1000, 0x2000, 'exe'))
+        self.assertEqual(self.index.find(0x1fff), (0x1000, 0x2000, 'exe'))
+        self.assertEqual(self.index.find(0x2000), (0x2000, 0x2800, 'exe-data'))
+        self.assertEqual(self.index.find(0x2800), None)
+        self.assertEqual(self.index.find(0x3000), None)
+        self.assertEqual(self.index.find(0x4800), (0x4000, 0x5000, 'heap'))
+        self.assertEqual(self.index.find(0x7fff), (0x7f00, 0x8000, 'libc'))
+        self.assertEqual(self.index.find(0x8000), None)
+        self.assertEqual(self.index.find(0xffffffffffff), None)
+
+    def test_find_inclusive_end(self):
+        '''find() with inclusive end addresses'''
+
+        # adjacent mapping: lower one wins
+        self.assertEqual(self.index.find(0x2000, inclusive_end=True), (0x1000, 0x2000, 'exe'))
+        self.assertEqual(self.index.find(0x2800, inclusive_end=True), (0x2000, 0x2800, 'exe-data'))
+        self.assertEqual(self.index.find(0x2801, inclusive_end=True), None)
+        self.assertEqual(self.index.find(0x8000, inclusive_end=True), (0x7f00, 0x8000, 'libc'))
+        self.assertEqual(self.index.find(0xfff, inclusive_end=True), None)
+
+    def test_find_all(self):
+        '''find_all()'''
+
+        self.assertEqual(self.index.find_all([0x7f01, 0, 0x1001]),
+                         [(0x7f00, 0x8000, 'libc'), None, (0x1000, 0x2000, 'exe')])
+        self.assertEqual(self.index.find_all([]), [])
+
+    def test_empty(self):
+        '''empty index'''
+
+        index = VMAIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.find(0x1000), None)
+        self.assertEqual(index.find(0x1000, inclusive_end=True), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -95,6 +95,50 @@ func(42)
         self.assertTrue(pr['Traceback'].startswith('Traceback'))
         self.assertIn("func\n    raise Exception(b'This should happen.", pr['Traceback'])
 
+    def test_minimal(self):
+        '''minimal report with $APPORT_PYTHON_HOOK_MINIMAL'''
+
+        os.environ['APPORT_PYTHON_HOOK_MINIMAL'] = '1'
+        self.addCleanup(os.environ.pop, 'APPORT_PYTHON_HOOK_MINIMAL')
+        script = self._test_crash()
+
+        reports = apport.fileutils.get_new_reports()
+        self.assertEqual(len(reports), 1, 'crashed Python program produced a report')
+        self.assertEqual(stat.S_IMODE(os.stat(reports[0]).st_mode), 0o640)
+
+        pr = apport.report.Report()
+        with open(reports[0], 'rb') as f:
+            pr.load(f)
+
+        expected_keys = ['InterpreterPath', 'PythonArgs', 'Traceback',
+                         'ProblemType', 'ProcEnviron', 'ProcStatus',
+                         'ProcCmdline', 'Date', 'ExecutablePath']
+        self.assertTrue(set(expected_keys).issubset(set(pr.keys())),
+                        'report has necessary fields')
+        self.assertNotIn('ProcMaps', pr)
+        self.assertEqual(pr['ProblemType'], 'Crash')
+        self.assertIn('bin/python', pr['InterpreterPath'])
+        self.assertEqual(pr['ExecutablePath'], script)
+        self.assertEqual(pr['ExecutableTimestamp'],
+                         str(int(os.stat(script).st_mtime)))
+        self.assertEqual(pr['PythonArgs'], "['%s', 'testarg1', 'testarg2']" % script)
+        self.assertIn('testarg1', pr['ProcCmdline'])
+        self.assertIn('PYTHONPATH=.:/my/bogus/path', pr['ProcEnviron'])
+        self.assertIn("func\n    raise Exception(b'This should happen.", pr['Traceback'])
+        self.assertEqual(pr.crash_signature(), '%s:Exception:%s@9:func' % (script, script))
+
+        # flood protection: an already seen report gets replaced once
+        apport.fileutils.mark_report_seen(reports[0])
+        self._test_crash(scriptname=script)
+        pr = apport.report.Report()
+        with open(reports[0], 'rb') as f:
+            pr.load(f)
+        self.assertEqual(pr['CrashCounter'], '1')
+        apport.fileutils.mark_report_seen(reports[0])
+        mtime = os.stat(reports[0]).st_mtime
+        self._test_crash(scriptname=script)
+        self.assertEqual(os.stat(reports[0]).st_mtime, mtime)
+
     def test_existing(self):
         '''Python crash hook overwrites seen existing files.'''
 
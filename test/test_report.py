@@ -1,5 +1,6 @@
 # coding: UTF-8
-import unittest, shutil, time, tempfile, os, subprocess, grp, atexit, sys
+import unittest, shutil, time, tempfile, os, subprocess, grp, atexit, sys, re, pwd
+import xml.dom.minidom
 
 try:
     from cStringIO import StringIO
@@ -45,6 +46,61 @@ class T(unittest.TestCase):
         pr.add_package_info()
         self.assertNotIn('Package', pr)
 
+    def test_package_info_cache(self):
+        '''package information is cached until the package status changes'''
+
+        calls = []
+
+        class FakePackaging:
+            def get_version(self, package):
+                calls.append(('get_version', package))
+                if package == 'missing':
+                    raise ValueError('not installed')
+                return '1.' + str(len(calls))
+
+            def get_modified_files(self, package):
+                calls.append(('get_modified_files', package))
+                return []
+
+        orig_packaging = apport.report.packaging
+        orig_status = apport.report._package_status_file
+        orig_max_age = apport.report._modified_files_max_age
+        apport.report.packaging = FakePackaging()
+        status = tempfile.NamedTemporaryFile()
+        apport.report._package_status_file = status.name
+        try:
+            v = apport.report._package_info('get_version', 'foo')
+            self.assertEqual(apport.report._package_info('get_version', 'foo'), v)
+            self.assertRaises(ValueError, apport.report._package_info, 'get_version', 'missing')
+            self.assertRaises(ValueError, apport.report._package_info, 'get_version', 'missing')
+            self.assertEqual(calls, [('get_version', 'foo'), ('get_version', 'missing')])
+
+            # modified files expire
+            apport.report._package_info('get_modified_files', 'foo')
+            apport.report._package_info('get_modified_files', 'foo')
+            self.assertEqual(len(calls), 3)
+            apport.report._modified_files_max_age = 0
+            apport.report._package_info('get_modified_files', 'foo')
+            self.assertEqual(len(calls), 4)
+
+            # changing the package status invalidates the cache
+            status.write(b'Package: foo\n')
+            status.flush()
+            self.assertNotEqual(apport.report._package_info('get_version', 'foo'), v)
+            self.assertEqual(len(calls), 5)
+
+            # no caching without status file
+            apport.report._package_status_file = '/nonexisting'
+            apport.report._package_info('get_version', 'foo')
+            apport.report._package_info('get_version', 'foo')
+            self.assertEqual(len(calls), 7)
+        finally:
+            apport.report.packaging = orig_packaging
+            apport.report._package_status_file = orig_status
+            apport.report._modified_files_max_age = orig_max_age
+            apport.report._package_info_cache[0] = None
+            status.close()
+
     def test_add_os_info(self):
         '''add_os_info().'''
 
@@ -638,6 +694,56 @@ int main() {
         self.assertNotIn('StacktraceTop', pr)
         self.assertIn('core is truncated', pr['UnreportableReason'])
 
+    def test_add_gdb_info_mi(self):
+        '''add_gdb_info_mi() with core dump file reference.'''
+
+        pr = apport.report.Report()
+        # should not throw an exception for missing fields
+        self.assertEqual(pr.add_gdb_info_mi(), None)
+
+        pr = self._generate_sigsegv_report()
+        for k in ['Stacktrace', 'ThreadStacktrace', 'StacktraceTop',
+                  'Registers', 'Disassembly']:
+            del pr[k]
+        # signature only
+        self.assertEqual(pr.add_gdb_info_mi(), None)
+        self._validate_gdb_fields(pr)
+        self.assertEqual(pr['StacktraceTop'], 'f (x=42) at crash.c:3\nmain () at crash.c:6', pr['StacktraceTop'])
+        self.assertNotIn('p = ', pr['Stacktrace'])
+        self.assertNotIn('AssertionMessage', pr)
+
+        # structured, with locals
+        info = pr.add_gdb_info_mi(with_locals=True, structured=True)
+        self._validate_gdb_fields(pr)
+        self.assertIn('p = 0x0', pr['Stacktrace'])
+        self.assertEqual(info['current-thread-id'], '1')
+        frames = info['threads']['1']['frames']
+        self.assertEqual(frames[0]['func'], 'f')
+        self.assertEqual(frames[0]['args'], [('x', '42')])
+        self.assertIn('rip', [name for (name, value) in info['registers']])
+
+        # limited depth
+        info = pr.add_gdb_info_mi(stack_depth=1, thread_depth=1, max_threads=1, structured=True)
+        self.assertEqual(len(info['threads']['1']['frames']), 1)
+        self.assertEqual(pr['StacktraceTop'], 'f (x=42) at crash.c:3')
+
+    def test_add_gdb_info_mi_same_as_batch(self):
+        '''add_gdb_info_mi() produces the same fields as add_gdb_info()'''
+
+        pr = self._generate_sigsegv_report()
+        keys = ['Stacktrace', 'ThreadStacktrace', 'StacktraceTop',
+                'StacktraceAddressSignature', 'Registers', 'Disassembly']
+        batch = dict((k, pr.get(k)) for k in keys)
+        signature = pr.crash_signature()
+        self.assertNotEqual(signature, None)
+        for k in keys:
+            pr.pop(k, None)
+
+        pr.add_gdb_info_mi(thread_depth=2000, max_threads=None, with_locals=True)
+        for k in keys:
+            self.assertEqual(pr.get(k), batch[k], k)
+        self.assertEqual(pr.crash_signature(), signature)
+
     def test_add_zz_parse_segv_details(self):
         '''parse-segv produces sensible results'''
         rep = tempfile.NamedTemporaryFile()
@@ -1018,6 +1124,60 @@ $0.bin 2>/dev/null
         self.assertEqual(r_bash.search_bug_patterns('http://nonexisting.domain/'), None,
                          'gracefully handles nonexisting URL domain')
 
+    def test_search_bug_patterns_cache(self):
+        '''search_bug_patterns() caches compiled patterns.'''
+
+        patterns = tempfile.NamedTemporaryFile(prefix='apport-')
+        patterns.write(b'''<?xml version="1.0"?>
+<patterns>
+    <pattern url="http://bugtracker.net/bugs/1">
+        <re key="Package">^bash </re>
+    </pattern>
+    <pattern url="http://bugtracker.net/bugs/2">
+        <re key="Foo">^1$</re>
+        <re key="Package">^bash </re>
+    </pattern>
+    <pattern url="http://bugtracker.net/bugs/3">
+        <re key="Foo">^2$</re>
+    </pattern>
+</patterns>''')
+        patterns.flush()
+        pattern_url = 'file://' + patterns.name
+
+        r = apport.report.Report()
+        r['Package'] = 'bash 1'
+        self.assertEqual(r.search_bug_patterns(pattern_url),
+                         'http://bugtracker.net/bugs/1')
+        matcher = apport.report._bug_pattern_cache[pattern_url][3]
+        self.assertEqual(sorted(matcher.index), ['Foo', 'Package'])
+
+        # patterns are evaluated in document order, independent of the index
+        r['Foo'] = '1'
+        self.assertEqual(r.search_bug_patterns(pattern_url),
+                         'http://bugtracker.net/bugs/1')
+        r['Package'] = 'coreutils 1'
+        self.assertEqual(r.search_bug_patterns(pattern_url), None)
+        r['Foo'] = '2'
+        self.assertEqual(r.search_bug_patterns(pattern_url),
+                         'http://bugtracker.net/bugs/3')
+
+        # unchanged document is not compiled again
+        self.assertTrue(apport.report._bug_pattern_cache[pattern_url][3] is matcher)
+
+        # changed document gets recompiled
+        patterns.seek(0)
+        patterns.truncate()
+        patterns.write(b'''<?xml version="1.0"?>
+<patterns>
+    <pattern url="http://bugtracker.net/bugs/4">
+        <re key="Foo">^2$</re>
+    </pattern>
+</patterns>''')
+        patterns.flush()
+        self.assertEqual(r.search_bug_patterns(pattern_url),
+                         'http://bugtracker.net/bugs/4')
+        self.assertFalse(apport.report._bug_pattern_cache[pattern_url][3] is matcher)
+
     def test_add_hooks_info(self):
         '''add_hooks_info().'''
 
@@ -1067,7 +1227,7 @@ def add_info(report):
             self.assertEqual(set(r.keys()),
                              set(['ProblemType', 'Date', 'Package',
                                   'CommonField1', 'CommonField2',
-                                  'CommonField3']),
+                                  'CommonField3', '_HookTimings']),
                              'report has required fields')
 
             r = apport.report.Report()
@@ -1077,7 +1237,7 @@ def add_info(report):
             self.assertEqual(set(r.keys()),
                              set(['ProblemType', 'Date', 'Package',
                                   'CommonField1', 'CommonField2',
-                                  'CommonField3']),
+                                  'CommonField3', '_HookTimings']),
                              'report has required fields')
 
             r = apport.report.Report()
@@ -1086,7 +1246,7 @@ def add_info(report):
             self.assertEqual(set(r.keys()),
                              set(['ProblemType', 'Date', 'Package', 'Field1',
                                   'Field2', 'CommonField1', 'CommonField2',
-                                  'CommonField3']),
+                                  'CommonField3', '_HookTimings']),
                              'report has required fields')
             self.assertEqual(r['Field1'], 'Field 1')
             self.assertEqual(r['Field2'], 'Field 2\nBla')
@@ -1100,7 +1260,7 @@ def add_info(report):
             self.assertEqual(set(r.keys()),
                              set(['ProblemType', 'Date', 'Package', 'Field1',
                                   'Field2', 'CommonField1', 'CommonField2',
-                                  'CommonField3']),
+                                  'CommonField3', '_HookTimings']),
                              'report has required fields')
             self.assertEqual(r['Field1'], 'Field 1')
             self.assertEqual(r['Field2'], 'Field 2\nBla')
@@ -1131,7 +1291,7 @@ def add_info(report, ui):
                              set(['ProblemType', 'Date', 'Package',
                                   'SourcePackage', 'Field1', 'Field2',
                                   'CommonField1', 'CommonField2',
-                                  'CommonField3']),
+                                  'CommonField3', '_HookTimings']),
                              'report has required fields')
             self.assertEqual(r['Field1'], 'Field 1')
             self.assertEqual(r['Field2'], 'Field 2\nBla')
@@ -1149,6 +1309,177 @@ def add_info(report, ui):
             apport.report._hook_dir = orig_hook_dir
             apport.report._common_hook_dir = orig_common_hook_dir
 
+    def test_hook_cache(self):
+        '''hooks are only loaded once, and timed'''
+
+        orig_common_hook_dir = apport.report._common_hook_dir
+        apport.report._common_hook_dir = tempfile.mkdtemp()
+        try:
+            hook = os.path.join(apport.report._common_hook_dir, 'counter.py')
+            with open(hook, 'w') as fd:
+                fd.write('''
+loaded = []
+loaded.append(1)
+
+def add_info(report, ui):
+    report['Loaded'] = str(len(loaded))
+''')
+
+            for i in range(3):
+                r = apport.report.Report()
+                self.assertEqual(r.add_hooks_info('fake_ui'), False)
+                self.assertEqual(r['Loaded'], '1')
+            self.assertRegex(r['_HookTimings'], r'^%s: \d+\.\d{3}s$' % re.escape(hook))
+
+            # changed hooks get reloaded
+            with open(hook, 'a') as fd:
+                fd.write('loaded.append(2)\n')
+            r = apport.report.Report()
+            r.add_hooks_info('fake_ui')
+            self.assertEqual(r['Loaded'], '2')
+
+            # new hooks are picked up
+            with open(os.path.join(apport.report._common_hook_dir, 'zz.py'), 'w') as fd:
+                fd.write('''
+def add_info(report, ui):
+    report['Second'] = '1'
+''')
+            r = apport.report.Report()
+            r.add_hooks_info('fake_ui')
+            self.assertEqual(r['Second'], '1')
+            self.assertEqual(len(r['_HookTimings'].splitlines()), 2)
+        finally:
+            shutil.rmtree(apport.report._common_hook_dir)
+            apport.report._common_hook_dir = orig_common_hook_dir
+
+    def test_general_hooks_deadline(self):
+        '''general hooks run concurrently, with a deadline'''
+
+        orig_common_hook_dir = apport.report._common_hook_dir
+        orig_timeout = apport.report._general_hook_timeout
+        apport.report._common_hook_dir = tempfile.mkdtemp()
+        try:
+            for (name, code) in [('a.py', '''
+import time
+def add_info(report, ui):
+    time.sleep(0.5)
+    report['A'] = '1'
+    del report['Remove']
+'''), ('b.py', '''
+import time
+def add_info(report, ui):
+    time.sleep(0.5)
+    report['B'] = str(ui)
+    if 'Stop' in report:
+        raise StopIteration
+'''), ('c.py', '''
+import time
+def add_info(report, ui):
+    time.sleep(0.5)
+    report['C'] = report.get('A', 'unset')
+''')]:
+                with open(os.path.join(apport.report._common_hook_dir, name), 'w') as fd:
+                    fd.write(code)
+
+            r = apport.report.Report()
+            r['Remove'] = 'x'
+            start = time.time()
+            self.assertEqual(r.add_hooks_info('fake_ui'), False)
+            # takes as long as the slowest hook
+            self.assertLess(time.time() - start, 1.2)
+            self.assertEqual(r['A'], '1')
+            self.assertEqual(r['B'], 'fake_ui')
+            # hooks do not see each other's changes
+            self.assertEqual(r['C'], 'unset')
+            self.assertNotIn('Remove', r)
+            self.assertEqual(len(r['_HookTimings'].splitlines()), 3)
+
+            # stopping hook; the changes of the later ones are discarded
+            r = apport.report.Report()
+            r['Stop'] = '1'
+            self.assertEqual(r.add_hooks_info('fake_ui'), True)
+            self.assertEqual(r['A'], '1')
+            self.assertEqual(r['B'], 'fake_ui')
+            self.assertNotIn('C', r)
+            self.assertEqual(len(r['_HookTimings'].splitlines()), 2)
+
+            # deadline
+            apport.report._general_hook_timeout = 0.2
+            with open(os.path.join(apport.report._common_hook_dir, 'c.py'), 'w') as fd:
+                fd.write('''def add_info(report, ui):
+    report['C'] = report.get('A', 'unset')
+''')
+            r = apport.report.Report()
+            r['Remove'] = 'x'
+            start = time.time()
+            self.assertEqual(r.add_hooks_info(None), False)
+            self.assertLess(time.time() - start, 0.5)
+            self.assertIn('timed out', r['HookError_a'])
+            self.assertIn('timed out', r['HookError_b'])
+            self.assertNotIn('A', r)
+            self.assertEqual(r['Remove'], 'x')
+            self.assertEqual(r['C'], 'unset')
+        finally:
+            shutil.rmtree(apport.report._common_hook_dir)
+            apport.report._common_hook_dir = orig_common_hook_dir
+            apport.report._general_hook_timeout = orig_timeout
+
+    def test_general_hooks_conflict(self):
+        '''general hooks which change the same key are merged in order'''
+
+        orig_common_hook_dir = apport.report._common_hook_dir
+        apport.report._common_hook_dir = tempfile.mkdtemp()
+        try:
+            for name in ['a', 'b', 'c']:
+                with open(os.path.join(apport.report._common_hook_dir, name + '.py'), 'w') as fd:
+                    fd.write('''def add_info(report, ui):
+    report['Tags'] += ' tag%s'
+    report['Order'] = report.get('Order', '') + '%s'
+''' % (name, name))
+
+            r = apport.report.Report()
+            r['Tags'] = 'orig'
+            self.assertEqual(r.add_hooks_info(None), False)
+            self.assertEqual(r['Tags'], 'orig taga tagb tagc')
+            self.assertEqual(r['Order'], 'abc')
+        finally:
+            shutil.rmtree(apport.report._common_hook_dir)
+            apport.report._common_hook_dir = orig_common_hook_dir
+
+    def test_general_hooks_timeout_ui(self):
+        '''general hooks cannot use the UI after their deadline'''
+
+        class UI:
+            def __init__(self):
+                self.questions = []
+
+            def yesno(self, text):
+                self.questions.append(text)
+                return True
+
+        orig_common_hook_dir = apport.report._common_hook_dir
+        orig_timeout = apport.report._general_hook_timeout
+        apport.report._common_hook_dir = tempfile.mkdtemp()
+        apport.report._general_hook_timeout = 0.2
+        try:
+            with open(os.path.join(apport.report._common_hook_dir, 'slow.py'), 'w') as fd:
+                fd.write('''import time
+def add_info(report, ui):
+    ui.yesno('first')
+    time.sleep(0.5)
+    ui.yesno('late')
+''')
+            ui = UI()
+            r = apport.report.Report()
+            self.assertEqual(r.add_hooks_info(ui), False)
+            self.assertIn('timed out', r['HookError_slow'])
+            time.sleep(0.6)
+            self.assertEqual(ui.questions, ['first'])
+        finally:
+            shutil.rmtree(apport.report._common_hook_dir)
+            apport.report._common_hook_dir = orig_common_hook_dir
+            apport.report._general_hook_timeout = orig_timeout
+
     def test_add_hooks_info_opt(self):
         '''add_hooks_info() for a package in /opt'''
 
@@ -1301,6 +1632,55 @@ def add_info(report, ui):
             shutil.rmtree(workdir)
             apport.report.apport.report._ignore_file = orig_ignore_file
 
+    def test_ignoring_append(self):
+        '''mark_ignore() adds entries to an existing ignore file in place.'''
+
+        orig_ignore_file = apport.report._ignore_file
+        workdir = tempfile.mkdtemp()
+        apport.report._ignore_file = os.path.join(workdir, 'ignore.xml')
+        try:
+            reports = []
+            for name in ['bash', 'crap', 'foo & <bar>']:
+                with open(os.path.join(workdir, name), 'w') as fd:
+                    fd.write(name)
+                r = apport.report.Report()
+                r['ExecutablePath'] = os.path.join(workdir, name)
+                reports.append(r)
+
+            for r in reports:
+                self.assertEqual(r.check_ignored(), False)
+                r.mark_ignore()
+                self.assertEqual(r.check_ignored(), True)
+            # marking again does not duplicate the entry
+            reports[0].mark_ignore()
+
+            # file is still valid and has all entries exactly once
+            dom = xml.dom.minidom.parse(apport.report._ignore_file)
+            programs = [i.getAttribute('program') for i in dom.getElementsByTagName('ignore')]
+            self.assertEqual(programs, [r['ExecutablePath'] for r in reports])
+
+            # a fresh cache gives the same result
+            apport.report._ignore_cache.clear()
+            for r in reports:
+                self.assertEqual(r.check_ignored(), True)
+
+            # updating an entry rewrites the file; this must not keep stale
+            # cache entries even if the file looks unchanged
+            st = os.stat(reports[1]['ExecutablePath'])
+            os.utime(reports[1]['ExecutablePath'], (st.st_atime, st.st_mtime + 10))
+            self.assertEqual(reports[1].check_ignored(), False)
+            orig_file_validator = apport.report._file_validator
+            apport.report._file_validator = lambda path: (0, 1, 0)
+            try:
+                reports[1].check_ignored()
+                reports[1].mark_ignore()
+                self.assertEqual(reports[1].check_ignored(), True)
+            finally:
+                apport.report._file_validator = orig_file_validator
+        finally:
+            shutil.rmtree(workdir)
+            apport.report._ignore_file = orig_ignore_file
+
     def test_blacklisting(self):
         '''check_ignored() for system-wise blacklist.'''
 
@@ -2005,6 +2385,44 @@ CR2: 00000000ffffb4ff
 '''
         self.assertEqual(report.crash_signature(), 'kernel paging request:ext4_get_acl+0x80/0x210:ext4_check_acl+0x4a/0x90:acl_permission_check+0x97/0xa0:generic_permission+0x25/0xc0:inode_permission+0x99/0xd0:may_open+0x6b/0x110:do_last+0x1a6/0x640:path_openat+0x9d/0x350:do_filp_open+0x31/0x80:open_exec+0x2f/0x110:do_execve_common+0x8a/0x270:do_execve+0x17/0x20:sys_execve+0x37/0x70:ptregs_execve+0x12/0x18')
 
+    def test_anonymize(self):
+        '''anonymize()'''
+
+        orig_getuid = os.getuid
+        orig_getpwuid = pwd.getpwuid
+        orig_uname = os.uname
+        os.getuid = lambda: 1000
+        pwd.getpwuid = lambda uid: ('joe', 'x', 1000, 1000, 'Joe Doe,Room 42,,', '/home/joe', '/bin/sh')
+        uname = os.uname()
+        os.uname = lambda: (uname[0], 'joebox', uname[2], uname[3], uname[4])
+        try:
+            pr = apport.report.Report()
+            pr['ProcCwd'] = '/home/joe/src'
+            pr['ProcEnviron'] = 'HOME=/home/joe\nUSER=joe\nHOSTNAME=joebox\nJOEY=1'
+            pr['Stacktrace'] = b'#0 open (name=0x1 "/home/joe/.config") at joebox.c:1\n\xff'
+            pr['Title'] = 'crash of Joe Doe in Room 42'
+            pr['Package'] = 'joe 1'
+            pr['ProcStatus'] = 'Name: joe'
+            pr.anonymize()
+
+            self.assertNotIn('ProcCwd', pr)
+            self.assertEqual(pr['ProcEnviron'], 'HOME=/home/username\nUSER=username\nHOSTNAME=hostname\nJOEY=1')
+            self.assertEqual(pr['Stacktrace'],
+                             b'#0 open (name=0x1 "/home/username/.config") at hostname.c:1\n\xef\xbf\xbd')
+            self.assertEqual(pr['Title'], 'crash of User Name in User Name')
+            # untouched fields
+            self.assertEqual(pr['Package'], 'joe 1')
+            self.assertEqual(pr['ProcStatus'], 'Name: joe')
+
+            # values without identifying strings are not rewritten
+            pr['ProcCmdline'] = b'foo\xff'
+            pr.anonymize()
+            self.assertEqual(pr['ProcCmdline'], b'foo\xff')
+        finally:
+            os.getuid = orig_getuid
+            pwd.getpwuid = orig_getpwuid
+            os.uname = orig_uname
+
     def test_nonascii_data(self):
         '''methods get along with non-ASCII data'''
 
@@ -2028,6 +2446,68 @@ CR2: 00000000ffffb4ff
         finally:
             os.uname = orig_uname
 
+    def test_spool_core(self):
+        '''spool_core() unpacks once and reuses the file'''
+
+        pr = apport.report.Report()
+        self.assertEqual(pr.spool_core(), None)
+
+        pr['CoreDump'] = ('/nonexisting/core',)
+        self.assertEqual(pr.spool_core(), '/nonexisting/core')
+
+        # plain bytes
+        pr['CoreDump'] = b'\x7fELF' + b'\x01' * 1000
+        core = pr.spool_core()
+        with open(core, 'rb') as f:
+            self.assertEqual(f.read(), pr['CoreDump'])
+        mtime = os.stat(core).st_mtime_ns
+        self.assertEqual(pr.spool_core(), core)
+        self.assertEqual(os.stat(core).st_mtime_ns, mtime)
+
+        # changing the value unpacks again and cleans up the old file
+        pr['CoreDump'] = problem_report.CompressedValue(b'\x7fELF' + b'\x02' * 1000)
+        core2 = pr.spool_core()
+        self.assertNotEqual(core2, core)
+        self.assertFalse(os.path.exists(core))
+        with open(core2, 'rb') as f:
+            self.assertEqual(f.read(), pr['CoreDump'].get_value())
+
+        # straight from the report file
+        with tempfile.NamedTemporaryFile() as rep:
+            pr.write(rep)
+            rep.flush()
+            rep.seek(0)
+            pr = apport.report.Report()
+            pr.load(rep, binary='compressed')
+            core3 = pr.spool_core(rep)
+        with open(core3, 'rb') as f:
+            self.assertEqual(f.read(), b'\x7fELF' + b'\x02' * 1000)
+        self.assertEqual(pr.spool_core(), core3)
+
+        pr.discard_core_spool()
+        self.assertFalse(os.path.exists(os.path.dirname(core3)))
+
+    def test_new_core_spool(self):
+        '''new_core_spool() files are removed with discard_core_spool()'''
+
+        pr = apport.report.Report()
+        core = pr.new_core_spool()
+        with open(core, 'wb') as f:
+            f.write(b'\x7fELF')
+        pr['CoreDump'] = (core,)
+        self.assertEqual(pr.spool_core(), core)
+
+        # a new one replaces it
+        core2 = pr.new_core_spool()
+        self.assertNotEqual(core2, core)
+        self.assertFalse(os.path.exists(core))
+        self.assertTrue(os.path.isdir(os.path.dirname(core2)))
+
+        pr.discard_core_spool()
+        self.assertFalse(os.path.exists(os.path.dirname(core2)))
+        # does not fail without a spool file
+        pr.discard_core_spool()
+
     def test_address_to_offset(self):
         '''_address_to_offset()'''
 
@@ -2062,6 +2542,14 @@ ffffffffff600000-ffffffffff601000 r-xp 00000000 00:00 0                  [vsysca
         self.assertEqual(pr._address_to_offset(0x7f491fc24010),
                          '/lib/with spaces !/libfoo.so+10')
 
+        # end of a mapping which is also the start of the next one
+        self.assertEqual(pr._address_to_offset(0x7f491fc24000),
+                         '/lib/x86_64-linux-gnu/libc-2.13.so+195000')
+
+        # batch resolution
+        self.assertEqual(pr._addresses_to_offsets([0x7f491fc24010, 0x10, 0x41d703]),
+                         ['/lib/with spaces !/libfoo.so+10', None, '/bin/bash+1d703'])
+
     def test_address_to_offset_arm(self):
         '''_address_to_offset() for ARM /proc/pid/maps'''
 
@@ -2189,6 +2677,14 @@ No symbol table info available.
 '''
         self.assertEqual(pr.crash_signature_addresses(), None)
 
+        # only the top 15 resolved frames are considered, the rest is not
+        # looked at
+        frames = ['#%i  0x00000000004%05x in ?? ()' % (i, i) for i in range(17)]
+        frames.insert(3, '#99 0x0000010000000000 in ?? ()')
+        pr['Stacktrace'] = '\n'.join(frames + ['#17 0xgarbage in ?? ()'])
+        sig = pr.crash_signature_addresses()
+        self.assertEqual(sig, '/bin/bash:42:' + ':'.join('/bin/bash+%x' % i for i in range(15)))
+
     def test_missing_uid(self):
         '''check_ignored() works for removed user'''
 
@@ -0,0 +1,273 @@
+import unittest, tempfile, threading, os, sys
+
+if sys.version_info.major == 2:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import apport.resumable_upload
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''Request handler of StandInServer'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, headers={}):
+        self.send_response(status)
+        self.send_header('Tus-Resumable', apport.resumable_upload.tus_version)
+        self.send_header('Content-Length', '0')
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def upload_headers(self, upload, token=True):
+        headers = {'Upload-Offset': str(len(upload['data']))}
+        if upload['length'] is not None:
+            headers['Upload-Length'] = str(upload['length'])
+            if token and len(upload['data']) == upload['length']:
+                headers['X-Launchpad-Blob-Token'] = 'token%i' % upload['id']
+        return headers
+
+    def injected_failure(self):
+        '''Answer with an injected error status, if one is pending'''
+
+        with self.server.lock:
+            self.server.requests.append(self.command)
+            for (i, (method, status)) in enumerate(self.server.errors):
+                if method == self.command:
+                    del self.server.errors[i]
+                    break
+            else:
+                return False
+        # discard the body, to keep the connection usable
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply(status)
+        return True
+
+    def do_POST(self):
+        if self.injected_failure():
+            return
+        assert self.headers['Tus-Resumable'] == apport.resumable_upload.tus_version
+        upload = {'id': len(self.server.uploads), 'data': bytearray(), 'length': None}
+        if self.headers.get('Upload-Defer-Length') != '1':
+            upload['length'] = int(self.headers['Upload-Length'])
+        self.server.uploads.append(upload)
+        self.reply(201, {'Location': '/files/%i' % upload['id']})
+
+    def do_HEAD(self):
+        if self.injected_failure():
+            return
+        upload = self.server.uploads[int(self.path.split('/')[-1])]
+        # upload_url servers only need to send the token in PATCH responses
+        self.reply(200, self.upload_headers(upload, token=False))
+
+    def do_PATCH(self):
+        if self.injected_failure():
+            return
+        upload = self.server.uploads[int(self.path.split('/')[-1])]
+        size = int(self.headers['Content-Length'])
+        if int(self.headers['Upload-Offset']) != len(upload['data']):
+            self.rfile.read(size)
+            self.reply(409)
+            return
+        if 'Upload-Length' in self.headers:
+            if upload['length'] is not None:
+                # the length must not be declared again
+                self.rfile.read(size)
+                self.reply(400)
+                return
+            upload['length'] = int(self.headers['Upload-Length'])
+
+        if self.server.drops:
+            # store only a part of the data, or all of it but do not answer,
+            # and drop the connection
+            keep = min(self.server.drops.pop(0), size)
+            upload['data'] += self.rfile.read(keep)
+            self.server.received += keep
+            self.close_connection = True
+            return
+
+        upload['data'] += self.rfile.read(size)
+        self.server.received += size
+        self.reply(204, self.upload_headers(upload))
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    '''Local stand-in for a resumable upload server.
+
+    This implements what a server behind the "upload_url" crashdb option
+    must provide (see doc/crashdb-conf.txt): the tus core protocol with the
+    creation and creation-defer-length extensions, and the Launchpad blob
+    token in the X-Launchpad-Blob-Token header of the response to a PATCH
+    request which completes an upload, or is sent to a completed upload
+    (with an empty body). HEAD responses do not need to have it.
+
+    Failures can be injected: errors is a list of (method, HTTP status) pairs
+    to answer the next requests of these methods with; drops is a list of
+    byte counts after which the next PATCH requests store only that much
+    data and drop the connection.
+    '''
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.uploads = []
+        self.requests = []
+        self.errors = []
+        self.drops = []
+        self.received = 0
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def url(self):
+        return 'http://127.0.0.1:%i/files/' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.thread.join()
+        self.server_close()
+
+
+class T(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.orig_chunk_size = apport.resumable_upload.chunk_size
+        apport.resumable_upload.chunk_size = 100000
+        self.data = os.urandom(1048576)
+        self.progress = []
+
+    def tearDown(self):
+        apport.resumable_upload.chunk_size = self.orig_chunk_size
+        self.server.stop()
+
+    def blocks(self, data, size=30000):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    def upload(self, blob, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return apport.resumable_upload.upload(
+            self.server.url(), blob, lambda sent, total: self.progress.append((sent, total)),
+            **kwargs)
+
+    def test_upload_generated(self):
+        '''upload() of generated data with unknown size'''
+
+        headers = self.upload(self.blocks(self.data))
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token0')
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        self.assertEqual(self.server.uploads[0]['length'], len(self.data))
+        self.assertEqual(self.server.requests, ['POST'] + ['PATCH'] * 11)
+
+        # progress is reported in blocks, and at the end
+        self.assertGreater(len(self.progress), 11)
+        self.assertEqual(self.progress, sorted(self.progress))
+        self.assertEqual(self.progress[-1], (len(self.data), None))
+
+    def test_upload_file(self):
+        '''upload() of a file with known size'''
+
+        with tempfile.TemporaryFile() as f:
+            f.write(self.data)
+            f.seek(0)
+            headers = self.upload(f)
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token0')
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        self.assertEqual(self.progress[-1], (len(self.data), len(self.data)))
+
+    def test_upload_empty(self):
+        '''upload() of empty data'''
+
+        headers = self.upload([])
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token0')
+        self.assertEqual(self.server.uploads[0]['length'], 0)
+
+    def test_resume(self):
+        '''upload() continues after dropped connections'''
+
+        self.server.drops = [50000, 0, 99999, 70000]
+        headers = self.upload(self.blocks(self.data))
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token0')
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        # data which the server got is not sent again
+        self.assertEqual(self.server.received, len(self.data))
+        self.assertEqual(self.server.requests.count('HEAD'), 4)
+        self.assertEqual(self.progress[-1], (len(self.data), None))
+
+    def test_resume_final(self):
+        '''upload() recovers from lost responses'''
+
+        self.data = self.data[:150000]
+        # the server gets all data of both chunks, but does not answer; an
+        # empty request gets the final response again
+        self.server.drops = [100000, 50000]
+        headers = self.upload(self.blocks(self.data))
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token0')
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        self.assertEqual(self.server.requests, ['POST', 'PATCH', 'HEAD', 'PATCH', 'HEAD', 'PATCH'])
+        self.assertEqual(self.server.received, len(self.data))
+
+        # same with known size
+        self.server.drops = [100000, 50000]
+        with tempfile.TemporaryFile() as f:
+            f.write(self.data)
+            f.seek(0)
+            headers = self.upload(f)
+        self.assertEqual(headers['X-Launchpad-Blob-Token'], 'token1')
+        self.assertEqual(bytes(self.server.uploads[1]['data']), self.data)
+
+    def test_server_errors(self):
+        '''upload() retries after server errors'''
+
+        self.server.errors = [('POST', 503), ('POST', 500), ('PATCH', 503),
+                              ('HEAD', 409), ('HEAD', 503)]
+        self.upload(self.blocks(self.data))
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        self.assertEqual(self.server.requests[:9],
+                         ['POST', 'POST', 'POST', 'PATCH', 'HEAD', 'HEAD', 'HEAD', 'PATCH', 'PATCH'])
+
+    def test_retries_exhausted(self):
+        '''upload() gives up after too many failures in a row'''
+
+        self.server.errors = [('POST', 503)] * 10
+        self.assertRaises(apport.resumable_upload.UploadError, self.upload,
+                          self.blocks(self.data), retries=3)
+        # the first failure and 3 retries
+        self.assertEqual(self.server.requests, ['POST'] * 4)
+
+    def test_client_error(self):
+        '''upload() does not retry after client errors'''
+
+        self.server.errors = [('POST', 403)]
+        self.assertRaises(apport.resumable_upload.UploadError, self.upload,
+                          self.blocks(self.data))
+        self.assertEqual(self.server.requests, ['POST'])
+
+    def test_bounded_buffer(self):
+        '''upload() keeps at most a chunk of unconfirmed data'''
+
+        read = [0]
+        max_unconfirmed = [0]
+
+        def blocks():
+            for block in self.blocks(self.data):
+                unconfirmed = read[0] - len(self.server.uploads[0]['data'])
+                max_unconfirmed[0] = max(max_unconfirmed[0], unconfirmed)
+                read[0] += len(block)
+                yield block
+
+        self.server.drops = [30000]
+        self.upload(blocks())
+        self.assertEqual(bytes(self.server.uploads[0]['data']), self.data)
+        self.assertLessEqual(max_unconfirmed[0], apport.resumable_upload.chunk_size + 30000)
+
+
+if __name__ == '__main__':
+    unittest.main()